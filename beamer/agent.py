@@ -1,42 +1,69 @@
 import threading
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 import structlog
 import web3
 from eth_account.signers.local import LocalAccount
 from eth_typing import Address
-from web3.gas_strategies.rpc import rpc_gas_price_strategy
 from web3.middleware import construct_sign_and_send_raw_middleware, geth_poa_middleware
 
-from beamer.chain import ContractEventMonitor, EventProcessor
+from beamer.chain import ContractEventMonitor, EventProcessor, NewHeadsSubscription
 from beamer.contracts import DeploymentInfo, make_contracts
 from beamer.state_machine import Context
+from beamer.store import EventStore
 from beamer.tracker import Tracker
+from beamer.transactions import (
+    GasOracle,
+    NonceManager,
+    construct_gas_oracle_middleware,
+    construct_nonce_middleware,
+)
 from beamer.typing import URL, ChainId
-from beamer.util import TokenMatchChecker
+from beamer.util import SessionPool, TokenMatchChecker
 
 log = structlog.get_logger(__name__)
 
 
+@dataclass
+class ChainConfig:
+    rpc_url: URL
+    ws_url: Optional[URL] = None
+    rpc_timeout: float = 5
+
+
 @dataclass
 class Config:
     account: LocalAccount
     deployment_info: DeploymentInfo
-    l2a_rpc_url: URL
-    l2b_rpc_url: URL
+    # The chains served by the agent. Requests from any of them to any other
+    # are filled.
+    chains: list[ChainConfig]
     token_match_file: Path
     fill_wait_time: int
-
-
-def _make_web3(url: URL, account: LocalAccount) -> web3.Web3:
-    w3 = web3.Web3(web3.HTTPProvider(url, request_kwargs=dict(timeout=5)))
-    w3.eth.set_gas_price_strategy(rpc_gas_price_strategy)
+    sync_workers: int = 4
+    state_dir: Optional[Path] = None
+    rpc_pool_size: int = 10
+    approval_policy: str = "exact"
+
+
+def _make_web3(
+    url: URL, account: LocalAccount, sessions: SessionPool, timeout: float
+) -> tuple[web3.Web3, NonceManager]:
+    provider = web3.HTTPProvider(
+        url, request_kwargs=dict(timeout=timeout), session=sessions.get(url)
+    )
+    w3 = web3.Web3(provider)
     # Add POA middleware for geth POA chains, no/op for other chains
     w3.middleware_onion.inject(geth_poa_middleware, layer=0)
     w3.middleware_onion.add(construct_sign_and_send_raw_middleware(account))
+    # Added last so that the nonce and the fees are filled in before signing.
+    nonce_manager = NonceManager(w3, account.address)
+    w3.middleware_onion.add(construct_nonce_middleware(nonce_manager))
+    w3.middleware_onion.add(construct_gas_oracle_middleware(GasOracle(w3)))
     w3.eth.default_account = account.address
-    return w3
+    return w3, nonce_manager
 
 
 class Agent:
@@ -45,64 +72,118 @@ class Agent:
         self._stopped = threading.Event()
         self._stopped.set()
 
-        w3_l2a = _make_web3(config.l2a_rpc_url, config.account)
-        w3_l2b = _make_web3(config.l2b_rpc_url, config.account)
-
-        l2a_contracts_info = config.deployment_info[ChainId(w3_l2a.eth.chain_id)]
-        l2b_contracts_info = config.deployment_info[ChainId(w3_l2b.eth.chain_id)]
-
-        l2a_contracts = make_contracts(w3_l2a, l2a_contracts_info)
-        l2b_contracts = make_contracts(w3_l2b, l2b_contracts_info)
-
-        request_manager = l2a_contracts["RequestManager"]
-        fill_manager = l2b_contracts["FillManager"]
-
-        if not fill_manager.functions.allowedLPs(config.account.address).call():
-            raise RuntimeError("Agent address is not whitelisted")
+        # All users of an endpoint, i.e. the contract event monitors and the
+        # transactions sent by the event processor, share its connections.
+        self._sessions = SessionPool(config.rpc_pool_size)
+        chains: dict[ChainId, tuple[ChainConfig, web3.Web3, NonceManager]] = {}
+        for chain_config in config.chains:
+            w3, nonce_manager = _make_web3(
+                chain_config.rpc_url, config.account, self._sessions, chain_config.rpc_timeout
+            )
+            chain_id = ChainId(w3.eth.chain_id)
+            # The same chain may be given more than once, e.g. as the source
+            # and the target chain.
+            if chain_id not in chains:
+                chains[chain_id] = chain_config, w3, nonce_manager
+
+        request_managers = {}
+        fill_managers = {}
+        contracts_infos = {}
+        for chain_id, (_, w3, _) in chains.items():
+            contracts_infos[chain_id] = config.deployment_info[chain_id]
+            contracts = make_contracts(w3, contracts_infos[chain_id])
+            request_managers[chain_id] = contracts["RequestManager"]
+            fill_managers[chain_id] = contracts["FillManager"]
+
+            if not fill_managers[chain_id].functions.allowedLPs(config.account.address).call():
+                raise RuntimeError(f"Agent address is not whitelisted on chain {chain_id}")
 
         with open(config.token_match_file, "r") as f:
             match_checker = TokenMatchChecker.from_file(f)
 
         self.context = Context(
             requests=Tracker(),
-            claims=Tracker(),
-            request_manager=request_manager,
-            fill_manager=fill_manager,
+            claims=Tracker(indexes=dict(request_key=lambda claim: claim.request_key)),
+            request_managers=request_managers,
+            fill_managers=fill_managers,
             match_checker=match_checker,
             fill_wait_time=config.fill_wait_time,
             address=config.account.address,
             latest_blocks={},
+            approval_policy=config.approval_policy,
         )
-        self._event_processor = EventProcessor(self.context)
-
-        self._contract_monitor_l2a = ContractEventMonitor(
-            "RequestManager",
-            request_manager,
-            l2a_contracts_info["RequestManager"].deployment_block,
-            self._event_processor.add_events,
-            self._event_processor.mark_sync_done,
-        )
-
-        self._contract_monitor_l2b = ContractEventMonitor(
-            "FillManager",
-            fill_manager,
-            l2b_contracts_info["FillManager"].deployment_block,
-            self._event_processor.add_events,
-            self._event_processor.mark_sync_done,
+        for _, w3, nonce_manager in chains.values():
+            self.context.transactions.add_nonce_manager(w3, nonce_manager)
+        self._store = None
+        if config.state_dir is not None:
+            config.state_dir.mkdir(parents=True, exist_ok=True)
+            self._store = EventStore(config.state_dir / "events.db")
+
+        # One monitor per chain and contract, all feeding the same processor.
+        self._event_processor = EventProcessor(
+            self.context, self._store, num_monitors=2 * len(chains)
         )
+        self._contract_monitors = []
+        # Both monitors of a chain share its newHeads subscription.
+        self._new_heads_subscriptions = []
+        for chain_id, (chain_config, _, _) in chains.items():
+            new_heads = None
+            if chain_config.ws_url is not None:
+                new_heads = NewHeadsSubscription(chain_config.ws_url)
+                self._new_heads_subscriptions.append(new_heads)
+            self._contract_monitors.append(
+                ContractEventMonitor(
+                    f"RequestManager-{chain_id}",
+                    request_managers[chain_id],
+                    contracts_infos[chain_id]["RequestManager"].deployment_block,
+                    self._event_processor.add_events,
+                    self._event_processor.mark_sync_done,
+                    config.sync_workers,
+                    self._store,
+                    new_heads,
+                )
+            )
+            self._contract_monitors.append(
+                ContractEventMonitor(
+                    f"FillManager-{chain_id}",
+                    fill_managers[chain_id],
+                    contracts_infos[chain_id]["FillManager"].deployment_block,
+                    self._event_processor.add_events,
+                    self._event_processor.mark_sync_done,
+                    config.sync_workers,
+                    self._store,
+                    new_heads,
+                    balances=self.context.balances[chain_id],
+                )
+            )
 
     def start(self) -> None:
         assert self._stopped.is_set()
         self._event_processor.start()
-        self._contract_monitor_l2a.start()
-        self._contract_monitor_l2b.start()
+        for subscription in self._new_heads_subscriptions:
+            subscription.start()
+        for monitor in self._contract_monitors:
+            monitor.start()
         self._stopped.clear()
 
     def stop(self) -> None:
         assert not self._stopped.is_set()
         self._event_processor.stop()
-        self._contract_monitor_l2a.stop()
-        self._contract_monitor_l2b.stop()
+        for monitor in self._contract_monitors:
+            monitor.stop()
+        for subscription in self._new_heads_subscriptions:
+            subscription.stop()
+        self.context.transactions.shutdown()
+        if self._store is not None:
+            self._store.close()
+        for url, stats in self._sessions.stats().items():
+            log.info(
+                "HTTP connection stats",
+                url=url,
+                num_connections=stats.num_connections,
+                num_requests=stats.num_requests,
+            )
+        self._sessions.close()
         self._stopped.set()
 
     @property
@@ -1,3 +1,7 @@
+import asyncio
+import collections
+import enum
+import functools
 import json
 import os
 import pathlib
@@ -5,18 +9,34 @@ import sys
 import threading
 import time
 import traceback
-from typing import Any, Callable, Optional, cast
+from typing import Any, Callable, Iterable, Optional, Union, cast
 
 import requests.exceptions
 import structlog
 import web3
-from web3.types import TxParams
-
-from beamer.events import Event, EventFetcher
+from web3.types import TxParams, TxReceipt
+from websockets.client import connect as ws_connect
+from websockets.exceptions import WebSocketException
+
+from beamer.events import (
+    ClaimMade,
+    ClaimWithdrawn,
+    DepositWithdrawn,
+    Event,
+    EventFetcher,
+    LatestBlockUpdatedEvent,
+    RangeLimits,
+    RequestCreated,
+    RequestFilled,
+)
 from beamer.models.claim import Claim
 from beamer.models.request import Request
+from beamer.scheduler import DeadlineScheduler
 from beamer.state_machine import Context, process_event
-from beamer.typing import BlockNumber, ChainId
+from beamer.store import Checkpoint, EventStore, Snapshot
+from beamer.tokens import BalanceCache
+from beamer.transactions import succeeded
+from beamer.typing import URL, BlockNumber, ChainId, ChecksumAddress, ClaimKey, RequestKey
 
 log = structlog.get_logger(__name__)
 
@@ -30,10 +50,39 @@ def _load_ERC20_abi() -> list[Any]:
 
 _ERC20_ABI = _load_ERC20_abi()
 
+
+@functools.lru_cache(maxsize=1024)
+def _make_token(w3: web3.Web3, address: ChecksumAddress) -> web3.contract.Contract:
+    return w3.eth.contract(abi=_ERC20_ABI, address=address)
+
+
 # The time we're waiting for our thread in stop(), in seconds.
 # This is also the maximum time a call to stop() would block.
 _STOP_TIMEOUT = 2
 
+# The minimum time between two context snapshots, in seconds.
+_SNAPSHOT_INTERVAL = 60
+
+# The number of events the contract event monitors may queue before they have
+# to wait for the event processor. A monitor may exceed this by the events of
+# one block range.
+_MAX_QUEUED_EVENTS = 10_000
+
+# The time between two polls for new blocks, in seconds. This is used
+# if there is no newHeads subscription or the subscription is down.
+_POLL_INTERVAL = 1
+
+# The maximum time to wait for a newHeads notification before polling anyway,
+# in seconds. This guards against subscriptions that silently stopped working.
+_NEW_HEADS_TIMEOUT = 30
+
+# The time to wait before trying to re-establish a newHeads subscription, in seconds.
+_NEW_HEADS_RECONNECT_DELAY = 5
+
+# The time to wait before processing a request or claim again after a
+# transaction could not be sent, in seconds.
+_RETRY_DELAY = 5
+
 
 def _wrap_thread_func(func: Callable) -> Callable:
     def wrapper(*args, **kwargs):  # type: ignore
@@ -48,14 +97,113 @@ def _wrap_thread_func(func: Callable) -> Callable:
     return wrapper
 
 
+class NewHeadsSubscription:
+    """Subscribes to newHeads notifications of a WebSocket JSON-RPC endpoint,
+    so that waiting for a new block does not require polling.
+
+    One subscription can be shared by several waiters, e.g. the contract event
+    monitors of a chain. Each waiter remembers num_blocks before fetching and
+    then waits for it to change, so no notification is missed."""
+
+    def __init__(self, url: URL):
+        self._url = url
+        # Notified whenever self._num_blocks changes or we're stopping.
+        self._new_block = threading.Condition()
+        self._num_blocks = 0
+        self._connected = False
+        self._stop = False
+        self._log = structlog.get_logger(type(self).__name__).bind(url=url)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            name="NewHeadsSubscription", target=_wrap_thread_func(self._thread_func)
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop = True
+        self.wake_up()
+        self._thread.join(_STOP_TIMEOUT)
+
+    @property
+    def num_blocks(self) -> int:
+        """The number of notifications received so far."""
+        with self._new_block:
+            return self._num_blocks
+
+    def wait(self, num_blocks: int) -> None:
+        """Block until a new block arrived since num_blocks was read. Fall back
+        to polling, i.e. return after _POLL_INTERVAL, while the subscription
+        is not established."""
+        timeout = _NEW_HEADS_TIMEOUT if self._connected else _POLL_INTERVAL
+        with self._new_block:
+            self._new_block.wait_for(lambda: self._num_blocks != num_blocks or self._stop, timeout)
+
+    def wake_up(self) -> None:
+        """Wake up all waiters, as if a new block arrived."""
+        with self._new_block:
+            self._num_blocks += 1
+            self._new_block.notify_all()
+
+    def _thread_func(self) -> None:
+        self._log.info("NewHeadsSubscription started")
+        asyncio.run(self._run())
+        self._log.info("NewHeadsSubscription stopped")
+
+    async def _run(self) -> None:
+        while not self._stop:
+            try:
+                await self._subscribe()
+            except (OSError, asyncio.TimeoutError, WebSocketException) as exc:
+                self._log.warning("newHeads subscription failed", exc=exc)
+            if self._connected:
+                self._connected = False
+                # Wake up the waiting monitors so they can switch to polling right away.
+                self.wake_up()
+
+            deadline = time.monotonic() + _NEW_HEADS_RECONNECT_DELAY
+            while not self._stop and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+
+    async def _subscribe(self) -> None:
+        async with ws_connect(self._url) as ws:
+            request = dict(jsonrpc="2.0", id=1, method="eth_subscribe", params=["newHeads"])
+            await ws.send(json.dumps(request))
+            response = await asyncio.wait_for(ws.recv(), _STOP_TIMEOUT)
+            try:
+                subscription_id = json.loads(response)["result"]
+            except (ValueError, KeyError, TypeError) as exc:
+                # Without a subscription the waiters keep polling.
+                self._log.warning("newHeads subscription rejected", response=response, exc=exc)
+                return
+
+            self._log.info("Subscribed to newHeads", subscription_id=subscription_id)
+            self._connected = True
+            while not self._stop:
+                try:
+                    # Use a short timeout so that we notice stop requests in time.
+                    await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                self.wake_up()
+
+
 class ContractEventMonitor:
     def __init__(
         self,
         name: str,
         contract: web3.contract.Contract,
         deployment_block: BlockNumber,
-        on_new_events: Callable[[list[Event]], None],
+        on_new_events: Callable[[list[Event], Checkpoint], None],
         on_sync_done: Callable[[], None],
+        sync_workers: int = 1,
+        store: Optional[EventStore] = None,
+        new_heads: Optional[NewHeadsSubscription] = None,
+        balances: Optional[BalanceCache] = None,
     ):
         self._name = name
         self._contract = contract
@@ -63,6 +211,11 @@ class ContractEventMonitor:
         self._stop = False
         self._on_new_events = on_new_events
         self._on_sync_done = on_sync_done
+        self._sync_workers = sync_workers
+        self._store = store
+        self._new_heads = new_heads
+        self._balances = balances
+        self._saved_range_limits: Optional[RangeLimits] = None
         self._log = structlog.get_logger(type(self).__name__).bind(contract=name)
 
     def start(self) -> None:
@@ -73,6 +226,10 @@ class ContractEventMonitor:
 
     def stop(self) -> None:
         self._stop = True
+        # Wake up our thread if it is waiting for a new block. The subscription
+        # may be shared, it is started and stopped by its owner.
+        if self._new_heads is not None:
+            self._new_heads.wake_up()
         self._thread.join(_STOP_TIMEOUT)
 
     def _thread_func(self) -> None:
@@ -80,46 +237,144 @@ class ContractEventMonitor:
         self._log.info(
             "ContractEventMonitor started", chain_id=chain_id, address=self._contract.address
         )
-        fetcher = EventFetcher(self._name, self._contract, self._deployment_block)
-        events = fetcher.fetch()
-        if events:
-            self._on_new_events(events)
+        start_block = self._deployment_block
+        if self._store is not None:
+            events, next_block = self._store.load(chain_id, self._contract.address)
+            if next_block is not None:
+                start_block = next_block
+                self._on_new_events(events, self._make_checkpoint(chain_id, next_block))
+
+        endpoint = getattr(self._contract.web3.provider, "endpoint_uri", None)
+        range_limits = None
+        if self._store is not None and endpoint is not None:
+            range_limits = self._store.load_range_limits(endpoint)
+            self._saved_range_limits = range_limits
+
+        fetcher = EventFetcher(self._name, self._contract, start_block, range_limits)
+        # Hand over the events of each block range as soon as it is fetched,
+        # rather than collecting the whole history first.
+        on_events = functools.partial(self._handle_fetched, chain_id, fetcher)
+        events = fetcher.fetch(self._sync_workers, on_events)
+        self._handle_fetched(chain_id, fetcher, events)
         self._on_sync_done()
         self._log.info("Sync done", chain_id=chain_id)
         while not self._stop:
-            events = fetcher.fetch()
-            if events:
-                self._on_new_events(events)
-            # TODO: wait for new block instead of the sleep here
-            time.sleep(1)
+            # Read before fetching, so that a block announced while fetching
+            # is not missed.
+            num_blocks = 0 if self._new_heads is None else self._new_heads.num_blocks
+            events = fetcher.fetch(on_events=on_events)
+            self._handle_fetched(chain_id, fetcher, events)
+            if self._new_heads is None:
+                time.sleep(_POLL_INTERVAL)
+            else:
+                self._new_heads.wait(num_blocks)
         self._log.info("ContractEventMonitor stopped", chain_id=chain_id)
 
+    def _make_checkpoint(self, chain_id: ChainId, next_block: BlockNumber) -> Checkpoint:
+        return Checkpoint(chain_id=chain_id, address=self._contract.address, next_block=next_block)
+
+    def _handle_fetched(
+        self, chain_id: ChainId, fetcher: EventFetcher, events: list[Event]
+    ) -> None:
+        if not events:
+            return
+        checkpoint = self._make_checkpoint(chain_id, fetcher.next_block_number)
+        if self._store is not None:
+            self._store.append(events, checkpoint)
+            self._save_range_limits(fetcher)
+        self._on_new_events(events, checkpoint)
+
+        # Refresh the balances here, so that deciding whether a request can
+        # be filled does not require fetching them.
+        if isinstance(events[-1], LatestBlockUpdatedEvent) and self._balances is not None:
+            self._balances.refresh()
+
+    def _save_range_limits(self, fetcher: EventFetcher) -> None:
+        assert self._store is not None
+        endpoint = getattr(self._contract.web3.provider, "endpoint_uri", None)
+        range_limits = fetcher.range_limits
+        if endpoint is not None and range_limits != self._saved_range_limits:
+            self._store.save_range_limits(endpoint, range_limits)
+            self._saved_range_limits = range_limits
+
+
+# Identifies the request or claim an event refers to, e.g. ("request", (2, 3))
+# for request 3 of the RequestManager on chain 2.
+_EntityKey = tuple[str, Union[RequestKey, ClaimKey]]
+
+# The clock of deadlines that are not based on the block time of a chain.
+_WALL_CLOCK = None
+
+
+def _entity_key(event: Event) -> Optional[_EntityKey]:
+    if isinstance(event, (RequestCreated, RequestFilled, DepositWithdrawn)):
+        return "request", event.request_key
+    if isinstance(event, (ClaimMade, ClaimWithdrawn)):
+        return "claim", event.claim_key
+    return None
+
 
 class EventProcessor:
-    def __init__(self, context: Context):
+    def __init__(
+        self,
+        context: Context,
+        store: Optional[EventStore] = None,
+        max_queued_events: int = _MAX_QUEUED_EVENTS,
+        num_monitors: int = 2,
+    ):
         # This lock protects the following objects:
         #   - self._events
+        #   - self._checkpoints
         #   - self._num_syncs_done
         self._lock = threading.Lock()
+        # Notified when events were taken from self._events or we're stopping.
+        self._events_taken = threading.Condition(self._lock)
         self._have_new_events = threading.Event()
         self._events: list[Event] = []
+        self._max_queued_events = max_queued_events
+        # Events that could not be processed yet, keyed by the request or claim
+        # they depend on, along with the entity's state when they were parked.
+        # They are only retried once that entity is created or changes state.
+        # Only accessed by the event processor thread.
+        self._parked: dict[_EntityKey, tuple[Optional[enum.Enum], list[Event]]] = {}
+        # Requests and claims that need to be looked at by process_requests
+        # and process_claims, because an event changed them or an earlier
+        # attempt to act on them has not finished yet.
+        self._dirty_requests: set[RequestKey] = set()
+        self._dirty_claims: set[ClaimKey] = set()
+        # Request expiries and claim terminations, by the block time of the
+        # chain they are checked against, and challenge back-offs by wall
+        # clock time (_WALL_CLOCK). Once due, the entity is marked dirty.
+        self._deadlines: DeadlineScheduler[Optional[ChainId], _EntityKey] = DeadlineScheduler()
+        # The latest checkpoint per chain and contract, i.e. all events before
+        # the checkpoint's block are either in self._events or processed.
+        self._checkpoints: dict[tuple[ChainId, ChecksumAddress], Checkpoint] = {}
+        self._store = store
+        self._last_snapshot_time = time.monotonic()
         self._stop = False
         self._log = structlog.get_logger(type(self).__name__)
-        # The number of times we synced with a chain:
-        # 0 = we're still waiting for sync to complete for both chains
-        # 1 = one of the chains was synced, waiting for the other one
-        # 2 = both chains synced
+        # The number of contract event monitors that finished their initial
+        # sync. Requests and claims are only processed once all of them did.
         self._num_syncs_done = 0
+        self._num_monitors = num_monitors
         self._context = context
 
+        # Receipts arriving should wake up the event processor thread.
+        context.transactions.set_wakeup(self._have_new_events.set)
+
+        if store is not None:
+            snapshot = store.load_snapshot()
+            if snapshot is not None:
+                self._restore_snapshot(snapshot)
+
     @property
     def _synced(self) -> bool:
         with self._lock:
-            return self._num_syncs_done == 2
+            return self._num_syncs_done == self._num_monitors
 
     def mark_sync_done(self) -> None:
         with self._lock:
-            assert self._num_syncs_done < 2
+            assert self._num_syncs_done < self._num_monitors
             self._num_syncs_done += 1
 
     def start(self) -> None:
@@ -130,59 +385,245 @@ class EventProcessor:
 
     def stop(self) -> None:
         self._stop = True
+        with self._lock:
+            self._events_taken.notify_all()
         self._thread.join(_STOP_TIMEOUT)
 
-    def add_events(self, events: list[Event]) -> None:
+    def add_events(self, events: list[Event], checkpoint: Checkpoint) -> None:
+        """Queue events for processing. If the queue is full, this blocks until
+        the event processor has caught up, so that the contract event monitors
+        don't fetch events faster than they can be processed."""
         with self._lock:
+            while len(self._events) >= self._max_queued_events and not self._stop:
+                self._events_taken.wait()
             self._events.extend(events)
+            self._checkpoints[checkpoint.chain_id, checkpoint.address] = checkpoint
             self._log.debug("New events", events=events)
         self._have_new_events.set()
 
     def _thread_func(self) -> None:
         self._log.info("EventProcessor started")
         while not self._stop:
-            if self._have_new_events.wait(1):
+            if self._have_new_events.wait(self._wait_timeout()):
                 self._have_new_events.clear()
                 self._process_events()
 
             if self._synced:
-                process_requests(self._context)
-                process_claims(self._context)
-
+                self._process_receipts()
+                self._mark_due_dirty()
+                self._mark_affordable_dirty()
+                self._process_dirty()
+
+            if (
+                self._store is not None
+                and time.monotonic() - self._last_snapshot_time >= _SNAPSHOT_INTERVAL
+            ):
+                self._save_snapshot(self._store)
+
+        if self._store is not None:
+            self._save_snapshot(self._store)
         self._log.info("EventProcessor stopped")
 
-    def _process_events(self) -> None:
-        iteration = 0
-        while True:
-            with self._lock:
-                events = self._events[:]
-
-            unprocessed = []
-            any_state_changed = False
-            for event in events:
-                state_changed = process_event(event, self._context)
-                any_state_changed |= state_changed
-                if not state_changed:
-                    unprocessed.append(event)
-
-            # Return the unprocessed events to the event list.
-            # Note that the event list might have been changed in the meantime
-            # by one of the event monitors. Placing unprocessed events at the
-            # back of the list, as opposed to the front, may avoid an extra
-            # iteration over all events.
+    def _save_snapshot(self, store: EventStore) -> None:
+        # The context is only modified by this thread so it is consistent
+        # with the pending events and checkpoints taken here.
+        with self._lock:
+            events = [event for _, parked in self._parked.values() for event in parked]
+            events.extend(self._events)
+            checkpoints = list(self._checkpoints.values())
+        snapshot = Snapshot(
+            requests=list(self._context.requests),
+            claims=list(self._context.claims),
+            events=events,
+            checkpoints=checkpoints,
+            latest_request_ids=dict(self._context.latest_request_ids),
+        )
+        store.save_snapshot(snapshot)
+        self._last_snapshot_time = time.monotonic()
+
+    def _restore_snapshot(self, snapshot: Snapshot) -> None:
+        for request in snapshot.requests:
+            self._context.requests.add(request.key, request)
+            self._dirty_requests.add(request.key)
+        for claim in snapshot.claims:
+            self._context.claims.add(claim.key, claim)
+            self._dirty_claims.add(claim.key)
+        self._context.latest_request_ids.update(snapshot.latest_request_ids)
+        with self._lock:
+            self._events.extend(snapshot.events)
+            for checkpoint in snapshot.checkpoints:
+                self._checkpoints[checkpoint.chain_id, checkpoint.address] = checkpoint
+
+    def _entity_state(self, key: _EntityKey) -> Optional[enum.Enum]:
+        kind, entity_key = key
+        entity: Union[Request, Claim, None]
+        if kind == "request":
+            entity = self._context.requests.get(cast(RequestKey, entity_key))
+        else:
+            entity = self._context.claims.get(cast(ClaimKey, entity_key))
+        return None if entity is None else entity.state
+
+    def _parking_key(self, event: Event) -> _EntityKey:
+        # A claim waits for its request, if that is not tracked yet.
+        if isinstance(event, ClaimMade) and event.request_key not in self._context.requests:
+            return "request", event.request_key
+        key = _entity_key(event)
+        assert key is not None
+        return key
+
+    def _park(self, key: _EntityKey, event: Event) -> None:
+        state, parked = self._parked.get(key, (None, []))
+        if not parked:
+            state = self._entity_state(key)
+        parked.append(event)
+        self._parked[key] = state, parked
+
+    def _release_changed_entities(self, keys: Iterable[_EntityKey]) -> None:
+        """Requeue the parked events of those of the given requests and claims
+        that changed state outside of event processing, e.g. in process_requests."""
+        released = []
+        for key in keys:
+            entry = self._parked.get(key)
+            if entry is not None and self._entity_state(key) != entry[0]:
+                del self._parked[key]
+                released.extend(entry[1])
+        if released:
             with self._lock:
-                del self._events[: len(events)]
-                self._events.extend(unprocessed)
-
-            self._log.debug(
-                "Finished iteration",
-                iteration=iteration,
-                any_state_changed=any_state_changed,
-                num_events=len(self._events),
-            )
-            iteration += 1
-            if not any_state_changed:
-                break
+                self._events[:0] = released
+            self._have_new_events.set()
+
+    def _wait_timeout(self) -> float:
+        # Wake up in time for the next back-off to end. Block time deadlines
+        # are checked whenever a new block arrives.
+        timeout = 1.0
+        deadline = self._deadlines.next_deadline(_WALL_CLOCK)
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - time.time()))
+        return timeout
+
+    def _mark_key_dirty(self, key: _EntityKey) -> None:
+        kind, entity_key = key
+        if kind == "request":
+            self._dirty_requests.add(cast(RequestKey, entity_key))
+        else:
+            self._dirty_claims.add(cast(ClaimKey, entity_key))
+
+    def _mark_due_dirty(self) -> None:
+        due = self._deadlines.pop_due(_WALL_CLOCK, int(time.time()))
+        for chain_id, block in self._context.latest_blocks.items():
+            due.extend(self._deadlines.pop_due(chain_id, block.timestamp))
+        for key in due:
+            self._mark_key_dirty(key)
+
+    def _mark_affordable_dirty(self) -> None:
+        # Pending requests are not retried while the agent cannot afford to
+        # fill them, only once the balance of their target token went up.
+        increased = {
+            (chain_id, token_address)
+            for chain_id, balances in self._context.balances.items()
+            for token_address in balances.pop_increased()
+        }
+        if not increased:
+            return
+        for request in self._context.requests:
+            if (
+                request.is_pending
+                and (request.target_chain_id, request.target_token_address) in increased
+            ):
+                self._dirty_requests.add(request.key)
+
+    def _process_receipts(self) -> None:
+        # The receipt callbacks may change requests and claims, which then
+        # need to be looked at again.
+        for key in self._context.transactions.process_completed():
+            self._mark_key_dirty(cast(_EntityKey, key))
+
+    def _schedule_deadlines(
+        self, request_keys: Iterable[RequestKey], claim_keys: Iterable[ClaimKey]
+    ) -> None:
+        for request_key in request_keys:
+            request = self._context.requests.get(request_key)
+            if request is None:
+                continue
+            # Expired requests are ignored by fill_request and claim_request.
+            if request.is_pending:
+                self._deadlines.schedule(
+                    request.target_chain_id, request.valid_until, ("request", request.key)
+                )
+            elif request.is_filled and request.filler == self._context.address:
+                self._deadlines.schedule(
+                    request.source_chain_id, request.valid_until, ("request", request.key)
+                )
+
+        for claim_key in claim_keys:
+            claim = self._context.claims.get(claim_key)
+            if claim is None or not (claim.is_claimer_winning or claim.is_challenger_winning):
+                continue
+            # Claims are made on the source chain of their request.
+            key = "claim", claim.key
+            self._deadlines.schedule(claim.chain_id, claim.termination, key)
+            if claim.challenge_back_off_timestamp > time.time():
+                self._deadlines.schedule(_WALL_CLOCK, claim.challenge_back_off_timestamp, key)
+
+    def _process_dirty(self) -> None:
+        dirty_requests, self._dirty_requests = self._dirty_requests, set()
+        dirty_claims, self._dirty_claims = self._dirty_claims, set()
+        to_retry: list[_EntityKey] = [
+            ("request", key) for key in process_requests(self._context, sorted(dirty_requests))
+        ]
+        to_retry.extend(
+            ("claim", key) for key in process_claims(self._context, sorted(dirty_claims))
+        )
+        retry_at = int(time.time()) + _RETRY_DELAY
+        for key in to_retry:
+            self._deadlines.schedule(_WALL_CLOCK, retry_at, key)
+        self._schedule_deadlines(dirty_requests, dirty_claims)
+        # Only the processed requests and claims can have changed state.
+        processed: list[_EntityKey] = [("request", key) for key in dirty_requests]
+        processed.extend(("claim", key) for key in dirty_claims)
+        self._release_changed_entities(processed)
+
+    def _mark_dirty(self, event: Event) -> None:
+        if isinstance(event, (RequestCreated, RequestFilled, DepositWithdrawn)):
+            self._dirty_requests.add(event.request_key)
+            if isinstance(event, RequestFilled):
+                # Whether a claim is honest depends on the fill.
+                for claim in self._context.claims.find("request_key", event.request_key):
+                    self._dirty_claims.add(claim.key)
+        elif isinstance(event, (ClaimMade, ClaimWithdrawn)):
+            self._dirty_claims.add(event.claim_key)
+            # A withdrawn request can be removed once all its claims are withdrawn.
+            self._dirty_requests.add(event.request_key)
+
+    def _process_events(self) -> None:
+        with self._lock:
+            queue = collections.deque(self._events)
+            self._events.clear()
+            self._events_taken.notify_all()
+
+        num_processed = 0
+        while queue:
+            event = queue.popleft()
+            key = _entity_key(event)
+            num_processed += 1
+            if not process_event(event, self._context):
+                # The event depends on a request or claim that doesn't exist
+                # yet or is in the wrong state. Only retry it once that changes.
+                self._park(self._parking_key(event), event)
+                continue
+
+            self._mark_dirty(event)
+            if key is not None and key in self._parked:
+                # Retry the events waiting for this entity right away so that
+                # they are processed before any later events.
+                _, parked = self._parked.pop(key)
+                queue.extendleft(reversed(parked))
+
+        self._log.debug(
+            "Processed events",
+            num_processed=num_processed,
+            num_parked=sum(len(parked) for _, parked in self._parked.values()),
+        )
 
 
 class _TransactionFailed(Exception):
@@ -203,42 +644,72 @@ def _transact(func: web3.contract.ContractFunction, **kwargs: Any) -> web3.types
         raise _TransactionFailed() from exc
 
 
-def process_requests(context: Context) -> None:
-    log.info("Processing requests", num_requests=len(context.requests))
+def process_requests(
+    context: Context, request_keys: Optional[Iterable[RequestKey]] = None
+) -> set[RequestKey]:
+    """Process the given requests, or all requests if request_keys is None.
+    Returns the keys of the requests that need to be processed again, even if
+    no new event arrives for them, because a transaction could not be sent."""
+    if request_keys is None:
+        requests = list(context.requests)
+    else:
+        requests = [r for r in map(context.requests.get, request_keys) if r is not None]
+    log.info("Processing requests", num_requests=len(requests))
 
     to_remove = []
-    for request in context.requests:
+    to_retry = set()
+    for request in requests:
         log.debug("Processing request", request=request)
 
+        key = "request", request.key
+        if context.transactions.in_flight(key):
+            # The request will be processed again once the receipt arrives.
+            continue
+
         if request.is_pending:
-            fill_request(request, context)
+            if fill_request(request, context):
+                to_retry.add(request.key)
 
         elif request.is_filled:
-            claim_request(request, context)
+            if claim_request(request, context):
+                to_retry.add(request.key)
 
         elif request.is_withdrawn:
-            active_claims = any(claim.request_id == request.id for claim in context.claims)
+            active_claims = any(
+                not claim.is_withdrawn for claim in context.claims.find("request_key", request.key)
+            )
             if not active_claims:
                 log.debug("Removing withdrawn request", request=request)
-                to_remove.append(request.id)
+                to_remove.append(request.key)
 
-    for request_id in to_remove:
-        context.requests.remove(request_id)
+    for request_key in to_remove:
+        context.requests.remove(request_key)
+    return to_retry
 
 
-def process_claims(context: Context) -> None:
-    log.info("Processing claims", num_claims=len(context.claims))
+def process_claims(
+    context: Context, claim_keys: Optional[Iterable[ClaimKey]] = None
+) -> set[ClaimKey]:
+    """Process the given claims, or all claims if claim_keys is None.
+    Returns the keys of the claims that need to be processed again, even if
+    no new event arrives for them, e.g. because a transaction failed."""
+    if claim_keys is None:
+        claims = list(context.claims)
+    else:
+        claims = [c for c in map(context.claims.get, claim_keys) if c is not None]
+    log.info("Processing claims", num_claims=len(claims))
 
     to_remove = []
-    for claim in context.claims:
+    to_retry = set()
+    for claim in claims:
         log.debug("Processing claim", claim=claim)
 
         if claim.is_withdrawn:
             log.debug("Removing withdrawn claim", claim=claim)
-            to_remove.append(claim.id)
+            to_remove.append(claim.key)
             continue
 
-        request = context.requests.get(claim.request_id)
+        request = context.requests.get(claim.request_key)
         # As per definition an invalid or expired request cannot be claimed
         # This gives us a chronological order. The agent should never garbage collect
         # a request which has active claims
@@ -251,42 +722,72 @@ def process_claims(context: Context) -> None:
             continue
 
         if claim.transaction_pending:
+            # The claim will be processed again once the event of the
+            # transaction arrives.
             continue
 
-        block = context.latest_blocks[request.source_chain_id]
-        if block["timestamp"] >= claim.termination:
+        block = context.latest_blocks.get(claim.chain_id)
+        if block is None:
+            # The block time of the chain is not known yet.
+            to_retry.add(claim.key)
+            continue
+        terminated = block.timestamp >= claim.termination
+        if terminated:
             withdraw(claim, context)
 
         if claim.is_claimer_winning or claim.is_challenger_winning:
             maybe_challenge(claim, context)
 
-    for claim_id in to_remove:
-        context.claims.remove(claim_id)
-
-
-def fill_request(request: Request, context: Context) -> None:
-    block = context.latest_blocks[request.target_chain_id]
-    if block["timestamp"] >= request.valid_until:
+        # Retry failed transactions. Otherwise, the claim is waiting for its
+        # termination or the challenge back-off, or for the other party.
+        challenge_due = (
+            int(time.time()) >= claim.challenge_back_off_timestamp
+            and claim.get_winning_address() != context.address
+        )
+        if (terminated or challenge_due) and not claim.transaction_pending:
+            to_retry.add(claim.key)
+
+    for claim_key in to_remove:
+        context.claims.remove(claim_key)
+    return to_retry
+
+
+def fill_request(request: Request, context: Context) -> bool:
+    """Try to fill the request. Returns whether it should be tried again later.
+    A request the agent cannot afford to fill is not retried, see BalanceCache."""
+    block = context.latest_blocks.get(request.target_chain_id)
+    if block is None:
+        log.debug("Latest block of target chain unknown", request=request)
+        return True
+    if block.timestamp >= request.valid_until:
         log.info("Request expired, ignoring", request=request)
         request.ignore()
-        return
+        return False
 
-    w3 = context.fill_manager.web3
-    token = w3.eth.contract(abi=_ERC20_ABI, address=request.target_token_address)
-    address = w3.eth.default_account
-    balance = token.functions.balanceOf(address).call()
+    fill_manager = context.fill_managers[request.target_chain_id]
+    w3 = fill_manager.web3
+    token = _make_token(w3, request.target_token_address)
+    balances = context.balances[request.target_chain_id]
+    balance = balances.available(token, context.address)
     if balance < request.amount:
         log.debug("Unable to fill request", balance=balance, request_amount=request.amount)
-        return
-
-    func = token.functions.approve(context.fill_manager.address, request.amount)
-    try:
-        _transact(func)
-    except _TransactionFailed as exc:
-        log.error("approve failed", request_id=request.id, cause=exc.cause())
-        return
+        return False
 
-    func = context.fill_manager.functions.fillRequest(
+    allowances = context.allowances[request.target_chain_id]
+    spender = fill_manager.address
+    if not allowances.covers(token, context.address, spender, request.amount):
+        amount = allowances.approval_amount(request.amount)
+        func = token.functions.approve(spender, amount)
+        try:
+            _transact(func)
+        except _TransactionFailed as exc:
+            log.error("approve failed", request_id=request.id, cause=exc.cause())
+            allowances.invalidate(token.address)
+            return True
+        # The fill is sent right away, its nonce orders it after the approval.
+        allowances.approved(token.address, amount)
+
+    func = fill_manager.functions.fillRequest(
         requestId=request.id,
         sourceChainId=request.source_chain_id,
         targetTokenAddress=request.target_token_address,
@@ -297,32 +798,50 @@ def fill_request(request: Request, context: Context) -> None:
         txn_hash = _transact(func)
     except _TransactionFailed as exc:
         log.error("fillRequest failed", request_id=request.id, cause=exc.cause())
-        return
-
-    w3.eth.wait_for_transaction_receipt(txn_hash)
+        return True
+    allowances.spent(token.address, request.amount)
+    balances.spent(token.address, request.amount)
+
+    def on_receipt(receipt: Optional[TxReceipt]) -> None:
+        balances.settled(token.address, request.amount, succeeded(receipt))
+        if not succeeded(receipt):
+            log.error("fillRequest failed", request_id=request.id, txn_hash=txn_hash.hex())
+            # The failure may be due to a wrong allowance, e.g. a failed approval.
+            allowances.invalidate(token.address)
+            return
+        # The RequestFilled event may have been processed already.
+        if request.is_pending:
+            request.try_to_fill()
+        log.debug(
+            "Filled request",
+            request=request,
+            txn_hash=txn_hash.hex(),
+            token=token.functions.symbol().call(),
+        )
 
-    request.try_to_fill()
-    log.debug(
-        "Filled request",
-        request=request,
-        txn_hash=txn_hash.hex(),
-        token=token.functions.symbol().call(),
-    )
+    context.transactions.submit(("request", request.key), w3, txn_hash, on_receipt)
+    return False
 
 
-def claim_request(request: Request, context: Context) -> None:
+def claim_request(request: Request, context: Context) -> bool:
+    """Try to claim the request if the agent filled it. Returns whether it
+    should be tried again later."""
     if request.filler != context.address:
-        return
+        return False
 
-    block = context.latest_blocks[request.source_chain_id]
-    if block["timestamp"] >= request.valid_until:
+    block = context.latest_blocks.get(request.source_chain_id)
+    if block is None:
+        log.debug("Latest block of source chain unknown", request=request)
+        return True
+    if block.timestamp >= request.valid_until:
         log.info("Request expired, ignoring", request=request)
         request.ignore()
-        return
+        return False
 
-    stake = context.request_manager.functions.claimStake().call()
+    request_manager = context.request_managers[request.source_chain_id]
+    stake = context.parameters[request.source_chain_id].claim_stake
 
-    func = context.request_manager.functions.claimRequest(request.id, request.fill_id)
+    func = request_manager.functions.claimRequest(request.id, request.fill_id)
     try:
         txn_hash = _transact(func, value=stake)
     except _TransactionFailed as exc:
@@ -333,16 +852,23 @@ def claim_request(request: Request, context: Context) -> None:
             cause=exc.cause(),
             stake=stake,
         )
-        return
+        return True
 
-    context.request_manager.web3.eth.wait_for_transaction_receipt(txn_hash)
+    def on_receipt(receipt: Optional[TxReceipt]) -> None:
+        if not succeeded(receipt):
+            log.error("claimRequest failed", request_id=request.id, txn_hash=txn_hash.hex())
+            return
+        if request.is_filled:
+            request.try_to_claim()
+        log.debug(
+            "Claimed request",
+            request=request,
+            txn_hash=txn_hash.hex(),
+        )
 
-    request.try_to_claim()
-    log.debug(
-        "Claimed request",
-        request=request,
-        txn_hash=txn_hash.hex(),
-    )
+    w3 = request_manager.web3
+    context.transactions.submit(("request", request.key), w3, txn_hash, on_receipt)
+    return False
 
 
 def maybe_challenge(claim: Claim, context: Context) -> bool:
@@ -360,28 +886,35 @@ def maybe_challenge(claim: Claim, context: Context) -> bool:
 
     stake = claim.get_next_challenge_stake()
 
-    func = context.request_manager.functions.challengeClaim(claim.id)
+    request_manager = context.request_managers[claim.chain_id]
+    func = request_manager.functions.challengeClaim(claim.id)
     try:
         txn_hash = _transact(func, value=stake)
     except _TransactionFailed as exc:
         log.error("challengeClaim failed", claim=claim, cause=exc.cause(), stake=stake)
         return False
 
-    w3 = context.request_manager.web3
-    w3.eth.wait_for_transaction_receipt(txn_hash)
     claim.transaction_pending = True
 
-    log.debug(
-        "Challenged claim",
-        claim=claim,
-        txn_hash=txn_hash.hex(),
-    )
+    def on_receipt(receipt: Optional[TxReceipt]) -> None:
+        if not succeeded(receipt):
+            log.error("challengeClaim failed", claim=claim, txn_hash=txn_hash.hex())
+            claim.transaction_pending = False
+            return
+        log.debug(
+            "Challenged claim",
+            claim=claim,
+            txn_hash=txn_hash.hex(),
+        )
 
+    w3 = request_manager.web3
+    context.transactions.submit(("claim", claim.key), w3, txn_hash, on_receipt)
     return True
 
 
 def withdraw(claim: Claim, context: Context) -> None:
-    func = context.request_manager.functions.withdraw(claim.id)
+    request_manager = context.request_managers[claim.chain_id]
+    func = request_manager.functions.withdraw(claim.id)
     try:
         txn_hash = _transact(func)
     except _TransactionFailed as exc:
@@ -394,6 +927,14 @@ def withdraw(claim: Claim, context: Context) -> None:
         log.error("Withdraw failed", claim=claim, cause=exc.cause())
         return
 
-    context.request_manager.web3.eth.wait_for_transaction_receipt(txn_hash)
     claim.transaction_pending = True
-    log.debug("Withdrew", claim=claim.id, txn_hash=txn_hash.hex())
+
+    def on_receipt(receipt: Optional[TxReceipt]) -> None:
+        if not succeeded(receipt):
+            log.error("Withdraw failed", claim=claim, txn_hash=txn_hash.hex())
+            claim.transaction_pending = False
+            return
+        log.debug("Withdrew", claim=claim.id, txn_hash=txn_hash.hex())
+
+    w3 = request_manager.web3
+    context.transactions.submit(("claim", claim.key), w3, txn_hash, on_receipt)
@@ -1,6 +1,7 @@
 import json
 import signal
 from pathlib import Path
+from typing import Any, Optional
 
 import click
 import structlog
@@ -9,11 +10,14 @@ from eth_account.signers.local import LocalAccount
 
 import beamer.contracts
 import beamer.util
-from beamer.agent import Agent, Config
+from beamer.agent import Agent, ChainConfig, Config
+from beamer.tokens import APPROVAL_POLICIES
 from beamer.typing import URL
 
 log = structlog.get_logger(__name__)
 
+_TIMEOUT_TYPE = click.FloatRange(min=0, min_open=True)
+
 
 def _account_from_keyfile(keyfile: Path, password: str) -> LocalAccount:
     with open(keyfile, "rt") as fp:
@@ -21,6 +25,30 @@ def _account_from_keyfile(keyfile: Path, password: str) -> LocalAccount:
     return Account.from_key(privkey)
 
 
+class _ChainParamType(click.ParamType):
+    """Parses URL[,ws=URL][,timeout=SECONDS] into a ChainConfig."""
+
+    name = "chain"
+
+    def convert(
+        self, value: Any, param: Optional[click.Parameter], ctx: Optional[click.Context]
+    ) -> ChainConfig:
+        if isinstance(value, ChainConfig):
+            return value
+
+        rpc_url, *options = value.split(",")
+        chain = ChainConfig(URL(rpc_url))
+        for option in options:
+            key, _, option_value = option.partition("=")
+            if key == "ws":
+                chain.ws_url = URL(option_value)
+            elif key == "timeout":
+                chain.rpc_timeout = _TIMEOUT_TYPE.convert(option_value, param, ctx)
+            else:
+                self.fail(f"unknown option {option!r}", param, ctx)
+        return chain
+
+
 def _sigint_handler(agent: Agent) -> None:
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     log.info("Received SIGINT, shutting down")
@@ -37,18 +65,17 @@ def _sigint_handler(agent: Agent) -> None:
 )
 @click.password_option(required=True, help="The password needed to unlock the account.")
 @click.option(
-    "--l2a-rpc-url",
-    type=str,
+    "--rpc-url",
+    "chains",
+    type=_ChainParamType(),
     required=True,
-    metavar="URL",
-    help="The URL of the source L2 chain RPC server (e.g. http://10.0.0.2:8545).",
-)
-@click.option(
-    "--l2b-rpc-url",
-    type=str,
-    required=True,
-    metavar="URL",
-    help="The URL of the target L2 chain RPC server (e.g. http://10.0.0.3:8545).",
+    multiple=True,
+    metavar="URL[,ws=URL][,timeout=SECONDS]",
+    help="The URL of the RPC server of an L2 chain to serve (e.g. http://10.0.0.2:8545), "
+    "optionally followed by the WebSocket URL of the server and the request timeout "
+    "(default: 5). If a WebSocket URL is given, the agent subscribes to new blocks instead "
+    "of polling for them. Give this once per chain. Requests between any two of the served "
+    "chains are filled.",
 )
 @click.option(
     "--deployment-dir",
@@ -70,6 +97,36 @@ def _sigint_handler(agent: Agent) -> None:
     default=120,
     help="Time in seconds to wait for a fill event before challenging a false claim.",
 )
+@click.option(
+    "--sync-workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of concurrent eth_getLogs queries used during the initial sync.",
+)
+@click.option(
+    "--state-dir",
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),
+    metavar="DIR",
+    help="The directory used to persist fetched events across restarts. "
+    "If not given, all events are fetched again on every start.",
+)
+@click.option(
+    "--rpc-pool-size",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Maximum number of keep-alive connections per RPC server.",
+)
+@click.option(
+    "--approval-policy",
+    type=click.Choice(APPROVAL_POLICIES),
+    default="exact",
+    show_default=True,
+    help="How much to approve the FillManager to spend of a token. With 'exact', "
+    "each fill is approved separately, with 'unlimited', each token is approved once "
+    "with the maximum amount.",
+)
 @click.option(
     "--log-level",
     type=click.Choice(("debug", "info", "warning", "error", "critical")),
@@ -81,11 +138,14 @@ def _sigint_handler(agent: Agent) -> None:
 def main(
     keystore_file: Path,
     password: str,
-    l2a_rpc_url: URL,
-    l2b_rpc_url: URL,
+    chains: tuple[ChainConfig, ...],
     deployment_dir: Path,
     token_match_file: Path,
     fill_wait_time: int,
+    sync_workers: int,
+    state_dir: Optional[Path],
+    rpc_pool_size: int,
+    approval_policy: str,
     log_level: str,
 ) -> None:
     beamer.util.setup_logging(log_level=log_level.upper(), log_json=False)
@@ -96,10 +156,13 @@ def main(
     config = Config(
         account=account,
         deployment_info=deployment_info,
-        l2a_rpc_url=l2a_rpc_url,
-        l2b_rpc_url=l2b_rpc_url,
+        chains=list(chains),
         token_match_file=token_match_file,
         fill_wait_time=fill_wait_time,
+        sync_workers=sync_workers,
+        state_dir=state_dir,
+        rpc_pool_size=rpc_pool_size,
+        approval_policy=approval_policy,
     )
 
     signal.signal(signal.SIGINT, lambda *_unused: _sigint_handler(agent))
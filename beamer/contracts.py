@@ -1,6 +1,7 @@
 import json
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 import web3
 from web3.contract import Contract
@@ -49,3 +50,19 @@ def load_deployment_info(deployment_dir: Path) -> DeploymentInfo:
             )
         deployment_info[ChainId(int(chain_id))] = infos
     return deployment_info
+
+
+class RequestManagerParameters:
+    """A cached view of the parameters of a RequestManager contract that the
+    agent needs. The claim stake is set when the contract is deployed, so it
+    is read only once."""
+
+    def __init__(self, request_manager: Contract) -> None:
+        self._request_manager = request_manager
+        self._claim_stake: Optional[int] = None
+
+    @property
+    def claim_stake(self) -> int:
+        if self._claim_stake is None:
+            self._claim_stake = self._request_manager.functions.claimStake().call()
+        return self._claim_stake
@@ -1,43 +1,107 @@
+import collections
+import functools
+import json
+import re
+import threading
 import time
-from dataclasses import dataclass
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Optional, Sequence
 
 import requests.exceptions
 import structlog
 import web3
 from eth_abi.codec import ABICodec
+from eth_typing import HexStr
+from eth_utils import encode_hex, hexstr_if_str, to_bytes, to_checksum_address
 from eth_utils.abi import event_abi_to_log_topic
-from web3.contract import Contract, get_event_data
-from web3.types import ABIEvent, BlockData, ChecksumAddress, FilterParams, LogReceipt, Wei
+from hexbytes import HexBytes
+from web3._utils.method_formatters import log_entry_formatter
+from web3._utils.request import make_post_request
+from web3.contract import Contract
+from web3.exceptions import MismatchedABI
+from web3.types import (
+    ABIEvent,
+    BlockData,
+    ChecksumAddress,
+    FilterParams,
+    LogReceipt,
+    RPCResponse,
+    Wei,
+)
 
 from beamer.typing import (
     BlockNumber,
     ChainId,
     ClaimId,
+    ClaimKey,
     FillId,
     RequestId,
+    RequestKey,
     Termination,
     TokenAmount,
 )
 
 
+class _Slotted:
+    """Pickle support for frozen dataclasses with __slots__. Without it,
+    unpickling fails, since restoring the slots assigns to the fields."""
+
+    __slots__ = ()
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, field.name) for field in fields(self))
+
+    def __setstate__(self, state: tuple) -> None:
+        for field, value in zip(fields(self), state):
+            object.__setattr__(self, field.name, value)
+
+
 @dataclass(frozen=True)
-class Event:
+class BlockHeader(_Slotted):
+    """The parts of a block the agent uses."""
+
+    __slots__ = ("number", "hash", "parent_hash", "timestamp", "base_fee_per_gas")
+    number: BlockNumber
+    hash: HexBytes
+    parent_hash: HexBytes
+    timestamp: int
+    # None if the chain does not support EIP-1559.
+    base_fee_per_gas: Optional[Wei]
+
+
+@dataclass(frozen=True)
+class Event(_Slotted):
+    __slots__ = ("chain_id",)
     chain_id: ChainId
 
 
 @dataclass(frozen=True)
 class LatestBlockUpdatedEvent(Event):
-    block_data: BlockData
+    __slots__ = ("block",)
+    block: BlockHeader
 
 
 @dataclass(frozen=True)
 class RequestEvent(Event):
+    __slots__ = ("request_id",)
     request_id: RequestId
 
+    @property
+    def request_key(self) -> RequestKey:
+        return self.chain_id, self.request_id
+
 
 @dataclass(frozen=True)
 class RequestCreated(RequestEvent):
+    __slots__ = (
+        "target_chain_id",
+        "source_token_address",
+        "target_token_address",
+        "target_address",
+        "amount",
+        "valid_until",
+    )
     target_chain_id: ChainId
     source_token_address: ChecksumAddress
     target_token_address: ChecksumAddress
@@ -48,26 +112,50 @@ class RequestCreated(RequestEvent):
 
 @dataclass(frozen=True)
 class RequestFilled(RequestEvent):
+    __slots__ = ("fill_id", "source_chain_id", "target_token_address", "filler", "amount")
     fill_id: FillId
     source_chain_id: ChainId
     target_token_address: ChecksumAddress
     filler: ChecksumAddress
     amount: TokenAmount
 
+    @property
+    def request_key(self) -> RequestKey:
+        # Fills are emitted on the target chain.
+        return self.source_chain_id, self.request_id
+
 
 @dataclass(frozen=True)
 class DepositWithdrawn(RequestEvent):
+    __slots__ = ("receiver",)
     receiver: ChecksumAddress
 
 
 @dataclass(frozen=True)
 class ClaimEvent(Event):
+    __slots__ = ("claim_id", "request_id")
     claim_id: ClaimId
+    request_id: RequestId
+
+    @property
+    def claim_key(self) -> ClaimKey:
+        return self.chain_id, self.claim_id
+
+    @property
+    def request_key(self) -> RequestKey:
+        return self.chain_id, self.request_id
 
 
 @dataclass(frozen=True)
 class ClaimMade(ClaimEvent):
-    request_id: RequestId
+    __slots__ = (
+        "fill_id",
+        "claimer",
+        "claimer_stake",
+        "challenger",
+        "challenger_stake",
+        "termination",
+    )
     fill_id: FillId
     claimer: ChecksumAddress
     claimer_stake: Wei
@@ -78,7 +166,7 @@ class ClaimMade(ClaimEvent):
 
 @dataclass(frozen=True)
 class ClaimWithdrawn(ClaimEvent):
-    request_id: RequestId
+    __slots__ = ("claim_receiver",)
     claim_receiver: ChecksumAddress
 
 
@@ -96,58 +184,351 @@ _EVENT_TYPES = dict(
 
 
 def _make_topics_to_abi(contract: web3.contract.Contract) -> dict[bytes, ABIEvent]:
+    """Return a mapping from topic to event ABI for all contract events
+    that have a corresponding type in _EVENT_TYPES."""
     event_abis = {}
     for abi in contract.abi:
-        if abi["type"] == "event":
+        if abi["type"] == "event" and abi["name"] in _EVENT_TYPES:
             event_abis[event_abi_to_log_topic(abi)] = abi  # type: ignore
     return event_abis
 
 
-def _decode_event(
-    codec: ABICodec, log_entry: LogReceipt, chain_id: ChainId, event_abis: dict[bytes, ABIEvent]
-) -> Optional[Event]:
-    topic = log_entry["topics"][0]
-    event_abi = event_abis[topic]
-    data = get_event_data(abi_codec=codec, event_abi=event_abi, log_entry=log_entry)
-    if data.event in _EVENT_TYPES:
-        kwargs = {_camel_to_snake(name): value for name, value in data.args.items()}
-        kwargs["chain_id"] = chain_id
-        return _EVENT_TYPES[data.event](**kwargs)
-    return None
+# Decoders for ABI types that are encoded as a single 32-byte word. Events that
+# only consist of such types can be decoded by slicing the log data, which is
+# considerably faster than going through the generic ABI codec.
+#
+# Computing the checksum address requires hashing. Since logs mostly contain
+# the same few addresses (tokens, agents, ...), results are cached.
+_checksum_address = functools.lru_cache(maxsize=4096)(to_checksum_address)
+
+_WORD_DECODERS: dict[str, Callable[[bytes], Any]] = {
+    "address": lambda word: _checksum_address(word[12:]),
+    "bytes32": bytes,
+    "uint256": lambda word: int.from_bytes(word, "big"),
+}
+
+
+class _EventDecoder:
+    """Decodes logs of a single event type straight into the corresponding
+    event dataclass. Everything that only depends on the event ABI, like the
+    argument types and dataclass field names, is computed once, up front."""
+
+    def __init__(self, codec: ABICodec, event_abi: ABIEvent):
+        self._codec = codec
+        self._event_type = _EVENT_TYPES[event_abi["name"]]
+        inputs = event_abi["inputs"]
+        indexed = [arg for arg in inputs if arg["indexed"]]
+        not_indexed = [arg for arg in inputs if not arg["indexed"]]
+        self._topic_types = [arg["type"] for arg in indexed]
+        self._data_types = [arg["type"] for arg in not_indexed]
+        self._field_names = [_camel_to_snake(arg["name"]) for arg in indexed + not_indexed]
+        self._normalizers = [
+            _checksum_address if arg["type"] == "address" else None
+            for arg in indexed + not_indexed
+        ]
+        self._word_decoders: Optional[list[Callable[[bytes], Any]]] = None
+        if all(arg["type"] in _WORD_DECODERS for arg in inputs):
+            self._word_decoders = [_WORD_DECODERS[arg["type"]] for arg in indexed + not_indexed]
+
+    def decode(self, log_entry: LogReceipt, chain_id: ChainId) -> Event:
+        topics = log_entry["topics"][1:]
+        if len(topics) != len(self._topic_types):
+            raise MismatchedABI("Number of topics does not match the event ABI")
+        data = hexstr_if_str(to_bytes, log_entry["data"])
+
+        if self._word_decoders is not None:
+            return self._decode_words(topics, data, chain_id)
+
+        values = [
+            self._codec.decode_single(type_, topic)
+            for type_, topic in zip(self._topic_types, topics)
+        ]
+        values.extend(self._codec.decode_abi(self._data_types, data))
+
+        kwargs: dict[str, Any] = dict(chain_id=chain_id)
+        for name, normalize, value in zip(self._field_names, self._normalizers, values):
+            kwargs[name] = value if normalize is None else normalize(value)
+        return self._event_type(**kwargs)
+
+    def _decode_words(self, topics: Sequence[bytes], data: bytes, chain_id: ChainId) -> Event:
+        if len(data) != 32 * len(self._data_types):
+            raise MismatchedABI("Log data size does not match the event ABI")
+        words = list(topics)
+        for start in range(0, len(data), 32):
+            end = start + 32
+            words.append(data[start:end])
+
+        kwargs: dict[str, Any] = dict(chain_id=chain_id)
+        assert self._word_decoders is not None
+        for name, decode, word in zip(self._field_names, self._word_decoders, words):
+            kwargs[name] = decode(word)
+        return self._event_type(**kwargs)
+
+
+def _make_decoders(
+    codec: ABICodec, event_abis: dict[bytes, ABIEvent]
+) -> dict[bytes, _EventDecoder]:
+    return {topic: _EventDecoder(codec, abi) for topic, abi in event_abis.items()}
 
 
 def _decode_events(
-    logs: list[LogReceipt], codec: ABICodec, chain_id: ChainId, event_abis: dict[bytes, ABIEvent]
+    logs: list[LogReceipt], chain_id: ChainId, decoders: dict[bytes, _EventDecoder]
 ) -> list[Event]:
     events = []
     for entry in logs:
-        event = _decode_event(codec, entry, chain_id, event_abis)
-        if event is not None:
-            events.append(event)
+        decoder = decoders.get(entry["topics"][0])
+        # Logs are filtered by topic on the server side, but we should not
+        # rely on every RPC server to apply the filter correctly.
+        if decoder is not None:
+            events.append(decoder.decode(entry, chain_id))
     return events
 
 
+class _BatchNotSupported(ValueError):
+    pass
+
+
+def _batch_request(w3: web3.Web3, calls: list[tuple[str, list]]) -> list[RPCResponse]:
+    """Send the calls as a single JSON-RPC batch request and return the responses
+    in the order of the calls. Raises _BatchNotSupported if the server does not
+    support batch requests and ValueError if the response is malformed. Note
+    that the web3 middlewares are bypassed."""
+    provider = w3.provider
+    assert isinstance(provider, web3.HTTPProvider)
+    assert provider.endpoint_uri is not None
+    batch = [
+        dict(jsonrpc="2.0", id=request_id, method=method, params=params)
+        for request_id, (method, params) in enumerate(calls)
+    ]
+    raw_response = make_post_request(
+        provider.endpoint_uri, to_bytes(text=json.dumps(batch)), **provider.get_request_kwargs()
+    )
+    responses = json.loads(raw_response)
+    if isinstance(responses, dict):
+        # A single error response for the whole batch.
+        raise _BatchNotSupported(f"Batch requests not supported: {responses}")
+    if not isinstance(responses, list) or len(responses) != len(calls):
+        raise ValueError(f"Malformed batch response: {responses}")
+    responses.sort(key=lambda response: response["id"])
+    return responses
+
+
+def _parse_header(raw_block: dict) -> BlockHeader:
+    """Parse a block as returned by eth_getBlockByNumber, ignoring everything
+    but the header fields the agent uses."""
+    base_fee = raw_block.get("baseFeePerGas")
+    return BlockHeader(
+        number=BlockNumber(int(raw_block["number"], 16)),
+        hash=HexBytes(raw_block["hash"]),
+        parent_hash=HexBytes(raw_block["parentHash"]),
+        timestamp=int(raw_block["timestamp"], 16),
+        base_fee_per_gas=None if base_fee is None else Wei(int(base_fee, 16)),
+    )
+
+
+def _header_from_block(block: BlockData) -> BlockHeader:
+    return BlockHeader(
+        number=block["number"],
+        hash=HexBytes(block["hash"]),
+        parent_hash=HexBytes(block["parentHash"]),
+        timestamp=block["timestamp"],
+        base_fee_per_gas=block.get("baseFeePerGas"),
+    )
+
+
+# Called with the events of a block range and the block number following it.
+_DeliverFunc = Callable[[list[Event], BlockNumber], None]
+
+
+@dataclass(frozen=True)
+class RangeLimits:
+    """Block range parameters for eth_getLogs, learned for an RPC endpoint."""
+
+    # The number of blocks to fetch with a single eth_getLogs query.
+    blocks_to_fetch: int
+    # The maximum number of blocks the RPC server allows.
+    max_blocks: int
+
+
+# Error messages of RPC servers that limit the block range of eth_getLogs.
+# The first group of each pattern has to match the maximum number of blocks.
+_RANGE_LIMIT_PATTERNS = [
+    # Boba: 'exceed maximum block range: 5000'
+    re.compile(r"exceed maximum block range: ([\d,]+)"),
+    # QuickNode: 'eth_getLogs and eth_newFilter are limited to a 10,000 blocks range'
+    re.compile(r"limited to a ([\d,]+) blocks? range"),
+    # Geth based nodes: 'query exceeds max block range 100000'
+    re.compile(r"exceeds max block range ([\d,]+)"),
+    # Ankr: 'block range is too wide, maximum is 3000'
+    re.compile(r"block range is too wide, maximum is ([\d,]+)"),
+]
+
+# Error messages of RPC servers that limit the number of results of eth_getLogs
+# and suggest a block range that works.
+# Alchemy: '... Based on your parameters, this block range should work: [0x1, 0x2f]'
+_SUGGESTED_RANGE_PATTERN = re.compile(
+    r"this block range should work: \[(0x[0-9a-f]+), (0x[0-9a-f]+)\]"
+)
+
+
+def _error_message(exc: ValueError) -> str:
+    # web3 raises a ValueError with the JSON-RPC error object as argument.
+    if exc.args and isinstance(exc.args[0], dict):
+        return str(exc.args[0].get("message", ""))
+    return str(exc)
+
+
+def _parse_range_limit(message: str) -> Optional[int]:
+    """Return the maximum number of blocks allowed in an eth_getLogs query,
+    if the error message is a known range limit error."""
+    for pattern in _RANGE_LIMIT_PATTERNS:
+        match = pattern.search(message)
+        if match is not None:
+            return int(match.group(1).replace(",", ""))
+    return None
+
+
+def _parse_suggested_range(message: str) -> Optional[int]:
+    """Return the number of blocks of the block range suggested in the error message, if any."""
+    match = _SUGGESTED_RANGE_PATTERN.search(message)
+    if match is None:
+        return None
+    from_block, to_block = (int(group, 16) for group in match.groups())
+    return to_block - from_block + 1
+
+
+class _UnfetchableBlock(Exception):
+    pass
+
+
 class EventFetcher:
     _DEFAULT_BLOCKS = 1_000
     _MIN_BLOCKS = 2
     _MAX_BLOCKS = 100_000
+    # How often a single block may fail in a row before the fetch is given up.
+    _MAX_BLOCK_ATTEMPTS = 5
     _ETH_GET_LOGS_THRESHOLD_FAST = 2
     _ETH_GET_LOGS_THRESHOLD_SLOW = 5
 
-    def __init__(self, contract_name: str, contract: Contract, start_block: BlockNumber):
+    def __init__(
+        self,
+        contract_name: str,
+        contract: Contract,
+        start_block: BlockNumber,
+        range_limits: Optional[RangeLimits] = None,
+    ):
         self._contract_name = contract_name
         self._contract = contract
         self._next_block_number = start_block
         self._blocks_to_fetch = EventFetcher._DEFAULT_BLOCKS
+        self._max_blocks = EventFetcher._MAX_BLOCKS
+        if range_limits is not None:
+            self._max_blocks = range_limits.max_blocks
+            self._blocks_to_fetch = min(range_limits.blocks_to_fetch, self._max_blocks)
+        # Block ranges that failed, e.g. because they contained too many events,
+        # along with the range size to use within them: (start, end, blocks_to_fetch).
+        self._dense_regions: list[tuple[BlockNumber, BlockNumber, int]] = []
+        # Consecutive failures of single block ranges, by block number.
+        self._block_failures: dict[BlockNumber, int] = {}
+        # Guards the range state above, which is updated by the pool workers.
+        self._lock = threading.Lock()
         self._chain_id = ChainId(contract.web3.eth.chain_id)
         self._event_abis = _make_topics_to_abi(contract)
+        self._decoders = _make_decoders(contract.web3.codec, self._event_abis)
+        # Only ask for the events we are able to decode. A list in the first
+        # topic position matches any of the contained topics.
+        self._topics = [[HexStr(encode_hex(topic)) for topic in self._event_abis]]
+        # Once we caught up with the chain head, a new block and the new logs up
+        # to it are fetched with a single batch request, if the server supports it.
+        self._use_batches = isinstance(contract.web3.provider, web3.HTTPProvider)
+        self._at_head = False
+        # Whether a LatestBlockUpdatedEvent has been returned yet.
+        self._head_reported = False
         self._log = structlog.get_logger(type(self).__name__)
 
+    @property
+    def next_block_number(self) -> BlockNumber:
+        return self._next_block_number
+
+    @property
+    def range_limits(self) -> RangeLimits:
+        return RangeLimits(blocks_to_fetch=self._blocks_to_fetch, max_blocks=self._max_blocks)
+
+    def _range_end(self, from_block: BlockNumber, block_number: BlockNumber) -> BlockNumber:
+        """Return the last block of the range to query starting at from_block,
+        taking dense regions into account."""
+        with self._lock:
+            to_block = min(block_number, BlockNumber(from_block + self._blocks_to_fetch))
+            for start, end, num_blocks in self._dense_regions:
+                if start <= from_block <= end:
+                    # Don't let a piece of a dense region extend beyond it.
+                    to_block = min(to_block, end, BlockNumber(from_block + num_blocks))
+        return to_block
+
+    def _handle_failed_range(
+        self, from_block: BlockNumber, to_block: BlockNumber, exc: Exception
+    ) -> None:
+        message = _error_message(exc) if isinstance(exc, ValueError) else ""
+        with self._lock:
+            self._update_ranges(from_block, to_block, exc, message)
+
+    def _update_ranges(
+        self, from_block: BlockNumber, to_block: BlockNumber, exc: Exception, message: str
+    ) -> None:
+        if from_block == to_block:
+            # A single block cannot be split any further.
+            attempts = self._block_failures.get(from_block, 0) + 1
+            if attempts >= EventFetcher._MAX_BLOCK_ATTEMPTS:
+                del self._block_failures[from_block]
+                self._log.error(
+                    "Failed to get events of block",
+                    chain_id=self._chain_id,
+                    block=from_block,
+                    attempts=attempts,
+                    exc=exc,
+                )
+                raise _UnfetchableBlock(from_block) from exc
+            self._block_failures[from_block] = attempts
+
+        limit = _parse_range_limit(message)
+        if limit is not None:
+            # The server refuses ranges of this size anywhere. Our ranges include
+            # both ends, so a range of N blocks means to_block = from_block + N - 1.
+            self._max_blocks = max(EventFetcher._MIN_BLOCKS, limit - 1)
+            self._blocks_to_fetch = min(self._blocks_to_fetch, self._max_blocks)
+            self._log.debug(
+                "Block range limit exceeded",
+                chain_id=self._chain_id,
+                max_blocks=self._max_blocks,
+                exc=exc,
+            )
+            return
+
+        # Otherwise the range most likely contains too many events. Only this
+        # range is split, either as suggested by the server or in half, so that
+        # sparse regions are still fetched with the global range size.
+        suggested = _parse_suggested_range(message)
+        if suggested is not None:
+            num_blocks = max(0, suggested - 1)
+        else:
+            num_blocks = (to_block - from_block) // 2
+        region = (from_block, to_block, num_blocks)
+        if region not in self._dense_regions:
+            self._dense_regions.append(region)
+        self._log.debug(
+            "Failed to get events, splitting range",
+            chain_id=self._chain_id,
+            from_block=from_block,
+            to_block=to_block,
+            num_blocks=num_blocks,
+            exc=exc,
+        )
+
     def _fetch_range(
         self, from_block: BlockNumber, to_block: BlockNumber
     ) -> Optional[list[Event]]:
         """Returns a list of events that happened in the period [from_block, to_block],
-        or None if a timeout occurs."""
+        or None if the query failed."""
         self._log.debug(
             "Fetching events",
             chain_id=self._chain_id,
@@ -158,22 +539,18 @@ class EventFetcher:
         try:
             before_query = time.monotonic()
             params: FilterParams = dict(
-                fromBlock=from_block, toBlock=to_block, address=self._contract.address
+                fromBlock=from_block,
+                toBlock=to_block,
+                address=self._contract.address,
+                topics=self._topics,
             )
             logs = self._contract.web3.eth.get_logs(params)
             after_query = time.monotonic()
 
-        # Boba limits the range to 5000 blocks
+        # Some RPC servers limit the block range or the number of results, e.g. Boba:
         # 'ValueError: {'code': -32000, 'message': 'exceed maximum block range: 5000'}'
-        except (requests.exceptions.ReadTimeout, ValueError):
-            old = self._blocks_to_fetch
-            self._blocks_to_fetch = max(EventFetcher._MIN_BLOCKS, old // 5)
-            self._log.debug(
-                "Failed to get events in time, reducing number of blocks",
-                chain_id=self._chain_id,
-                old=old,
-                new=self._blocks_to_fetch,
-            )
+        except (requests.exceptions.ReadTimeout, ValueError) as exc:
+            self._handle_failed_range(from_block, to_block, exc)
             return None
 
         except requests.exceptions.ConnectionError as exc:
@@ -185,45 +562,195 @@ class EventFetcher:
 
         else:
             duration = after_query - before_query
-            if duration < EventFetcher._ETH_GET_LOGS_THRESHOLD_FAST:
-                self._blocks_to_fetch = min(EventFetcher._MAX_BLOCKS, self._blocks_to_fetch * 2)
-            elif duration > EventFetcher._ETH_GET_LOGS_THRESHOLD_SLOW:
-                self._blocks_to_fetch = max(EventFetcher._MIN_BLOCKS, self._blocks_to_fetch // 2)
-            codec = self._contract.web3.codec
-            return _decode_events(logs, codec, self._chain_id, self._event_abis)
-
-    def fetch(self) -> list[Event]:
-        try:
-            block_number = self._contract.web3.eth.block_number
-        except requests.exceptions.RequestException:
-            return []
-
-        if block_number < self._next_block_number:
-            return []
-
-        result = []
+            with self._lock:
+                if from_block == to_block:
+                    self._block_failures.pop(from_block, None)
+                if duration < EventFetcher._ETH_GET_LOGS_THRESHOLD_FAST:
+                    self._blocks_to_fetch = min(self._max_blocks, self._blocks_to_fetch * 2)
+                elif duration > EventFetcher._ETH_GET_LOGS_THRESHOLD_SLOW:
+                    self._blocks_to_fetch = max(
+                        EventFetcher._MIN_BLOCKS, self._blocks_to_fetch // 2
+                    )
+            return _decode_events(logs, self._chain_id, self._decoders)
+
+    def _fetch_parallel(
+        self, block_number: BlockNumber, num_workers: int, deliver: _DeliverFunc
+    ) -> BlockNumber:
+        """Fetch events up to and including block_number using a pool of num_workers
+        threads. The events of each range are passed to deliver in block order.
+        Returns the first block number that has not been fetched. Fetching stops
+        early on connection errors and on blocks that keep failing."""
+        pending: collections.deque[tuple[BlockNumber, BlockNumber, Future]] = collections.deque()
+        from_block = self._next_block_number
+        next_block = from_block
+
+        with ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix=self._contract_name
+        ) as executor:
+
+            def submit(start: BlockNumber, end: BlockNumber) -> None:
+                pending.append((start, end, executor.submit(self._fetch_range, start, end)))
+
+            while pending or next_block <= block_number:
+                # Keep the pool busy. The range size is read at submission time
+                # so that adjustments made by completed queries take effect.
+                while len(pending) < num_workers and next_block <= block_number:
+                    to_block = self._range_end(next_block, block_number)
+                    submit(next_block, to_block)
+                    next_block = BlockNumber(to_block + 1)
+
+                start, end, future = pending.popleft()
+                try:
+                    events = future.result()
+                except (requests.exceptions.ConnectionError, _UnfetchableBlock):
+                    for _, _, other in pending:
+                        other.cancel()
+                    break
+
+                if events is None:
+                    # The range failed and has been recorded as dense region.
+                    # Split the range and put the pieces in front of the queue so
+                    # that events are still delivered in block order.
+                    retries = []
+                    while start <= end:
+                        to_block = self._range_end(start, end)
+                        retries.append((start, to_block))
+                        start = BlockNumber(to_block + 1)
+                    for retry_start, retry_end in reversed(retries):
+                        future = executor.submit(self._fetch_range, retry_start, retry_end)
+                        pending.appendleft((retry_start, retry_end, future))
+                    continue
+
+                from_block = BlockNumber(end + 1)
+                deliver(events, from_block)
+
+        return from_block
+
+    def _fetch_sequential(self, block_number: BlockNumber, deliver: _DeliverFunc) -> BlockNumber:
         from_block = self._next_block_number
         while from_block <= block_number:
-            to_block = min(block_number, BlockNumber(from_block + self._blocks_to_fetch))
+            to_block = self._range_end(from_block, block_number)
             try:
                 events = self._fetch_range(from_block, to_block)
-            except requests.exceptions.ConnectionError:
+            except (requests.exceptions.ConnectionError, _UnfetchableBlock):
                 break
             if events is not None:
-                result.extend(events)
                 from_block = BlockNumber(to_block + 1)
-
-        self._next_block_number = from_block
+                deliver(events, from_block)
+        return from_block
+
+    def _fetch_block_and_logs(
+        self, block_number: BlockNumber
+    ) -> tuple[Optional[BlockHeader], Optional[list[LogReceipt]]]:
+        """Fetch the given block and all logs up to it since the last fetch in a
+        single round trip. The logs are None if they could not be fetched this
+        way, the block too if the batch request failed."""
+        params = dict(
+            fromBlock=hex(self._next_block_number),
+            toBlock=hex(block_number),
+            address=self._contract.address,
+            topics=self._topics,
+        )
+        calls: list[tuple[str, list]] = [
+            ("eth_getBlockByNumber", [hex(block_number), False]),
+            ("eth_getLogs", [params]),
+        ]
+        try:
+            block_response, logs_response = _batch_request(self._contract.web3, calls)
+        except _BatchNotSupported as exc:
+            self._log.info("Disabling batch requests", chain_id=self._chain_id, exc=exc)
+            self._use_batches = False
+            return None, None
+        except (requests.exceptions.RequestException, ValueError) as exc:
+            # Try again with the next block.
+            self._log.debug("Batch request failed", chain_id=self._chain_id, exc=exc)
+            return None, None
+
+        if "error" in block_response or block_response["result"] is None:
+            # The node serving the batch may be behind the one that returned the
+            # block number, e.g. behind a load balancer. Its logs might not cover
+            # the whole range then, so they are not used.
+            self._log.debug("Batched block unavailable", chain_id=self._chain_id)
+            return None, None
+        block = _parse_header(block_response["result"])
+        if "error" in logs_response:
+            self._log.debug(
+                "Batched eth_getLogs failed", chain_id=self._chain_id, error=logs_response["error"]
+            )
+            return block, None
+
+        logs: list[LogReceipt] = [log_entry_formatter(entry) for entry in logs_response["result"]]
+        return block, logs
+
+    def fetch(
+        self, num_workers: int = 1, on_events: Optional[Callable[[list[Event]], None]] = None
+    ) -> list[Event]:
+        """Fetch all events since the last call. If num_workers is larger than 1,
+        block ranges are queried concurrently, which is useful for the initial
+        sync. The returned events are always in block order.
+
+        If on_events is given, it is called with the events of each block range
+        as soon as they are decoded, in block order, and with next_block_number
+        already advanced past the range. Only the remaining events are returned
+        then, so that the whole history never needs to be held at once."""
         try:
-            # Block number needs to be decremented here, because it is already incremented above
-            block_data = self._contract.web3.eth.get_block(from_block - 1)
-        except requests.exceptions.RequestException:
-            return result
+            # Only the block number is needed to tell whether the head changed,
+            # the block itself is fetched below.
+            block_number = self._contract.web3.eth.block_number
+        except (requests.exceptions.RequestException, ValueError):
+            # A timeout may be caused by too many logs, don't try to
+            # fetch them all at once again.
+            self._at_head = False
+            return []
+
+        if block_number < self._next_block_number:
+            if self._head_reported:
+                return []
+            # This happens after a restart from a checkpoint at the chain head.
+            # The head is still reported, since requests cannot be processed
+            # before the block time of their chains is known.
+            try:
+                block = _header_from_block(self._contract.web3.eth.get_block(block_number))
+            except (requests.exceptions.RequestException, ValueError):
+                return []
+            self._head_reported = True
+            return [LatestBlockUpdatedEvent(chain_id=self._chain_id, block=block)]
+
+        logs: Optional[list[LogReceipt]] = None
+        latest_block: Optional[BlockHeader] = None
+        if num_workers == 1 and self._use_batches and self._at_head:
+            latest_block, logs = self._fetch_block_and_logs(block_number)
+
+        result: list[Event] = []
+
+        def deliver(events: list[Event], next_block: BlockNumber) -> None:
+            if on_events is None:
+                result.extend(events)
+            elif events:
+                self._next_block_number = next_block
+                on_events(events)
+
+        if logs is not None:
+            result.extend(_decode_events(logs, self._chain_id, self._decoders))
+            from_block = BlockNumber(block_number + 1)
+        elif num_workers > 1:
+            from_block = self._fetch_parallel(block_number, num_workers, deliver)
         else:
-            result.append(
-                LatestBlockUpdatedEvent(
-                    chain_id=self._chain_id,
-                    block_data=block_data,
+            from_block = self._fetch_sequential(block_number, deliver)
+
+        self._next_block_number = from_block
+        # Dense regions are only needed while their blocks are being fetched.
+        self._dense_regions = [region for region in self._dense_regions if region[1] >= from_block]
+        self._at_head = from_block > block_number
+        # Block number needs to be decremented here, because it is already incremented above
+        if latest_block is None or from_block - 1 != block_number:
+            try:
+                latest_block = _header_from_block(
+                    self._contract.web3.eth.get_block(from_block - 1)
                 )
-            )
+            except (requests.exceptions.RequestException, web3.exceptions.BlockNotFound):
+                return result
+
+        self._head_reported = True
+        result.append(LatestBlockUpdatedEvent(chain_id=self._chain_id, block=latest_block))
         return result
@@ -1,105 +1,161 @@
-from typing import Optional
+import enum
+from typing import Any, Optional
 
 from eth_typing import ChecksumAddress as Address
-from statemachine import State, StateMachine
 from web3.types import Wei
 
 from beamer.events import ClaimMade
 from beamer.models.request import Request
-from beamer.typing import ClaimId, RequestId, Termination
+from beamer.models.transitions import transition
+from beamer.typing import ClaimKey, RequestKey
 
 
-class Claim(StateMachine):
+class ClaimState(enum.Enum):
+    # Claimer is winning
+    CLAIMER_WINNING = "claimer_winning"
+    # Challenger is winning
+    CHALLENGER_WINNING = "challenger_winning"
+    IGNORED = "ignored"
+    WITHDRAWN = "withdrawn"
+
+
+_CLAIMER_WINNING = ClaimState.CLAIMER_WINNING
+_CHALLENGER_WINNING = ClaimState.CHALLENGER_WINNING
+_IGNORED = ClaimState.IGNORED
+_WITHDRAWN = ClaimState.WITHDRAWN
+
+_CHALLENGE = {
+    _CLAIMER_WINNING: _CHALLENGER_WINNING,
+    _CHALLENGER_WINNING: _CLAIMER_WINNING,
+    _IGNORED: _IGNORED,
+}
+_WITHDRAW = {
+    _CLAIMER_WINNING: _WITHDRAWN,
+    _CHALLENGER_WINNING: _WITHDRAWN,
+    _IGNORED: _WITHDRAWN,
+}
+_IGNORE = {_CLAIMER_WINNING: _IGNORED, _IGNORED: _IGNORED}
+
+
+class Claim:
+    # The fields of the latest ClaimMade event are stored directly, rather
+    # than keeping the event, to keep the many tracked claims small.
+    __slots__ = (
+        "id",
+        "chain_id",
+        "request_id",
+        "fill_id",
+        "claimer",
+        "claimer_stake",
+        "challenger",
+        "challenger_stake",
+        "termination",
+        "challenge_back_off_timestamp",
+        "transaction_pending",
+        "state",
+    )
+
     def __init__(
         self,
         claim_made: ClaimMade,
         challenge_back_off_timestamp: int,
     ) -> None:
-        super().__init__()
-        self._latest_claim_made = claim_made
+        self.id = claim_made.claim_id
+        self.chain_id = claim_made.chain_id
+        self.request_id = claim_made.request_id
+        self._on_new_claim_made(claim_made)
         self.challenge_back_off_timestamp = challenge_back_off_timestamp
         # transaction pending indicates whether a state output (transaction)
         # is pending in the chain network. If the corresponding event has
         # not arrived at the agent's EventProcessor yet, it will prevent
         # sending another transaction
         self.transaction_pending = False
+        self.state = ClaimState.CLAIMER_WINNING
 
-    # Claimer is winning
-    claimer_winning = State("ClaimerWinning", initial=True)
-    # Challenger is winning
-    challenger_winning = State("ChallengerWinning")
-    ignored = State("Ignored")
-    withdrawn = State("Withdrawn")
-
-    challenge = (
-        claimer_winning.to(challenger_winning)
-        | challenger_winning.to(claimer_winning)
-        | ignored.to(ignored)
-    )
-    withdraw = (
-        claimer_winning.to(withdrawn) | challenger_winning.to(withdrawn) | ignored.to(withdrawn)
-    )
-    ignore = claimer_winning.to(ignored) | ignored.to(ignored)
+    @property
+    def key(self) -> ClaimKey:
+        return self.chain_id, self.id
 
     @property
-    def id(self) -> ClaimId:
-        return self._latest_claim_made.claim_id
+    def request_key(self) -> RequestKey:
+        return self.chain_id, self.request_id
 
     @property
-    def request_id(self) -> RequestId:
-        return self._latest_claim_made.request_id
+    def is_claimer_winning(self) -> bool:
+        return self.state is _CLAIMER_WINNING
 
     @property
-    def claimer(self) -> Address:
-        return self._latest_claim_made.claimer
+    def is_challenger_winning(self) -> bool:
+        return self.state is _CHALLENGER_WINNING
 
     @property
-    def challenger(self) -> Address:
-        return self._latest_claim_made.challenger
+    def is_ignored(self) -> bool:
+        return self.state is _IGNORED
 
     @property
-    def termination(self) -> Termination:
-        return self._latest_claim_made.termination
+    def is_withdrawn(self) -> bool:
+        return self.state is _WITHDRAWN
 
     def valid_claim_for_request(self, request: Request) -> bool:
-        claim_event = self._latest_claim_made
-        if claim_event.request_id != request.id:
+        if self.request_key != request.key:
             return False
-        if claim_event.claimer != request.filler:
+        if self.claimer != request.filler:
             return False
-        if claim_event.fill_id != request.fill_id:
+        if self.fill_id != request.fill_id:
             return False
         return True
 
     def get_winning_address(self) -> Address:
-        if self._latest_claim_made.claimer_stake > self._latest_claim_made.challenger_stake:
+        if self.claimer_stake > self.challenger_stake:
             return self.claimer
         return self.challenger
 
     def get_next_challenge_stake(self) -> Wei:
         stake_increase = 1
-        claimer_stake = self._latest_claim_made.claimer_stake
-        challenger_stake = self._latest_claim_made.challenger_stake
+        claimer_stake = self.claimer_stake
+        challenger_stake = self.challenger_stake
 
         if challenger_stake == 0:
             # we challenge with enough stake for L1 resolution
             stake_increase = 10 ** 15
         return Wei(max(claimer_stake, challenger_stake) + stake_increase)
 
-    def on_challenge(self, new_claim_made: ClaimMade) -> None:
+    def challenge(self, new_claim_made: ClaimMade) -> None:
+        self.state = transition("challenge", self.state, _CHALLENGE)
         self._on_new_claim_made(new_claim_made)
+        self.transaction_pending = False
 
-    def on_withdraw(self) -> None:
+    def withdraw(self) -> None:
+        self.state = transition("withdraw", self.state, _WITHDRAW)
         self.transaction_pending = False
 
-    def on_ignore(self, new_claim_made: Optional[ClaimMade] = None) -> None:
+    def ignore(self, new_claim_made: Optional[ClaimMade] = None) -> None:
+        self.state = transition("ignore", self.state, _IGNORE)
         if new_claim_made is None:
-            self._on_new_claim_made(self._latest_claim_made)
-
-    def _on_new_claim_made(self, new_claim_made: ClaimMade) -> None:
-        self._latest_claim_made = new_claim_made
-        self.transaction_pending = False
+            self.transaction_pending = False
+
+    def _on_new_claim_made(self, claim_made: ClaimMade) -> None:
+        self.fill_id = claim_made.fill_id
+        self.claimer = claim_made.claimer
+        self.claimer_stake = claim_made.claimer_stake
+        self.challenger = claim_made.challenger
+        self.challenger_stake = claim_made.challenger_stake
+        self.termination = claim_made.termination
+
+    # Snapshots contain the claim data by slot name, so that they don't depend
+    # on the order of the slots. The state is stored as its value.
+    def __getstate__(self) -> dict[str, Any]:
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["state"] = self.state.value
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.state = ClaimState(state["state"])
 
     def __repr__(self) -> str:
-        state = self.current_state.identifier
-        return f"<Claim id={self.id} state={state} request_id={self.request_id}>"
+        return (
+            f"<Claim chain_id={self.chain_id} id={self.id} state={self.state.value} "
+            f"request_id={self.request_id}>"
+        )
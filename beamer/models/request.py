@@ -1,12 +1,50 @@
+import enum
 from typing import Optional
 
 from eth_typing import ChecksumAddress as Address
-from statemachine import State, StateMachine
 
-from beamer.typing import ChainId, FillId, RequestId, TokenAmount
+from beamer.models.transitions import transition
+from beamer.typing import ChainId, FillId, RequestId, RequestKey, TokenAmount
 
 
-class Request(StateMachine):
+class RequestState(enum.Enum):
+    PENDING = "pending"
+    FILLED = "filled"
+    CLAIMED = "claimed"
+    WITHDRAWN = "withdrawn"
+    IGNORED = "ignored"
+
+
+_PENDING = RequestState.PENDING
+_FILLED = RequestState.FILLED
+_CLAIMED = RequestState.CLAIMED
+_WITHDRAWN = RequestState.WITHDRAWN
+_IGNORED = RequestState.IGNORED
+
+_FILL = {_PENDING: _FILLED, _FILLED: _FILLED, _IGNORED: _FILLED}
+_TRY_TO_FILL = {_PENDING: _FILLED}
+_TRY_TO_CLAIM = {_FILLED: _CLAIMED}
+_WITHDRAW = {_CLAIMED: _WITHDRAWN, _FILLED: _WITHDRAWN, _IGNORED: _WITHDRAWN}
+_IGNORE = {_PENDING: _IGNORED, _FILLED: _IGNORED}
+
+
+class Request:
+    # Without __slots__, each of the many tracked requests would carry a
+    # per-instance dict.
+    __slots__ = (
+        "id",
+        "source_chain_id",
+        "target_chain_id",
+        "source_token_address",
+        "target_token_address",
+        "target_address",
+        "amount",
+        "valid_until",
+        "filler",
+        "fill_id",
+        "state",
+    )
+
     def __init__(
         self,
         request_id: RequestId,
@@ -18,7 +56,6 @@ class Request(StateMachine):
         amount: TokenAmount,
         valid_until: int,
     ) -> None:
-        super().__init__()
         self.id = request_id
         self.source_chain_id = source_chain_id
         self.target_chain_id = target_chain_id
@@ -29,23 +66,75 @@ class Request(StateMachine):
         self.valid_until = valid_until
         self.filler: Optional[Address] = None
         self.fill_id: Optional[int] = None
+        self.state = RequestState.PENDING
+
+    @property
+    def key(self) -> RequestKey:
+        return self.source_chain_id, self.id
+
+    @property
+    def is_pending(self) -> bool:
+        return self.state is _PENDING
+
+    @property
+    def is_filled(self) -> bool:
+        return self.state is _FILLED
+
+    @property
+    def is_claimed(self) -> bool:
+        return self.state is _CLAIMED
+
+    @property
+    def is_withdrawn(self) -> bool:
+        return self.state is _WITHDRAWN
+
+    @property
+    def is_ignored(self) -> bool:
+        return self.state is _IGNORED
+
+    def fill(self, filler: Address, fill_id: FillId) -> None:
+        self.state = transition("fill", self.state, _FILL)
+        self.filler = filler
+        self.fill_id = fill_id
+
+    def try_to_fill(self) -> None:
+        self.state = transition("try_to_fill", self.state, _TRY_TO_FILL)
+
+    def try_to_claim(self) -> None:
+        self.state = transition("try_to_claim", self.state, _TRY_TO_CLAIM)
+
+    def withdraw(self) -> None:
+        self.state = transition("withdraw", self.state, _WITHDRAW)
 
-    pending = State("Pending", initial=True)
-    filled = State("Filled")
-    claimed = State("Claimed")
-    withdrawn = State("Withdrawn")
-    ignored = State("Ignored")
+    def ignore(self) -> None:
+        self.state = transition("ignore", self.state, _IGNORE)
 
-    fill = pending.to(filled) | filled.to(filled) | ignored.to(filled)
-    try_to_fill = pending.to(filled)
-    try_to_claim = filled.to(claimed)
-    withdraw = claimed.to(withdrawn) | filled.to(withdrawn) | ignored.to(withdrawn)
-    ignore = pending.to(ignored) | filled.to(ignored)
+    # Snapshots only contain a tuple of the request data and the state value,
+    # which is smaller than pickling each attribute by name.
+    def __getstate__(self) -> tuple:
+        return (
+            self.id,
+            self.source_chain_id,
+            self.target_chain_id,
+            self.source_token_address,
+            self.target_token_address,
+            self.target_address,
+            self.amount,
+            self.valid_until,
+            self.filler,
+            self.fill_id,
+            self.state.value,
+        )
 
-    def on_fill(self, filler: Address, fill_id: FillId) -> None:
+    def __setstate__(self, state: tuple) -> None:
+        *args, filler, fill_id, state_value = state
+        Request.__init__(self, *args)
         self.filler = filler
         self.fill_id = fill_id
+        self.state = RequestState(state_value)
 
     def __repr__(self) -> str:
-        state = self.current_state.identifier
-        return f"<Request id={self.id} state={state} filler={self.filler}>"
+        return (
+            f"<Request chain_id={self.source_chain_id} id={self.id} "
+            f"state={self.state.value} filler={self.filler}>"
+        )
@@ -0,0 +1,20 @@
+import enum
+from typing import Mapping, TypeVar
+
+S = TypeVar("S", bound=enum.Enum)
+
+
+class TransitionNotAllowed(Exception):
+    def __init__(self, event: str, state: enum.Enum) -> None:
+        super().__init__(f"Can't {event} when in {state.value}.")
+        self.event = event
+        self.state = state
+
+
+def transition(event: str, state: S, transitions: Mapping[S, S]) -> S:
+    """Return the state that event leads to from state, according to the
+    mapping transitions of source to target states."""
+    target = transitions.get(state)
+    if target is None:
+        raise TransitionNotAllowed(event, state)
+    return target
@@ -0,0 +1,39 @@
+import heapq
+from typing import Generic, Optional, TypeVar
+
+C = TypeVar("C")
+K = TypeVar("K")
+
+
+class DeadlineScheduler(Generic[C, K]):
+    """Keeps track of deadlines per clock, e.g. the block time of a chain.
+
+    Keys are returned by pop_due once the clock has reached their deadline.
+    Scheduling a key again with the same deadline has no effect."""
+
+    def __init__(self) -> None:
+        self._heaps: dict[C, list[tuple[int, K]]] = {}
+        self._scheduled: set[tuple[C, int, K]] = set()
+
+    def schedule(self, clock: C, deadline: int, key: K) -> None:
+        if (clock, deadline, key) in self._scheduled:
+            return
+        self._scheduled.add((clock, deadline, key))
+        heapq.heappush(self._heaps.setdefault(clock, []), (deadline, key))
+
+    def pop_due(self, clock: C, now: int) -> list[K]:
+        """Remove and return all keys whose deadline is at or before now."""
+        heap = self._heaps.get(clock)
+        due: list[K] = []
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            self._scheduled.discard((clock, deadline, key))
+            due.append(key)
+        return due
+
+    def next_deadline(self, clock: C) -> Optional[int]:
+        heap = self._heaps.get(clock)
+        return heap[0][0] if heap else None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
@@ -1,17 +1,17 @@
 import os
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict
 
 import structlog
 from eth_typing import ChecksumAddress
 from hexbytes import HexBytes
-from statemachine.exceptions import TransitionNotAllowed
 from web3.constants import ADDRESS_ZERO
 from web3.contract import Contract
-from web3.types import BlockData
 
+from beamer.contracts import RequestManagerParameters
 from beamer.events import (
+    BlockHeader,
     ClaimMade,
     ClaimWithdrawn,
     DepositWithdrawn,
@@ -22,8 +22,11 @@ from beamer.events import (
 )
 from beamer.models.claim import Claim
 from beamer.models.request import Request
+from beamer.models.transitions import TransitionNotAllowed
+from beamer.tokens import AllowanceManager, BalanceCache
 from beamer.tracker import Tracker
-from beamer.typing import ChainId, ClaimId, RequestId
+from beamer.transactions import TransactionManager
+from beamer.typing import ChainId, ClaimKey, RequestId, RequestKey
 from beamer.util import TokenMatchChecker
 
 log = structlog.get_logger(__name__)
@@ -31,14 +34,36 @@ log = structlog.get_logger(__name__)
 
 @dataclass
 class Context:
-    requests: Tracker[RequestId, Request]
-    claims: Tracker[ClaimId, Claim]
-    request_manager: Contract
-    fill_manager: Contract
+    requests: Tracker[RequestKey, Request]
+    claims: Tracker[ClaimKey, Claim]
+    # The contracts of all served chains, by chain id. Requests are taken
+    # from any RequestManager and filled via the FillManager of their
+    # target chain.
+    request_managers: Dict[ChainId, Contract]
+    fill_managers: Dict[ChainId, Contract]
     match_checker: TokenMatchChecker
     fill_wait_time: int
     address: ChecksumAddress
-    latest_blocks: Dict[ChainId, BlockData]
+    latest_blocks: Dict[ChainId, BlockHeader]
+    # The id of the latest RequestCreated event processed, per RequestManager
+    # chain, whether the request is tracked or not. Request ids are assigned
+    # in order, so a request with a lower id that is not tracked never will be.
+    latest_request_ids: Dict[ChainId, RequestId] = field(default_factory=dict)
+    transactions: TransactionManager = field(default_factory=TransactionManager)
+    approval_policy: str = "exact"
+    allowances: Dict[ChainId, AllowanceManager] = field(init=False)
+    balances: Dict[ChainId, BalanceCache] = field(init=False)
+    parameters: Dict[ChainId, RequestManagerParameters] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.allowances = {
+            chain_id: AllowanceManager(self.approval_policy) for chain_id in self.fill_managers
+        }
+        self.balances = {chain_id: BalanceCache() for chain_id in self.fill_managers}
+        self.parameters = {
+            chain_id: RequestManagerParameters(request_manager)
+            for chain_id, request_manager in self.request_managers.items()
+        }
 
 
 def process_event(event: Event, context: Context) -> bool:
@@ -67,15 +92,25 @@ def process_event(event: Event, context: Context) -> bool:
 
 
 def _handle_latest_block_updated(event: LatestBlockUpdatedEvent, context: Context) -> bool:
-    context.latest_blocks[event.chain_id] = event.block_data
+    # Both contract event monitors of a chain report its latest block.
+    latest_block = context.latest_blocks.get(event.chain_id)
+    if latest_block is None or event.block.number >= latest_block.number:
+        context.latest_blocks[event.chain_id] = event.block
     return True
 
 
 def _handle_request_created(event: RequestCreated, context: Context) -> bool:
+    context.latest_request_ids[event.chain_id] = event.request_id
+
+    fill_manager = context.fill_managers.get(event.target_chain_id)
+    if fill_manager is None:
+        log.debug("Request to a chain that is not served", _event=event)
+        return True
+
     # If `BEAMER_ALLOW_UNLISTED_PAIRS` is set, do not check token match file
     if os.environ.get("BEAMER_ALLOW_UNLISTED_PAIRS") is not None:
         # Check if the address points to some contract
-        if context.fill_manager.web3.eth.get_code(event.target_token_address) == HexBytes("0x"):
+        if fill_manager.web3.eth.get_code(event.target_token_address) == HexBytes("0x"):
             log.info(
                 "Request unfillable, invalid token contract",
                 request_event=event,
@@ -104,13 +139,23 @@ def _handle_request_created(event: RequestCreated, context: Context) -> bool:
         amount=event.amount,
         valid_until=event.valid_until,
     )
-    context.requests.add(request.id, request)
+    context.requests.add(request.key, request)
     return True
 
 
 def _handle_request_filled(event: RequestFilled, context: Context) -> bool:
-    request = context.requests.get(event.request_id)
+    if event.source_chain_id not in context.request_managers:
+        # The request will never be seen, there is no need to wait for it.
+        return True
+
+    request = context.requests.get(event.request_key)
     if request is None:
+        latest_request_id = context.latest_request_ids.get(event.source_chain_id)
+        if latest_request_id is not None and event.request_id <= latest_request_id:
+            # The request was ignored or is done with already, e.g. a late fill
+            # of a withdrawn request. Waiting for it would be in vain.
+            log.debug("Fill for untracked request", _event=event)
+            return True
         return False
 
     fill_matches_request = (
@@ -133,9 +178,12 @@ def _handle_request_filled(event: RequestFilled, context: Context) -> bool:
 
 
 def _handle_deposit_withdrawn(event: DepositWithdrawn, context: Context) -> bool:
-    request = context.requests.get(event.request_id)
+    request = context.requests.get(event.request_key)
     if request is None:
-        return False
+        # RequestCreated is emitted by the same contract and thus processed
+        # first, so the request was never tracked.
+        log.debug("Withdrawal for untracked request", _event=event)
+        return True
 
     try:
         request.withdraw()
@@ -147,12 +195,20 @@ def _handle_deposit_withdrawn(event: DepositWithdrawn, context: Context) -> bool
 
 
 def _handle_claim_made(event: ClaimMade, context: Context) -> bool:
-    claim = context.claims.get(event.claim_id)
-    request = context.requests.get(event.request_id)
-
-    # RequestCreated event must arrive before ClaimMade
-    # Additionally, a request should never be dropped before all claims are finalized
-    assert request is not None, "Request object missing upon ClaimMade event"
+    claim = context.claims.get(event.claim_key)
+    request = context.requests.get(event.request_key)
+
+    # Claims are made on the request's source chain, so the request is looked up
+    # by (claim chain id, request id). A request is only dropped once all its
+    # claims are finalized. If RequestCreated has been processed and there is no
+    # request, it was never tracked, e.g. because its target chain is not served,
+    # and its claims are ignored as well. Otherwise, wait for the request.
+    if request is None:
+        latest_request_id = context.latest_request_ids.get(event.chain_id)
+        if latest_request_id is None or event.request_id > latest_request_id:
+            return False
+        log.debug("Claim for untracked request", _event=event)
+        return True
 
     if claim is None:
         challenge_back_off_timestamp = int(time.time())
@@ -162,7 +218,7 @@ def _handle_claim_made(event: ClaimMade, context: Context) -> bool:
         if request.filler is None and event.challenger_stake == 0:
             challenge_back_off_timestamp += context.fill_wait_time
         claim = Claim(event, challenge_back_off_timestamp)
-        context.claims.add(claim.id, claim)
+        context.claims.add(claim.key, claim)
 
         return True
 
@@ -181,12 +237,12 @@ def _handle_claim_made(event: ClaimMade, context: Context) -> bool:
 
 
 def _handle_claim_withdrawn(event: ClaimWithdrawn, context: Context) -> bool:
-    claim = context.claims.get(event.claim_id)
+    claim = context.claims.get(event.claim_key)
 
     # Check if claim exists, it could happen that we ignored the request because of an
     # invalid token pair, and therefore also did not create the claim
     if claim is None:
-        return False
+        return event.request_key not in context.requests
 
     claim.withdraw()
     return True
@@ -0,0 +1,238 @@
+import pickle
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import structlog
+
+from beamer.events import Event, LatestBlockUpdatedEvent, RangeLimits
+from beamer.models.claim import Claim
+from beamer.models.request import Request
+from beamer.typing import BlockNumber, ChainId, ChecksumAddress, RequestId
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    next_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, address)
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    next_block INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_contract ON events (chain_id, address, id);
+CREATE TABLE IF NOT EXISTS snapshot_checkpoints (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    next_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, address)
+);
+CREATE TABLE IF NOT EXISTS snapshot (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS range_limits (
+    endpoint TEXT PRIMARY KEY,
+    blocks_to_fetch INTEGER NOT NULL,
+    max_blocks INTEGER NOT NULL
+);
+"""
+
+# Stored in the user_version pragma. Increment it whenever the pickled events
+# or models change incompatibly, e.g. when a slot is added to Claim. Stores
+# written in another format are cleared on open, except for the range limits,
+# and the agent syncs from scratch.
+_FORMAT_VERSION = 3
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """Marks that all events of a contract emitted before next_block have been fetched."""
+
+    chain_id: ChainId
+    address: ChecksumAddress
+    next_block: BlockNumber
+
+
+@dataclass
+class Snapshot:
+    """The state of the agent context after processing all events up to the
+    given checkpoints. Events that were delivered, but could not be processed
+    yet, are part of the snapshot as well."""
+
+    requests: list[Request]
+    claims: list[Claim]
+    events: list[Event]
+    checkpoints: list[Checkpoint]
+    latest_request_ids: dict[ChainId, RequestId]
+
+
+class EventStore:
+    """Persists decoded contract events together with the next block number
+    that needs to be fetched, per chain and contract. This allows the agent
+    to resume from the last checkpoint after a restart instead of fetching
+    all events since contract deployment.
+
+    The store also remembers the eth_getLogs range limits learned for each
+    RPC endpoint, so that they don't have to be found out again.
+
+    Additionally, the store keeps the latest context snapshot. Events covered
+    by the snapshot are dropped from the store, so that a restart only needs
+    to process events that happened after the snapshot was taken."""
+
+    def __init__(self, path: Path):
+        # The connection is shared by the contract event monitor threads and
+        # the event processor thread, this lock serializes access to it.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._closed = False
+        self._log = structlog.get_logger(type(self).__name__).bind(path=str(path))
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version != _FORMAT_VERSION:
+                self._clear(version)
+
+    def _clear(self, version: int) -> None:
+        (num_checkpoints,) = self._conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()
+        if num_checkpoints > 0:
+            self._log.warning(
+                "Discarding events stored in an old format",
+                version=version,
+                expected_version=_FORMAT_VERSION,
+            )
+            for table in ("checkpoints", "events", "snapshot_checkpoints", "snapshot"):
+                self._conn.execute(f"DELETE FROM {table}")
+        self._conn.execute(f"PRAGMA user_version = {_FORMAT_VERSION}")
+
+    def load(
+        self, chain_id: ChainId, address: ChecksumAddress
+    ) -> tuple[list[Event], Optional[BlockNumber]]:
+        """Return the stored events not covered by the snapshot, in the order they
+        were added, and the next block number to fetch. If nothing was stored yet,
+        the block number is None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT next_block FROM checkpoints WHERE chain_id = ? AND address = ?",
+                (chain_id, address),
+            ).fetchone()
+            if row is None:
+                return [], None
+            rows = self._conn.execute(
+                "SELECT data FROM events WHERE chain_id = ? AND address = ? AND next_block > "
+                "(SELECT COALESCE(MAX(next_block), -1) FROM snapshot_checkpoints "
+                "WHERE chain_id = ? AND address = ?) ORDER BY id",
+                (chain_id, address, chain_id, address),
+            ).fetchall()
+
+        events = [pickle.loads(data) for data, in rows]
+        next_block = BlockNumber(row[0])
+        self._log.info(
+            "Loaded events",
+            chain_id=chain_id,
+            address=address,
+            num_events=len(events),
+            next_block=next_block,
+        )
+        return events, next_block
+
+    def append(self, events: list[Event], checkpoint: Checkpoint) -> None:
+        """Atomically store events and update the checkpoint."""
+        rows = [
+            (checkpoint.chain_id, checkpoint.address, checkpoint.next_block, pickle.dumps(event))
+            for event in events
+            # Block updates are only relevant for the current head and will be
+            # fetched again on startup.
+            if not isinstance(event, LatestBlockUpdatedEvent)
+        ]
+        with self._lock:
+            # A monitor thread may still be running after the agent has been
+            # stopped, see _STOP_TIMEOUT in beamer.chain.
+            if self._closed:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO events (chain_id, address, next_block, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints (chain_id, address, next_block) "
+                    "VALUES (?, ?, ?)",
+                    (checkpoint.chain_id, checkpoint.address, checkpoint.next_block),
+                )
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM snapshot WHERE id = 0").fetchone()
+        if row is None:
+            return None
+        snapshot = pickle.loads(row[0])
+        self._log.info(
+            "Loaded snapshot",
+            num_requests=len(snapshot.requests),
+            num_claims=len(snapshot.claims),
+            num_events=len(snapshot.events),
+        )
+        return snapshot
+
+    def save_snapshot(self, snapshot: Snapshot) -> None:
+        """Atomically replace the snapshot and drop all events it covers."""
+        data = pickle.dumps(snapshot)
+        with self._lock:
+            if self._closed:
+                return
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO snapshot (id, data) VALUES (0, ?)", (data,)
+                )
+                for checkpoint in snapshot.checkpoints:
+                    params = (checkpoint.chain_id, checkpoint.address, checkpoint.next_block)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO snapshot_checkpoints "
+                        "(chain_id, address, next_block) VALUES (?, ?, ?)",
+                        params,
+                    )
+                    self._conn.execute(
+                        "DELETE FROM events "
+                        "WHERE chain_id = ? AND address = ? AND next_block <= ?",
+                        params,
+                    )
+        self._log.debug(
+            "Saved snapshot",
+            num_requests=len(snapshot.requests),
+            num_claims=len(snapshot.claims),
+            num_events=len(snapshot.events),
+        )
+
+    def load_range_limits(self, endpoint: str) -> Optional[RangeLimits]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blocks_to_fetch, max_blocks FROM range_limits WHERE endpoint = ?",
+                (endpoint,),
+            ).fetchone()
+        if row is None:
+            return None
+        return RangeLimits(blocks_to_fetch=row[0], max_blocks=row[1])
+
+    def save_range_limits(self, endpoint: str, range_limits: RangeLimits) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO range_limits (endpoint, blocks_to_fetch, max_blocks) "
+                    "VALUES (?, ?, ?)",
+                    (endpoint, range_limits.blocks_to_fetch, range_limits.max_blocks),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._conn.close()
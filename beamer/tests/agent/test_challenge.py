@@ -248,16 +248,20 @@ def test_challenge_5(request_manager, fill_manager, token, config, honest_claim)
     target_address = accounts[8]
     requester, charlie = accounts[:2]
 
-    proxy_l2b = HTTPProxy(config.l2b_rpc_url)
-    proxy_l2b.delay_rpc({"eth_getLogs": 3})
-    proxy_l2b.start()
-
-    l2b_rpc_url = "http://%s:%s" % (
-        proxy_l2b.server_address[0],
-        proxy_l2b.server_address[1],
+    # Source and target chain are the same chain here, which the agent serves
+    # only once. To delay the fill events of the target chain as if it were
+    # a separate chain, only the FillManager's logs are delayed.
+    def delay_fill_manager_logs(call):
+        return 3 if call["params"][0]["address"] == fill_manager.address else 0
+
+    proxy = HTTPProxy(config.chains[0].rpc_url)
+    proxy.delay_rpc({"eth_getLogs": delay_fill_manager_logs})
+    proxy.start()
+
+    config.chains[0].rpc_url = "http://%s:%s" % (
+        proxy.server_address[0],
+        proxy.server_address[1],
     )
-
-    config.l2b_rpc_url = l2b_rpc_url
     config.fill_wait_time = 6
 
     agent = beamer.agent.Agent(config)
@@ -309,5 +313,5 @@ def test_challenge_5(request_manager, fill_manager, token, config, honest_claim)
         assert claim.challenger == to_checksum_address(agent.address)
 
     agent.stop()
-    proxy_l2b.stop()
+    proxy.stop()
     agent.wait()
@@ -4,11 +4,14 @@ import shutil
 import signal
 
 import brownie
+import click
 import eth_account
 import pytest
 from click.testing import CliRunner
 
-from beamer.cli import main
+from beamer.agent import ChainConfig
+from beamer.cli import _ChainParamType, main
+from beamer.typing import URL
 from beamer.util import TokenMatchChecker
 
 
@@ -55,10 +58,8 @@ def test_cli(config, tmp_path, contracts):
             str(keyfile),
             "--password",
             "",
-            "--l2a-rpc-url",
-            config.l2a_rpc_url,
-            "--l2b-rpc-url",
-            config.l2b_rpc_url,
+            "--rpc-url",
+            config.chains[0].rpc_url,
             "--deployment-dir",
             str(deployment_dir),
             "--token-match-file",
@@ -90,3 +91,29 @@ def test_token_lists_validity(token_chain_ids_validity):
             TokenMatchChecker(tokens)
     else:
         TokenMatchChecker(tokens)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("http://a:8545", ChainConfig(URL("http://a:8545"))),
+        (
+            "http://a:8545,ws=ws://a:8546",
+            ChainConfig(URL("http://a:8545"), ws_url=URL("ws://a:8546")),
+        ),
+        (
+            "http://a:8545,timeout=2.5,ws=ws://a:8546",
+            ChainConfig(URL("http://a:8545"), ws_url=URL("ws://a:8546"), rpc_timeout=2.5),
+        ),
+    ],
+)
+def test_rpc_url_chain_options(value, expected):
+    assert _ChainParamType().convert(value, None, None) == expected
+
+
+@pytest.mark.parametrize(
+    "value", ["http://a:8545,timeout=0", "http://a:8545,timeout=x", "http://a:8545,wss=x"]
+)
+def test_rpc_url_invalid_chain_options(value):
+    with pytest.raises(click.BadParameter):
+        _ChainParamType().convert(value, None, None)
@@ -0,0 +1,12 @@
+from unittest.mock import MagicMock
+
+from beamer.contracts import RequestManagerParameters
+
+
+def test_claim_stake_is_read_once():
+    request_manager = MagicMock()
+    request_manager.functions.claimStake.return_value.call.return_value = 5
+    parameters = RequestManagerParameters(request_manager)
+    for _ in range(3):
+        assert parameters.claim_stake == 5
+    assert request_manager.functions.claimStake.return_value.call.call_count == 1
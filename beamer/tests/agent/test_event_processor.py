@@ -0,0 +1,338 @@
+import dataclasses
+import threading
+
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.types import Wei
+
+import beamer.chain
+from beamer.chain import EventProcessor
+from beamer.events import (
+    BlockHeader,
+    ClaimMade,
+    DepositWithdrawn,
+    LatestBlockUpdatedEvent,
+    RequestFilled,
+)
+from beamer.state_machine import process_event
+from beamer.tests.util import make_checkpoint, make_context, make_request_created
+from beamer.typing import (
+    BlockNumber,
+    ChainId,
+    ClaimId,
+    FillId,
+    RequestId,
+    Termination,
+    TokenAmount,
+)
+
+SOURCE_CHAIN_ID = ChainId(2)
+TARGET_CHAIN_ID = ChainId(3)
+TOKEN = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+FILLER = to_checksum_address("0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512")
+
+
+def _make_context():
+    return make_context(SOURCE_CHAIN_ID, TARGET_CHAIN_ID, TOKEN, FILLER)
+
+
+def _request_created(request_id):
+    return make_request_created(request_id, SOURCE_CHAIN_ID, TARGET_CHAIN_ID, TOKEN)
+
+
+def _request_filled(request_id):
+    return RequestFilled(
+        chain_id=TARGET_CHAIN_ID,
+        request_id=RequestId(request_id),
+        fill_id=FillId(request_id),
+        source_chain_id=SOURCE_CHAIN_ID,
+        target_token_address=TOKEN,
+        filler=FILLER,
+        amount=TokenAmount(123),
+    )
+
+
+def _deposit_withdrawn(request_id):
+    return DepositWithdrawn(
+        chain_id=SOURCE_CHAIN_ID, request_id=RequestId(request_id), receiver=FILLER
+    )
+
+
+def _checkpoint(chain_id):
+    return make_checkpoint(chain_id, TOKEN, 1)
+
+
+def test_out_of_order_events_are_processed_once(monkeypatch):
+    calls = []
+
+    def counting_process_event(event, context):
+        calls.append(event)
+        return process_event(event, context)
+
+    monkeypatch.setattr(beamer.chain, "process_event", counting_process_event)
+
+    num_requests = 100
+    context = _make_context()
+    processor = EventProcessor(context)
+    # All fills arrive before the corresponding requests were created.
+    processor.add_events(
+        [_request_filled(i) for i in range(num_requests)], _checkpoint(TARGET_CHAIN_ID)
+    )
+    processor._process_events()
+    assert len(calls) == num_requests
+
+    processor.add_events(
+        [_request_created(i) for i in range(num_requests)], _checkpoint(SOURCE_CHAIN_ID)
+    )
+    processor._process_events()
+    # Each fill was retried exactly once, right after its request was created.
+    assert len(calls) == 3 * num_requests
+    assert calls[num_requests] == _request_created(0)
+    assert calls[num_requests + 1] == _request_filled(0)
+    assert all(request.is_filled for request in context.requests)
+    assert not processor._parked
+
+
+def test_parked_events_released_on_state_change():
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events(
+        [_request_created(1), _deposit_withdrawn(1)], _checkpoint(SOURCE_CHAIN_ID)
+    )
+    processor._process_events()
+
+    # A pending request cannot be withdrawn, the event waits for a state change.
+    key = "request", (SOURCE_CHAIN_ID, RequestId(1))
+    assert list(processor._parked) == [key]
+    processor._release_changed_entities([key])
+    assert not processor._events
+
+    # Only the given entities are looked at.
+    request = context.requests.get((SOURCE_CHAIN_ID, RequestId(1)))
+    request.fill(filler=FILLER, fill_id=FillId(1))
+    processor._release_changed_entities([("request", (SOURCE_CHAIN_ID, RequestId(2)))])
+    assert not processor._events
+
+    processor._release_changed_entities([key])
+    processor._process_events()
+    assert request.is_withdrawn
+    assert not processor._parked
+
+
+def test_events_for_untracked_requests_are_dropped():
+    context = _make_context()
+    processor = EventProcessor(context)
+    # The fill arrives before the request, which is not tracked because its
+    # target chain is not served.
+    processor.add_events([_request_filled(1)], _checkpoint(TARGET_CHAIN_ID))
+    processor._process_events()
+    assert list(processor._parked) == [("request", (SOURCE_CHAIN_ID, 1))]
+
+    unserved = make_request_created(1, SOURCE_CHAIN_ID, ChainId(99), TOKEN)
+    processor.add_events([unserved, _deposit_withdrawn(1)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    assert not processor._parked
+
+    # A fill of an older request that is not tracked is dropped right away.
+    processor.add_events([_request_created(2), _request_filled(1)], _checkpoint(TARGET_CHAIN_ID))
+    processor._process_events()
+    assert not processor._parked
+    assert list(context.requests) == [context.requests.get((SOURCE_CHAIN_ID, RequestId(2)))]
+
+
+def _claim_made(request_id):
+    return ClaimMade(
+        chain_id=SOURCE_CHAIN_ID,
+        claim_id=ClaimId(request_id),
+        request_id=RequestId(request_id),
+        fill_id=FillId(request_id),
+        claimer=FILLER,
+        claimer_stake=Wei(1),
+        challenger=TOKEN,
+        challenger_stake=Wei(0),
+        termination=Termination(1000),
+    )
+
+
+def test_claims_wait_for_their_request():
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events([_claim_made(1)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    assert list(processor._parked) == [("request", (SOURCE_CHAIN_ID, 1))]
+
+    # A claim for a request that is never tracked is dropped.
+    unserved = make_request_created(1, SOURCE_CHAIN_ID, ChainId(99), TOKEN)
+    processor.add_events([unserved, _claim_made(2)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    assert not context.claims.get((SOURCE_CHAIN_ID, ClaimId(1)))
+    assert list(processor._parked) == [("request", (SOURCE_CHAIN_ID, 2))]
+
+    processor.add_events([_request_created(2)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    assert context.claims.get((SOURCE_CHAIN_ID, ClaimId(2))).is_claimer_winning
+    assert not processor._parked
+
+
+def test_only_dirty_requests_are_processed(monkeypatch):
+    processed = []
+
+    def fill_request(request, _context):
+        processed.append(request.id)
+        # Only even requests can be filled, odd ones stay pending and are retried.
+        if request.id % 2 == 0:
+            request.try_to_fill()
+            return False
+        return True
+
+    monkeypatch.setattr(beamer.chain, "fill_request", fill_request)
+    monkeypatch.setattr(beamer.chain, "claim_request", lambda *_args: False)
+    monkeypatch.setattr(beamer.chain, "_RETRY_DELAY", 0)
+
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events([_request_created(i) for i in range(4)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    assert processor._dirty_requests == {(SOURCE_CHAIN_ID, i) for i in range(4)}
+
+    processor._process_dirty()
+    assert processed == [0, 1, 2, 3]
+    # The requests to retry are marked dirty once the retry delay has passed.
+    assert not processor._dirty_requests
+    processor._mark_due_dirty()
+    assert processor._dirty_requests == {(SOURCE_CHAIN_ID, 1), (SOURCE_CHAIN_ID, 3)}
+
+    processed.clear()
+    processor._process_dirty()
+    assert processed == [1, 3]
+
+
+def test_unaffordable_requests_wait_for_balance(monkeypatch):
+    processed = []
+
+    def fill_request(request, _context):
+        # The agent cannot afford the fill, which is not retried by itself.
+        processed.append(request.id)
+        return False
+
+    monkeypatch.setattr(beamer.chain, "fill_request", fill_request)
+
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events([_request_created(1)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    processor._process_dirty()
+    processor._mark_due_dirty()
+    processor._mark_affordable_dirty()
+    assert not processor._dirty_requests
+
+    # Once the balance of the target token went up, the request is tried again.
+    balances = context.balances[TARGET_CHAIN_ID]
+    balances.spent(TOKEN, 100)
+    balances.settled(TOKEN, 100, success=False)
+    processor._mark_affordable_dirty()
+    assert processor._dirty_requests == {(SOURCE_CHAIN_ID, 1)}
+    processor._process_dirty()
+    assert processed == [1, 1]
+
+
+def _block_updated(chain_id, timestamp):
+    block = BlockHeader(
+        number=BlockNumber(timestamp),
+        hash=HexBytes(b""),
+        parent_hash=HexBytes(b""),
+        timestamp=timestamp,
+        base_fee_per_gas=None,
+    )
+    return LatestBlockUpdatedEvent(chain_id=chain_id, block=block)
+
+
+def test_claim_processed_at_termination(monkeypatch):
+    withdrawn = []
+
+    def withdraw(claim, _context):
+        withdrawn.append(claim.id)
+        claim.transaction_pending = True
+
+    monkeypatch.setattr(beamer.chain, "withdraw", withdraw)
+    monkeypatch.setattr(beamer.chain, "claim_request", lambda *_args: False)
+
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events(
+        [
+            _block_updated(SOURCE_CHAIN_ID, 500),
+            _request_created(1),
+            _request_filled(1),
+            _claim_made(1),
+        ],
+        _checkpoint(SOURCE_CHAIN_ID),
+    )
+    processor._process_events()
+    processor._process_dirty()
+    assert processor._dirty_claims == set()
+
+    # Nothing happens to the claim until the block time reaches its termination.
+    processor.add_events([_block_updated(SOURCE_CHAIN_ID, 999)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    processor._mark_due_dirty()
+    assert processor._dirty_claims == set()
+
+    processor.add_events([_block_updated(SOURCE_CHAIN_ID, 1000)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+    processor._mark_due_dirty()
+    assert processor._dirty_claims == {(SOURCE_CHAIN_ID, 1)}
+    processor._process_dirty()
+    assert withdrawn == [1]
+
+
+def test_add_events_waits_for_processing():
+    context = _make_context()
+    processor = EventProcessor(context, max_queued_events=2)
+    processor.add_events([_request_created(0), _request_created(1)], _checkpoint(SOURCE_CHAIN_ID))
+
+    # The queue is full, further events have to wait until it was processed.
+    thread = threading.Thread(
+        target=processor.add_events, args=([_request_created(2)], _checkpoint(SOURCE_CHAIN_ID))
+    )
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+
+    processor._process_events()
+    thread.join(1)
+    assert not thread.is_alive()
+    processor._process_events()
+    assert len(context.requests) == 3
+
+
+def test_requests_of_different_chains_are_kept_apart():
+    context = _make_context()
+    processor = EventProcessor(context)
+    # Request ids are only unique per RequestManager.
+    reverse_request = dataclasses.replace(
+        _request_created(1), chain_id=TARGET_CHAIN_ID, target_chain_id=SOURCE_CHAIN_ID
+    )
+    unserved_request = dataclasses.replace(_request_created(2), target_chain_id=ChainId(5))
+    processor.add_events([_request_created(1), unserved_request], _checkpoint(SOURCE_CHAIN_ID))
+    processor.add_events([reverse_request, _request_filled(1)], _checkpoint(TARGET_CHAIN_ID))
+    processor._process_events()
+
+    assert len(context.requests) == 2
+    assert context.requests.get((SOURCE_CHAIN_ID, RequestId(1))).is_filled
+    assert context.requests.get((TARGET_CHAIN_ID, RequestId(1))).is_pending
+    assert not processor._parked
+
+
+def test_requests_wait_for_latest_block(monkeypatch):
+    monkeypatch.setattr(beamer.chain, "_RETRY_DELAY", 0)
+    context = _make_context()
+    processor = EventProcessor(context)
+    processor.add_events([_request_created(1)], _checkpoint(SOURCE_CHAIN_ID))
+    processor._process_events()
+
+    # Without the target chain's block time, the request can't be filled yet.
+    processor._process_dirty()
+    assert context.requests.get((SOURCE_CHAIN_ID, RequestId(1))).is_pending
+    processor._mark_due_dirty()
+    assert processor._dirty_requests == {(SOURCE_CHAIN_ID, 1)}
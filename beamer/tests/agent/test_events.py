@@ -0,0 +1,449 @@
+import dataclasses
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, cast
+from unittest.mock import MagicMock
+
+import pytest
+import web3
+from eth_utils import encode_hex, event_abi_to_log_topic, keccak, to_checksum_address
+from hexbytes import HexBytes
+from web3._utils.events import get_event_data
+from web3.middleware import geth_poa_middleware
+from web3.types import LogReceipt, Wei
+
+from beamer.events import (
+    ClaimMade,
+    EventFetcher,
+    LatestBlockUpdatedEvent,
+    RangeLimits,
+    _camel_to_snake,
+    _decode_events,
+    _make_decoders,
+)
+from beamer.typing import BlockNumber, ChainId, ClaimId, FillId, RequestId, Termination
+
+
+def _make_fetcher(block_number, fail_once=(), fail_always=()):
+    contract = MagicMock()
+    contract.abi = []
+    contract.web3.eth.chain_id = 1
+    contract.web3.eth.block_number = block_number
+    contract.web3.eth.get_block.side_effect = lambda number: dict(
+        number=number,
+        hash=number.to_bytes(32, "big"),
+        parentHash=(number - 1).to_bytes(32, "big"),
+        timestamp=1000 + number,
+    )
+    fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+    fetcher._blocks_to_fetch = 10
+
+    lock = threading.Lock()
+    queried = []
+    failed = set()
+
+    def fetch_range(from_block, to_block):
+        time.sleep(random.random() / 100)
+        with lock:
+            queried.append((from_block, to_block))
+            failing = any(from_block <= block <= to_block for block in fail_always)
+            if failing or from_block in fail_once and from_block not in failed:
+                failed.add(from_block)
+                fetcher._handle_failed_range(from_block, to_block, ValueError("too many results"))
+                return None
+        # Use the block numbers as events so that we can check the order.
+        return list(range(from_block, to_block + 1))
+
+    fetcher._fetch_range = fetch_range  # type: ignore
+    return fetcher, queried
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_fetch_in_block_order(num_workers):
+    fetcher, queried = _make_fetcher(block_number=200)
+    events = fetcher.fetch(num_workers)
+
+    assert isinstance(events[-1], LatestBlockUpdatedEvent)
+    assert events[-1].chain_id == ChainId(1)
+    assert events[:-1] == list(range(201))
+    assert fetcher._next_block_number == 201
+    assert len(queried) > 1
+
+
+def test_fetch_reports_head_when_resuming_at_head():
+    fetcher, queried = _make_fetcher(block_number=200)
+    # E.g. after a restart, with no new block since the checkpoint.
+    fetcher._next_block_number = BlockNumber(201)
+    events = fetcher.fetch(4)
+
+    assert len(events) == 1
+    assert isinstance(events[0], LatestBlockUpdatedEvent)
+    assert events[0].block.number == 200
+    assert queried == []
+    # The head is only reported again once it changed.
+    assert fetcher.fetch() == []
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_fetch_streams_events(num_workers):
+    fetcher, _ = _make_fetcher(block_number=100, fail_once=(11,))
+    chunks = []
+
+    def on_events(events):
+        # The fetcher has advanced past the delivered range.
+        assert fetcher.next_block_number == events[-1] + 1
+        chunks.append(events)
+
+    events = fetcher.fetch(num_workers, on_events)
+    assert len(events) == 1
+    assert isinstance(events[0], LatestBlockUpdatedEvent)
+    assert len(chunks) > 1
+    assert [event for chunk in chunks for event in chunk] == list(range(101))
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_fetch_bisects_failed_range(num_workers):
+    fetcher, queried = _make_fetcher(block_number=100, fail_once=(11, 17))
+    events = fetcher.fetch(num_workers)
+
+    assert events[:-1] == list(range(101))
+    # Only the failed ranges were split, the following range has the full size.
+    assert (11, 21) in queried
+    assert (11, 16) in queried
+    assert (17, 19) in queried
+    assert (20, 21) in queried
+    assert (22, 32) in queried
+    assert fetcher.range_limits.blocks_to_fetch == 10
+    assert fetcher._dense_regions == []
+    assert fetcher._next_block_number == 101
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_fetch_gives_up_on_failing_block(num_workers):
+    fetcher, queried = _make_fetcher(block_number=100, fail_always=(50,))
+    events = fetcher.fetch(num_workers)
+
+    # Everything before the failing block is delivered, the rest is left
+    # for the next fetch.
+    assert events[:-1] == list(range(50))
+    assert events[-1].block.number == 49
+    assert fetcher._next_block_number == 50
+    assert queried.count((50, 50)) == EventFetcher._MAX_BLOCK_ATTEMPTS
+    assert fetcher._block_failures == {}
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ("exceed maximum block range: 5000", RangeLimits(blocks_to_fetch=1000, max_blocks=4999)),
+        (
+            "eth_getLogs is limited to a 10,000 blocks range",
+            RangeLimits(blocks_to_fetch=1000, max_blocks=9999),
+        ),
+    ],
+)
+def test_range_limits_learned_from_errors(message, expected):
+    contract = MagicMock()
+    contract.abi = []
+    contract.web3.eth.chain_id = 1
+    fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+    exc = ValueError(dict(code=-32000, message=message))
+    fetcher._handle_failed_range(BlockNumber(0), BlockNumber(1000), exc)
+    assert fetcher.range_limits == expected
+    assert fetcher._dense_regions == []
+
+    # Growing the range never exceeds the learned limit.
+    fetcher._blocks_to_fetch = expected.max_blocks
+    contract.web3.eth.get_logs.return_value = []
+    fetcher._fetch_range(BlockNumber(0), BlockNumber(expected.max_blocks))
+    assert fetcher.range_limits.blocks_to_fetch <= expected.max_blocks
+
+
+@pytest.mark.parametrize(
+    "message, num_blocks",
+    [
+        (
+            "Log response size exceeded. You can make eth_getLogs requests with up to a 2K "
+            "block range and no limit on the response size, or you can request any block "
+            "range with a cap of 10K logs in the response. Based on your parameters, this "
+            "block range should work: [0x64, 0x15d]",
+            249,
+        ),
+        ("query returned more than 10000 results", 500),
+    ],
+)
+def test_dense_region_recorded_on_errors(message, num_blocks):
+    contract = MagicMock()
+    contract.abi = []
+    contract.web3.eth.chain_id = 1
+    fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+    exc = ValueError(dict(code=-32000, message=message))
+    fetcher._handle_failed_range(BlockNumber(100), BlockNumber(1100), exc)
+
+    assert fetcher.range_limits == RangeLimits(blocks_to_fetch=1000, max_blocks=100_000)
+    assert fetcher._dense_regions == [(100, 1100, num_blocks)]
+    assert fetcher._range_end(BlockNumber(100), BlockNumber(5000)) == 100 + num_blocks
+    assert fetcher._range_end(BlockNumber(1101), BlockNumber(5000)) == 2101
+
+
+def _event_abi(name, inputs):
+    return dict(
+        type="event",
+        name=name,
+        anonymous=False,
+        inputs=[dict(name=n, type=t, indexed=False) for n, t in inputs],
+    )
+
+
+def test_topic_filter_only_contains_known_events():
+    contract = MagicMock()
+    contract.abi = [
+        _event_abi("DepositWithdrawn", [("requestId", "uint256"), ("receiver", "address")]),
+        _event_abi("LPAdded", [("lp", "address")]),
+        dict(type="function", name="allowedLPs", inputs=[], outputs=[]),
+    ]
+    contract.web3.eth.chain_id = 1
+    fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+
+    assert len(fetcher._topics) == 1
+    assert fetcher._topics[0] == [encode_hex(keccak(text="DepositWithdrawn(uint256,address)"))]
+
+
+def test_decoder_matches_get_event_data():
+    w3 = web3.Web3()
+    abi = _event_abi(
+        "ClaimMade",
+        [
+            ("requestId", "uint256"),
+            ("claimId", "uint256"),
+            ("claimer", "address"),
+            ("claimerStake", "uint256"),
+            ("challenger", "address"),
+            ("challengerStake", "uint256"),
+            ("termination", "uint256"),
+            ("fillId", "bytes32"),
+        ],
+    )
+    # Make requestId indexed to cover decoding of topics as well.
+    abi["inputs"][0]["indexed"] = True
+    topic = event_abi_to_log_topic(abi)
+    claimer = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+    challenger = to_checksum_address("0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512")
+    fill_id = b"\x01" * 32
+    data = w3.codec.encode_abi(
+        [arg["type"] for arg in abi["inputs"][1:]],
+        [2, claimer, 100, challenger, 101, 1000, fill_id],
+    )
+    log_entry = dict(
+        topics=[HexBytes(topic), HexBytes(w3.codec.encode_single("uint256", 1))],
+        data=encode_hex(data),
+        logIndex=0,
+        transactionIndex=0,
+        transactionHash=HexBytes(b"\x00" * 32),
+        address=claimer,
+        blockHash=HexBytes(b"\x00" * 32),
+        blockNumber=1,
+    )
+
+    decoders = _make_decoders(w3.codec, {topic: abi})
+    events = _decode_events([cast(LogReceipt, log_entry)], ChainId(1), decoders)
+
+    expected = ClaimMade(
+        chain_id=ChainId(1),
+        request_id=RequestId(1),
+        claim_id=ClaimId(2),
+        claimer=claimer,
+        claimer_stake=Wei(100),
+        challenger=challenger,
+        challenger_stake=Wei(101),
+        termination=Termination(1000),
+        # Decoded as bytes32, like the contracts define it.
+        fill_id=cast(FillId, fill_id),
+    )
+    assert events == [expected]
+
+    event_data = get_event_data(w3.codec, abi, cast(LogReceipt, log_entry))
+    assert {_camel_to_snake(k): v for k, v in event_data.args.items()} == {
+        k: v for k, v in dataclasses.asdict(expected).items() if k != "chain_id"
+    }
+
+    # Logs with unknown topics are skipped.
+    log_entry["topics"] = [HexBytes(b"\x00" * 32)]
+    assert _decode_events([cast(LogReceipt, log_entry)], ChainId(1), decoders) == []
+
+
+class _JSONRPCHandler(BaseHTTPRequestHandler):
+    server: "_JSONRPCServer"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.server.num_posts += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response: Any
+        if isinstance(body, list):
+            if not self.server.support_batches:
+                response = dict(jsonrpc="2.0", id=None, error=dict(code=-32600, message="no"))
+            else:
+                response = [self.server.handle(request, batched=True) for request in body]
+        else:
+            response = self.server.handle(body)
+        data = json.dumps(response).encode()
+        if isinstance(body, list) and self.server.malformed_batches:
+            data = data[:-1]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+CONTRACT_ADDRESS = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+
+
+def _latest_block(events):
+    assert isinstance(events[-1], LatestBlockUpdatedEvent)
+    return events[-1].block
+
+
+class _JSONRPCServer(HTTPServer):
+    """A minimal JSON-RPC node stand-in that counts HTTP requests."""
+
+    def __init__(self, support_batches=True):
+        super().__init__(("127.0.0.1", 0), _JSONRPCHandler)
+        self.support_batches = support_batches
+        self.malformed_batches = False
+        # Block number seen by batch requests, None means the same as the others.
+        self.batch_block_number = None
+        self.num_posts = 0
+        self.block_number = 10
+        self.methods = []
+
+    @property
+    def url(self):
+        return "http://%s:%s" % self.server_address
+
+    def handle(self, request, batched=False):
+        method, params = request["method"], request["params"]
+        self.methods.append(method)
+        block_number = self.block_number
+        if batched and self.batch_block_number is not None:
+            block_number = self.batch_block_number
+        result: Any
+        if method == "eth_chainId":
+            result = "0x1"
+        elif method == "eth_blockNumber":
+            result = hex(self.block_number)
+        elif method == "eth_getBlockByNumber":
+            number = block_number if params[0] == "latest" else int(params[0], 16)
+            if number > block_number:
+                return dict(jsonrpc="2.0", id=request["id"], result=None)
+            result = dict(
+                number=hex(number),
+                hash=encode_hex(number.to_bytes(32, "big")),
+                parentHash=encode_hex((number - 1).to_bytes(32, "big")),
+                timestamp=hex(1000 + number),
+                extraData="0x" + "00" * 97,
+            )
+        elif method == "eth_getLogs":
+            result = []
+        else:
+            raise AssertionError(f"unexpected method {method}")
+        return dict(jsonrpc="2.0", id=request["id"], result=result)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+
+
+@pytest.mark.parametrize("support_batches", [True, False])
+def test_fetch_uses_batch_requests_at_head(support_batches):
+    server = _JSONRPCServer(support_batches)
+    server.start()
+    try:
+        w3 = web3.Web3(web3.HTTPProvider(server.url))
+        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=[])
+        fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+
+        # Initial sync: latest block and logs
+        events = fetcher.fetch()
+        assert _latest_block(events).number == 10
+        assert fetcher.next_block_number == 11
+
+        server.block_number = 12
+        server.num_posts = 0
+        server.methods = []
+        events = fetcher.fetch()
+        assert len(events) == 1
+        assert _latest_block(events).number == 12
+        assert _latest_block(events).timestamp == 1012
+        assert fetcher.next_block_number == 13
+        if support_batches:
+            assert server.methods == ["eth_blockNumber", "eth_getBlockByNumber", "eth_getLogs"]
+            assert server.num_posts == 2
+        else:
+            # The first attempt to send a batch request fails.
+            assert server.methods == ["eth_blockNumber", "eth_getLogs", "eth_getBlockByNumber"]
+            assert server.num_posts == 4
+            assert not fetcher._use_batches
+
+        # No new block, nothing to do
+        server.num_posts = 0
+        assert fetcher.fetch() == []
+        assert server.num_posts == 1
+    finally:
+        server.stop()
+
+
+def test_fetch_retries_batch_requests():
+    server = _JSONRPCServer()
+    server.start()
+    try:
+        w3 = web3.Web3(web3.HTTPProvider(server.url))
+        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=[])
+        fetcher = EventFetcher("TestContract", contract, BlockNumber(0))
+        fetcher.fetch()
+
+        # A malformed response falls back to separate requests for this block only.
+        server.malformed_batches = True
+        server.block_number = 12
+        events = fetcher.fetch()
+        assert _latest_block(events).number == 12
+        assert fetcher.next_block_number == 13
+        assert fetcher._use_batches
+
+        # The node answering the batch lags behind, so its logs are not used.
+        server.malformed_batches = False
+        server.batch_block_number = 12
+        server.block_number = 14
+        server.methods = []
+        events = fetcher.fetch()
+        assert _latest_block(events).number == 14
+        assert fetcher.next_block_number == 15
+        assert server.methods == [
+            "eth_blockNumber",
+            "eth_getBlockByNumber",
+            "eth_getLogs",
+            "eth_getLogs",
+            "eth_getBlockByNumber",
+        ]
+
+        # Batches are used again once the node caught up.
+        server.batch_block_number = None
+        server.block_number = 15
+        server.num_posts = 0
+        events = fetcher.fetch()
+        assert _latest_block(events).number == 15
+        assert server.num_posts == 2
+    finally:
+        server.stop()
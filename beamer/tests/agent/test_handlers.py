@@ -4,12 +4,13 @@ from unittest.mock import MagicMock
 
 from eth_typing import BlockNumber
 from eth_utils import to_checksum_address
+from hexbytes import HexBytes
 from web3.contract import Contract
-from web3.types import BlockData, ChecksumAddress, Timestamp, Wei
+from web3.types import ChecksumAddress, Wei
 
 from beamer.agent import Config
 from beamer.chain import Context, claim_request, process_claims, process_requests
-from beamer.events import ClaimMade
+from beamer.events import BlockHeader, ClaimMade
 from beamer.models.claim import Claim
 from beamer.models.request import Request
 from beamer.tracker import Tracker
@@ -17,6 +18,7 @@ from beamer.typing import ChainId, ClaimId, FillId, RequestId, Termination, Toke
 from beamer.util import TokenMatchChecker
 
 SOURCE_CHAIN_ID = ChainId(2)
+TARGET_CHAIN_ID = ChainId(4)
 
 
 class MockEth:
@@ -43,7 +45,7 @@ def make_request(token) -> Request:
     return Request(
         request_id=RequestId(1),
         source_chain_id=SOURCE_CHAIN_ID,
-        target_chain_id=ChainId(4),
+        target_chain_id=TARGET_CHAIN_ID,
         source_token_address=token.address,
         target_token_address=token.address,
         target_address=token.address,
@@ -77,18 +79,19 @@ def make_context(config: Config, request_manager: Contract = None):
 
     return Context(
         requests=Tracker(),
-        claims=Tracker(),
-        request_manager=request_manager,
-        fill_manager=MagicMock(),
+        claims=Tracker(indexes=dict(request_key=lambda claim: claim.request_key)),
+        request_managers={SOURCE_CHAIN_ID: request_manager},
+        fill_managers={TARGET_CHAIN_ID: MagicMock()},
         match_checker=checker,
         fill_wait_time=5,
         address=config.account.address,
         latest_blocks={
-            SOURCE_CHAIN_ID: BlockData(
-                {
-                    "number": BlockNumber(42),
-                    "timestamp": Timestamp(457),
-                }
+            SOURCE_CHAIN_ID: BlockHeader(
+                number=BlockNumber(42),
+                hash=HexBytes(b""),
+                parent_hash=HexBytes(b""),
+                timestamp=457,
+                base_fee_per_gas=None,
             )
         },
     )
@@ -98,7 +101,7 @@ def test_skip_not_self_filled(token, config: Config):
     request = make_request(token)
     context = make_context(config)
 
-    context.requests.add(request.id, request)
+    context.requests.add(request.key, request)
 
     assert request.is_pending  # pylint:disable=no-member
     claim_request(request, context)
@@ -110,7 +113,7 @@ def test_ignore_expired(token, config: Config):
     request.filler = config.account.address
 
     context = make_context(config)
-    context.requests.add(request.id, request)
+    context.requests.add(request.key, request)
 
     assert request.is_pending  # pylint:disable=no-member
     claim_request(request, context)
@@ -119,11 +122,11 @@ def test_ignore_expired(token, config: Config):
 
 def test_request_garbage_collection_without_claim(token, config: Config):
     request = make_request(token)
-    request.fill(config.account.address, b"")
+    request.fill(config.account.address, FillId(0))
     request.withdraw()
 
     context = make_context(config)
-    context.requests.add(request.id, request)
+    context.requests.add(request.key, request)
 
     assert len(context.requests) == 1
     process_requests(context)
@@ -132,14 +135,14 @@ def test_request_garbage_collection_without_claim(token, config: Config):
 
 def test_request_garbage_collection_with_claim(token, config: Config):
     request = make_request(token)
-    request.fill(config.account.address, b"")
+    request.fill(config.account.address, FillId(0))
     request.withdraw()
 
     claim = make_claim(request)
 
     context = make_context(config)
-    context.requests.add(request.id, request)
-    context.claims.add(claim.id, claim)
+    context.requests.add(request.key, request)
+    context.claims.add(claim.key, claim)
 
     assert len(context.requests) == 1
     assert len(context.claims) == 1
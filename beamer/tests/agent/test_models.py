@@ -0,0 +1,84 @@
+import pytest
+from eth_utils import to_checksum_address
+
+from beamer.events import ClaimMade
+from beamer.models.claim import Claim, ClaimState
+from beamer.models.request import Request, RequestState
+from beamer.models.transitions import TransitionNotAllowed
+from beamer.typing import ChainId, ClaimId, FillId, RequestId, Termination, TokenAmount
+
+ADDRESS = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+OTHER_ADDRESS = to_checksum_address("0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512")
+
+
+def _make_request():
+    return Request(
+        request_id=RequestId(1),
+        source_chain_id=ChainId(1),
+        target_chain_id=ChainId(2),
+        source_token_address=ADDRESS,
+        target_token_address=ADDRESS,
+        target_address=ADDRESS,
+        amount=TokenAmount(123),
+        valid_until=456,
+    )
+
+
+def _claim_made(claimer_stake, challenger_stake):
+    return ClaimMade(
+        chain_id=ChainId(1),
+        claim_id=ClaimId(7),
+        request_id=RequestId(1),
+        fill_id=FillId(456),
+        claimer=ADDRESS,
+        claimer_stake=claimer_stake,
+        challenger=OTHER_ADDRESS,
+        challenger_stake=challenger_stake,
+        termination=Termination(1000),
+    )
+
+
+def test_request_transitions():
+    request = _make_request()
+    assert request.is_pending
+    with pytest.raises(TransitionNotAllowed):
+        request.try_to_claim()
+    assert request.is_pending
+
+    request.fill(filler=ADDRESS, fill_id=FillId(456))
+    assert request.state is RequestState.FILLED
+    assert request.filler == ADDRESS
+    with pytest.raises(TransitionNotAllowed):
+        request.try_to_fill()
+
+    request.try_to_claim()
+    request.withdraw()
+    assert request.is_withdrawn
+    with pytest.raises(TransitionNotAllowed):
+        request.ignore()
+
+
+def test_claim_transitions():
+    claim = Claim(_claim_made(100, 0), challenge_back_off_timestamp=0)
+    assert claim.is_claimer_winning
+    assert claim.get_winning_address() == ADDRESS
+
+    claim.transaction_pending = True
+    claim.challenge(_claim_made(100, 200))
+    assert claim.state is ClaimState.CHALLENGER_WINNING
+    assert claim.get_winning_address() == OTHER_ADDRESS
+    assert not claim.transaction_pending
+
+    with pytest.raises(TransitionNotAllowed):
+        claim.ignore()
+
+    claim.withdraw()
+    assert claim.is_withdrawn
+    with pytest.raises(TransitionNotAllowed):
+        claim.challenge(_claim_made(300, 200))
+
+
+def test_models_have_no_instance_dict():
+    claim = Claim(_claim_made(100, 0), challenge_back_off_timestamp=0)
+    assert not hasattr(_make_request(), "__dict__")
+    assert not hasattr(claim, "__dict__")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import threading
+import time
+
+from websockets.server import serve as ws_serve
+
+import beamer.chain
+from beamer.chain import NewHeadsSubscription
+from beamer.tests.util import Sleeper
+from beamer.typing import URL
+
+
+class _NewHeadsServer:
+    """A WebSocket stand-in for a JSON-RPC node that only supports newHeads subscriptions."""
+
+    def __init__(self, response=None):
+        # The reply to eth_subscribe, a successful subscription by default.
+        self._response = response
+        self._loop = asyncio.new_event_loop()
+        self._clients = set()
+        self._started = threading.Event()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self._port}"
+
+    @property
+    def num_clients(self):
+        return len(self._clients)
+
+    async def _handler(self, ws, _path):
+        request = json.loads(await ws.recv())
+        assert request["method"] == "eth_subscribe"
+        assert request["params"] == ["newHeads"]
+        if self._response is not None:
+            await ws.send(self._response)
+            await ws.wait_closed()
+            return
+        await ws.send(json.dumps(dict(jsonrpc="2.0", id=request["id"], result="0x1")))
+        self._clients.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            self._clients.discard(ws)
+
+    async def _notify(self, number):
+        message = dict(
+            jsonrpc="2.0",
+            method="eth_subscription",
+            params=dict(subscription="0x1", result=dict(number=hex(number))),
+        )
+        for ws in list(self._clients):
+            await ws.send(json.dumps(message))
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            ws_serve(self._handler, "127.0.0.1", 0, loop=self._loop)
+        )
+        self._server = server
+        assert server.sockets is not None
+        self._port = server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        server.close()
+        self._loop.run_until_complete(server.wait_closed())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def new_block(self, number):
+        asyncio.run_coroutine_threadsafe(self._notify(number), self._loop).result()
+
+
+def _wait_connected(subscription, connected=True):
+    with Sleeper(5) as sleeper:
+        while subscription.connected != connected:
+            sleeper.sleep(0.05)
+
+
+def test_new_heads_wakes_up_waiter():
+    server = _NewHeadsServer()
+    server.start()
+    subscription = NewHeadsSubscription(server.url)
+    subscription.start()
+    try:
+        _wait_connected(subscription)
+
+        # The subscription is shared by several waiters, all of them are woken up.
+        num_blocks = subscription.num_blocks
+        woken = [threading.Event() for _ in range(2)]
+
+        def waiter(event):
+            subscription.wait(num_blocks)
+            event.set()
+
+        threads = [threading.Thread(target=waiter, args=(event,)) for event in woken]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        assert not any(event.is_set() for event in woken)
+
+        server.new_block(1)
+        assert all(event.wait(1) for event in woken)
+        for thread in threads:
+            thread.join()
+
+        # A block announced before waiting is not missed.
+        num_blocks = subscription.num_blocks
+        server.new_block(2)
+        with Sleeper(5) as sleeper:
+            while subscription.num_blocks == num_blocks:
+                sleeper.sleep(0.05)
+        start = time.monotonic()
+        subscription.wait(num_blocks)
+        assert time.monotonic() - start < 0.5
+    finally:
+        subscription.stop()
+        server.stop()
+
+
+def test_new_heads_falls_back_to_polling(monkeypatch):
+    monkeypatch.setattr(beamer.chain, "_POLL_INTERVAL", 0.1)
+    # Nothing is listening on this port.
+    subscription = NewHeadsSubscription(URL("ws://127.0.0.1:1"))
+    subscription.start()
+    try:
+        assert not subscription.connected
+        start = time.monotonic()
+        subscription.wait(subscription.num_blocks)
+        assert time.monotonic() - start < 1
+    finally:
+        subscription.stop()
+
+
+def test_new_heads_survives_bad_subscribe_response(monkeypatch):
+    monkeypatch.setattr(beamer.chain, "_POLL_INTERVAL", 0.1)
+    for response in ("not json", "[]", json.dumps(dict(jsonrpc="2.0", id=1, error="nope"))):
+        server = _NewHeadsServer(response)
+        server.start()
+        subscription = NewHeadsSubscription(server.url)
+        subscription.start()
+        try:
+            time.sleep(0.2)
+            assert subscription._thread.is_alive()
+            assert not subscription.connected
+            start = time.monotonic()
+            subscription.wait(subscription.num_blocks)
+            assert time.monotonic() - start < 1
+        finally:
+            subscription.stop()
+            server.stop()
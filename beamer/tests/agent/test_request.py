@@ -12,8 +12,17 @@ from beamer.chain import maybe_challenge
 from beamer.events import ClaimMade, RequestFilled
 from beamer.models.claim import Claim
 from beamer.models.request import Request
+from beamer.store import Checkpoint
 from beamer.tests.util import HTTPProxy, Sleeper, Timeout, make_request
-from beamer.typing import ChainId, ClaimId, FillId, RequestId, Termination, TokenAmount
+from beamer.typing import (
+    BlockNumber,
+    ChainId,
+    ClaimId,
+    FillId,
+    RequestId,
+    Termination,
+    TokenAmount,
+)
 
 
 def _get_delay(request_data):
@@ -29,29 +38,20 @@ def _get_delay(request_data):
 def test_read_timeout(config):
     brownie.chain.mine(200)
 
-    proxy_l2a = HTTPProxy(config.l2a_rpc_url)
-    proxy_l2a.delay_rpc({"eth_getLogs": _get_delay})
-    proxy_l2a.start()
+    proxy = HTTPProxy(config.chains[0].rpc_url)
+    proxy.delay_rpc({"eth_getLogs": _get_delay})
+    proxy.start()
 
-    proxy_l2b = HTTPProxy(config.l2b_rpc_url)
-    proxy_l2b.delay_rpc({"eth_getLogs": _get_delay})
-    proxy_l2b.start()
-
-    config.l2a_rpc_url = "http://%s:%s" % (
-        proxy_l2a.server_address[0],
-        proxy_l2a.server_address[1],
-    )
-    config.l2b_rpc_url = "http://%s:%s" % (
-        proxy_l2b.server_address[0],
-        proxy_l2b.server_address[1],
+    config.chains[0].rpc_url = "http://%s:%s" % (
+        proxy.server_address[0],
+        proxy.server_address[1],
     )
 
     agent = Agent(config)
     agent.start()
     time.sleep(60)
     agent.stop()
-    proxy_l2a.stop()
-    proxy_l2b.stop()
+    proxy.stop()
 
 
 # This test delays the processing of eth_sendRawTransaction so that an agent
@@ -61,13 +61,13 @@ def test_read_timeout(config):
 # running and make a clean exit after our call agent.stop().
 def test_read_timeout_send_transaction(request_manager, token, config):
     delay_period = 6
-    proxy_l2a = HTTPProxy(config.l2a_rpc_url)
-    proxy_l2a.delay_rpc({"eth_sendRawTransaction": delay_period})
-    proxy_l2a.start()
+    proxy = HTTPProxy(config.chains[0].rpc_url)
+    proxy.delay_rpc({"eth_sendRawTransaction": delay_period})
+    proxy.start()
 
-    config.l2a_rpc_url = "http://%s:%s" % (
-        proxy_l2a.server_address[0],
-        proxy_l2a.server_address[1],
+    config.chains[0].rpc_url = "http://%s:%s" % (
+        proxy.server_address[0],
+        proxy.server_address[1],
     )
 
     make_request(request_manager, token, accounts[0], accounts[2], 1, validity_period=3600)
@@ -76,7 +76,7 @@ def test_read_timeout_send_transaction(request_manager, token, config):
     agent.start()
     time.sleep(delay_period)
     agent.stop()
-    proxy_l2a.stop()
+    proxy.stop()
 
 
 def test_challenge_own_claim(config, request_manager, token):
@@ -115,10 +115,11 @@ def test_challenge_own_claim(config, request_manager, token):
 def test_fill_and_claim(request_manager, token, agent, allow_unlisted_pairs):
     target_address = accounts[1]
     request_id = make_request(request_manager, token, accounts[0], target_address, 1)
+    request_key = (ChainId(brownie.chain.id), request_id)
 
     try:
         with Sleeper(5) as sleeper:
-            while (request := agent.context.requests.get(request_id)) is None:
+            while (request := agent.context.requests.get(request_key)) is None:
                 sleeper.sleep(0.1)
     except Timeout:
         pass
@@ -149,9 +150,10 @@ def test_fill_and_claim(request_manager, token, agent, allow_unlisted_pairs):
 def test_withdraw(request_manager, token, agent):
     target_address = accounts[1]
     request_id = make_request(request_manager, token, accounts[0], target_address, 1)
+    request_key = (ChainId(brownie.chain.id), request_id)
 
     with Sleeper(10) as sleeper:
-        while (request := agent.context.requests.get(request_id)) is None:
+        while (request := agent.context.requests.get(request_key)) is None:
             sleeper.sleep(0.1)
 
         while not request.is_claimed:
@@ -178,10 +180,11 @@ def test_expired_request_is_ignored(request_manager, token, agent):
         amount,
         validity_period=validity_period,
     )
+    request_key = (ChainId(brownie.chain.id), request_id)
 
     brownie.chain.mine(timedelta=validity_period / 2)
     with Sleeper(1) as sleeper:
-        while (request := agent.context.requests.get(request_id)) is None:
+        while (request := agent.context.requests.get(request_key)) is None:
             sleeper.sleep(0.1)
 
     assert request.is_pending
@@ -211,10 +214,17 @@ def test_agent_ignores_invalid_fill(_, request_manager, token, agent: Agent):
     )
 
     with Sleeper(1) as sleeper:
-        while (request := agent.context.requests.get(request_id)) is None:
+        while (request := agent.context.requests.get((chain_id, request_id))) is None:
             sleeper.sleep(0.1)
 
     event_processor = agent._event_processor
+    # The events are injected rather than fetched. A checkpoint at the
+    # deployment block never claims more than was actually fetched.
+    checkpoint = Checkpoint(
+        chain_id=chain_id,
+        address=agent.context.fill_managers[chain_id].address,
+        next_block=BlockNumber(0),
+    )
 
     # Test wrong amount
     event_processor.add_events(
@@ -228,7 +238,8 @@ def test_agent_ignores_invalid_fill(_, request_manager, token, agent: Agent):
                 filler=filler,
                 amount=amount - 1,
             ),
-        ]
+        ],
+        checkpoint,
     )
     time.sleep(1)
     assert not request.is_filled
@@ -245,7 +256,8 @@ def test_agent_ignores_invalid_fill(_, request_manager, token, agent: Agent):
                 filler=filler,
                 amount=amount,
             ),
-        ]
+        ],
+        checkpoint,
     )
     time.sleep(1)
     assert not request.is_filled
@@ -262,7 +274,8 @@ def test_agent_ignores_invalid_fill(_, request_manager, token, agent: Agent):
                 filler=filler,
                 amount=amount,
             ),
-        ]
+        ],
+        checkpoint,
     )
     time.sleep(1)
     assert not request.is_filled
@@ -279,7 +292,8 @@ def test_agent_ignores_invalid_fill(_, request_manager, token, agent: Agent):
                 filler=filler,
                 amount=amount,
             ),
-        ]
+        ],
+        checkpoint,
     )
     with Sleeper(1) as sleeper:
         while not request.is_filled:
@@ -0,0 +1,21 @@
+from beamer.scheduler import DeadlineScheduler
+
+
+def test_deadlines_are_due_in_order():
+    scheduler: DeadlineScheduler[int, str] = DeadlineScheduler()
+    scheduler.schedule(1, 30, "c")
+    scheduler.schedule(1, 10, "a")
+    scheduler.schedule(1, 20, "b")
+    scheduler.schedule(2, 5, "x")
+    # Scheduling the same deadline again has no effect.
+    scheduler.schedule(1, 10, "a")
+    assert len(scheduler) == 4
+
+    assert scheduler.next_deadline(1) == 10
+    assert scheduler.pop_due(1, 9) == []
+    assert scheduler.pop_due(1, 20) == ["a", "b"]
+    assert scheduler.next_deadline(1) == 30
+    assert scheduler.pop_due(2, 100) == ["x"]
+    assert scheduler.next_deadline(2) is None
+    assert scheduler.pop_due(3, 100) == []
+    assert len(scheduler) == 1
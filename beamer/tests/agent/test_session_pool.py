@@ -0,0 +1,55 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import web3
+
+from beamer.util import SessionPool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Required for keep-alive connections.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        data = json.dumps(dict(jsonrpc="2.0", id=request["id"], result="0x1")).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def test_session_pool_reuses_connections(server):
+    url = "http://%s:%s" % server.server_address
+    sessions = SessionPool(pool_size=2)
+    assert sessions.get(url) is sessions.get(url)
+
+    # Two providers for the same endpoint share the connection.
+    providers = [
+        web3.HTTPProvider(url, request_kwargs=dict(timeout=1), session=sessions.get(url))
+        for _ in range(2)
+    ]
+    for _ in range(5):
+        for provider in providers:
+            assert web3.Web3(provider).eth.chain_id == 1
+
+    stats = sessions.stats()[url]
+    assert stats.num_requests == 10
+    assert stats.num_connections == 1
+    sessions.close()
@@ -0,0 +1,219 @@
+import pickle
+import sqlite3
+
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.types import Wei
+
+from beamer.events import (
+    BlockHeader,
+    ClaimMade,
+    DepositWithdrawn,
+    LatestBlockUpdatedEvent,
+    RangeLimits,
+    RequestFilled,
+)
+from beamer.models.claim import Claim
+from beamer.models.request import Request
+from beamer.store import EventStore, Snapshot
+from beamer.tests.util import make_checkpoint, make_request_created
+from beamer.typing import (
+    BlockNumber,
+    ChainId,
+    ClaimId,
+    FillId,
+    RequestId,
+    Termination,
+    TokenAmount,
+)
+
+ADDRESS = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+OTHER_ADDRESS = to_checksum_address("0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512")
+CHAIN_ID = ChainId(1)
+
+
+def _checkpoint(next_block, address=ADDRESS):
+    return make_checkpoint(CHAIN_ID, address, next_block)
+
+
+def _make_events():
+    return [
+        make_request_created(1, CHAIN_ID, ChainId(2), ADDRESS),
+        DepositWithdrawn(chain_id=CHAIN_ID, request_id=RequestId(1), receiver=ADDRESS),
+    ]
+
+
+def _make_request():
+    return Request(
+        request_id=RequestId(1),
+        source_chain_id=CHAIN_ID,
+        target_chain_id=ChainId(2),
+        source_token_address=ADDRESS,
+        target_token_address=ADDRESS,
+        target_address=ADDRESS,
+        amount=TokenAmount(123),
+        valid_until=456,
+    )
+
+
+def _claim_made(request, challenger_stake=0):
+    return ClaimMade(
+        chain_id=CHAIN_ID,
+        claim_id=ClaimId(7),
+        request_id=request.id,
+        fill_id=FillId(456),
+        claimer=ADDRESS,
+        claimer_stake=Wei(100),
+        challenger=OTHER_ADDRESS,
+        challenger_stake=Wei(challenger_stake),
+        termination=Termination(1000),
+    )
+
+
+def _make_claim(request):
+    return Claim(_claim_made(request), challenge_back_off_timestamp=123)
+
+
+def test_store_resumes_from_checkpoint(tmp_path):
+    store = EventStore(tmp_path / "events.db")
+    assert store.load(CHAIN_ID, ADDRESS) == ([], None)
+
+    events = _make_events()
+    block = BlockHeader(
+        number=BlockNumber(20),
+        hash=HexBytes(b""),
+        parent_hash=HexBytes(b""),
+        timestamp=1000,
+        base_fee_per_gas=None,
+    )
+    block_event = LatestBlockUpdatedEvent(chain_id=CHAIN_ID, block=block)
+    store.append(events[:1], _checkpoint(10))
+    store.append(events[1:] + [block_event], _checkpoint(20))
+    store.close()
+
+    # Events written after close are dropped.
+    store.append(events, _checkpoint(30))
+
+    store = EventStore(tmp_path / "events.db")
+    assert store.load(CHAIN_ID, ADDRESS) == (events, BlockNumber(20))
+    assert store.load(CHAIN_ID, OTHER_ADDRESS) == ([], None)
+    assert store.load(ChainId(2), ADDRESS) == ([], None)
+
+
+def test_models_pickle_state():
+    request = _make_request()
+    request.fill(filler=ADDRESS, fill_id=FillId(456))
+    request.try_to_claim()
+    claim = _make_claim(request)
+    claim.challenge(_claim_made(request, challenger_stake=200))
+    claim.transaction_pending = True
+
+    restored_request = pickle.loads(pickle.dumps(request))
+    assert restored_request.is_claimed
+    assert restored_request.filler == ADDRESS
+    assert restored_request.fill_id == FillId(456)
+    assert restored_request.amount == request.amount
+
+    # Claims are pickled by slot name.
+    state = claim.__getstate__()
+    assert state["challenger_stake"] == 200
+    assert state["state"] == "challenger_winning"
+    restored_claim = pickle.loads(pickle.dumps(claim))
+    assert restored_claim.is_challenger_winning
+    assert restored_claim.transaction_pending
+    assert restored_claim.challenge_back_off_timestamp == 123
+    assert restored_claim.challenger_stake == 200
+    assert restored_claim.valid_claim_for_request(restored_request)
+
+
+def test_snapshot_drops_covered_events(tmp_path):
+    store = EventStore(tmp_path / "events.db")
+    assert store.load_snapshot() is None
+
+    events = _make_events()
+    filled = RequestFilled(
+        chain_id=CHAIN_ID,
+        request_id=RequestId(1),
+        fill_id=FillId(456),
+        source_chain_id=CHAIN_ID,
+        target_token_address=ADDRESS,
+        filler=ADDRESS,
+        amount=TokenAmount(123),
+    )
+    store.append(events[:1], _checkpoint(10))
+    store.append([filled], _checkpoint(15, OTHER_ADDRESS))
+    store.append(events[1:], _checkpoint(20))
+
+    request = _make_request()
+    snapshot = Snapshot(
+        requests=[request],
+        claims=[_make_claim(request)],
+        events=[filled],
+        checkpoints=[_checkpoint(10), _checkpoint(15, OTHER_ADDRESS)],
+        latest_request_ids={CHAIN_ID: request.id},
+    )
+    store.save_snapshot(snapshot)
+    store.close()
+
+    store = EventStore(tmp_path / "events.db")
+    restored = store.load_snapshot()
+    assert restored is not None
+    assert [r.id for r in restored.requests] == [request.id]
+    assert [c.id for c in restored.claims] == [ClaimId(7)]
+    assert restored.events == [filled]
+    assert restored.checkpoints == snapshot.checkpoints
+    assert restored.latest_request_ids == {CHAIN_ID: request.id}
+
+    # Only events after the snapshot are replayed.
+    assert store.load(CHAIN_ID, ADDRESS) == (events[1:], BlockNumber(20))
+    assert store.load(CHAIN_ID, OTHER_ADDRESS) == ([], BlockNumber(15))
+
+
+def test_store_persists_range_limits(tmp_path):
+    path = tmp_path / "events.db"
+    store = EventStore(path)
+    assert store.load_range_limits("http://localhost:8545") is None
+    store.save_range_limits("http://localhost:8545", RangeLimits(1000, 4999))
+    store.save_range_limits("http://localhost:8545", RangeLimits(4999, 4999))
+    store.close()
+
+    store = EventStore(path)
+    assert store.load_range_limits("http://localhost:8545") == RangeLimits(4999, 4999)
+    assert store.load_range_limits("http://localhost:9545") is None
+    store.close()
+
+
+def test_store_discards_old_format(tmp_path):
+    path = tmp_path / "events.db"
+    store = EventStore(path)
+    store.append(_make_events(), _checkpoint(10))
+    request = _make_request()
+    snapshot = Snapshot(
+        requests=[request],
+        claims=[_make_claim(request)],
+        events=[],
+        checkpoints=[_checkpoint(5)],
+        latest_request_ids={},
+    )
+    store.save_snapshot(snapshot)
+    store.save_range_limits("http://localhost:8545", RangeLimits(1000, 4999))
+    store.close()
+
+    # Stores written before the format was versioned have version 0.
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+
+    store = EventStore(path)
+    assert store.load(CHAIN_ID, ADDRESS) == ([], None)
+    assert store.load_snapshot() is None
+    assert store.load_range_limits("http://localhost:8545") == RangeLimits(1000, 4999)
+    store.close()
+
+    # The store is only cleared once.
+    store = EventStore(path)
+    store.append(_make_events(), _checkpoint(20))
+    store.close()
+    store = EventStore(path)
+    assert store.load(CHAIN_ID, ADDRESS) == (_make_events(), BlockNumber(20))
+    store.close()
@@ -0,0 +1,100 @@
+from unittest.mock import MagicMock
+
+from eth_utils import to_checksum_address
+
+from beamer.tokens import AllowanceManager, BalanceCache
+
+OWNER = to_checksum_address("0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512")
+SPENDER = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+
+
+def _make_token(allowance=0, balance=0):
+    token = MagicMock()
+    token.address = "0x9fE46736679d2D9a65F0992F2272dE9f3c7fa6e0"
+    token.functions.allowance.return_value.call.return_value = allowance
+    token.functions.balanceOf.return_value.call.return_value = balance
+    return token
+
+
+def test_unlimited_allowance_is_approved_once():
+    token = _make_token(0)
+    allowances = AllowanceManager("unlimited")
+
+    approvals = 0
+    for _ in range(10):
+        if not allowances.covers(token, OWNER, SPENDER, 100):
+            approvals += 1
+            allowances.approved(token.address, allowances.approval_amount(100))
+        allowances.spent(token.address, 100)
+
+    assert approvals == 1
+    # The allowance is only read from the chain once.
+    assert token.functions.allowance.call_count == 1
+
+
+def test_exact_allowance_is_approved_per_fill():
+    token = _make_token(150)
+    allowances = AllowanceManager("exact")
+
+    # The existing allowance covers the first fill.
+    assert allowances.covers(token, OWNER, SPENDER, 100)
+    allowances.spent(token.address, 100)
+    assert allowances.get(token.address) == 50
+
+    assert not allowances.covers(token, OWNER, SPENDER, 100)
+    assert allowances.approval_amount(100) == 100
+    allowances.approved(token.address, 100)
+    assert allowances.covers(token, OWNER, SPENDER, 100)
+
+
+def test_invalidated_allowance_is_read_again():
+    token = _make_token(2 ** 256 - 1)
+    allowances = AllowanceManager()
+    assert allowances.covers(token, OWNER, SPENDER, 100)
+
+    allowances.invalidate(token.address)
+    token.functions.allowance.return_value.call.return_value = 0
+    assert not allowances.covers(token, OWNER, SPENDER, 100)
+    assert token.functions.allowance.call_count == 2
+
+
+def test_balance_cache_tracks_pending_fills():
+    token = _make_token(balance=300)
+    balances = BalanceCache(refresh_interval=3600)
+    assert balances.available(token, OWNER) == 300
+
+    balances.spent(token.address, 100)
+    balances.spent(token.address, 100)
+    assert balances.available(token, OWNER) == 100
+
+    balances.settled(token.address, 100, success=True)
+    assert not balances.pop_increased()
+    balances.settled(token.address, 100, success=False)
+    assert balances.available(token, OWNER) == 200
+    # A failed fill frees its amount again.
+    assert balances.pop_increased() == {token.address}
+    assert not balances.pop_increased()
+    # The balance is only read from the chain once.
+    assert token.functions.balanceOf.call_count == 1
+
+
+def test_balance_cache_refresh():
+    token = _make_token(balance=100)
+    balances = BalanceCache(refresh_interval=0)
+    assert balances.available(token, OWNER) == 100
+
+    # Someone sent tokens to the owner.
+    token.functions.balanceOf.return_value.call.return_value = 500
+    assert balances.available(token, OWNER) == 100
+    balances.refresh()
+    assert balances.available(token, OWNER) == 500
+    assert balances.pop_increased() == {token.address}
+
+    token.functions.balanceOf.return_value.call.return_value = 400
+    balances.refresh()
+    assert not balances.pop_increased()
+
+    balances = BalanceCache(refresh_interval=3600)
+    balances.available(token, OWNER)
+    balances.refresh()
+    assert token.functions.balanceOf.call_count == 4
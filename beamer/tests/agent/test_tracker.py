@@ -0,0 +1,53 @@
+import threading
+from types import SimpleNamespace
+
+from beamer.tracker import Tracker
+
+
+def test_tracker_maintains_index():
+    tracker: Tracker[int, SimpleNamespace] = Tracker(
+        indexes=dict(request_id=lambda claim: claim.request_id)
+    )
+    claims = [SimpleNamespace(id=i, request_id=i % 2) for i in range(4)]
+    for claim in claims:
+        tracker.add(claim.id, claim)
+
+    assert tracker.find("request_id", 0) == [claims[0], claims[2]]
+    assert tracker.find("request_id", 1) == [claims[1], claims[3]]
+    assert tracker.find("request_id", 2) == []
+
+    tracker.remove(0)
+    assert tracker.find("request_id", 0) == [claims[2]]
+
+    # Replacing a value updates the index.
+    replacement = SimpleNamespace(id=2, request_id=1)
+    tracker.add(2, replacement)
+    assert tracker.find("request_id", 0) == []
+    assert tracker.find("request_id", 1) == [claims[1], claims[3], replacement]
+    assert len(tracker) == 3
+
+
+def test_tracker_iterates_over_snapshot():
+    tracker: Tracker[int, int] = Tracker()
+    for i in range(3):
+        tracker.add(i, i)
+
+    def change():
+        tracker.add(3, 3)
+        tracker.remove(0)
+
+    seen = []
+    for value in tracker:
+        seen.append(value)
+        if value == 0:
+            # Changes from another thread neither wait for the iteration to
+            # finish nor show up in it.
+            thread = threading.Thread(target=change)
+            thread.start()
+            thread.join(timeout=1)
+            assert not thread.is_alive()
+
+    assert seen == [0, 1, 2]
+    assert list(tracker) == [1, 2, 3]
+    # The snapshot is only copied again after a change.
+    assert tracker.snapshot() is tracker.snapshot()
@@ -0,0 +1,196 @@
+import threading
+from typing import Optional
+from unittest.mock import MagicMock, PropertyMock
+
+import requests.exceptions
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.exceptions import TimeExhausted, TransactionNotFound
+from web3.types import TxReceipt
+
+import beamer.transactions
+
+from beamer.transactions import (
+    GasOracle,
+    NonceManager,
+    TransactionManager,
+    construct_gas_oracle_middleware,
+    construct_nonce_middleware,
+    succeeded,
+)
+
+
+def test_receipts_are_resolved_in_background():
+    mined = threading.Event()
+    w3 = MagicMock()
+
+    def get_transaction_receipt(txn_hash):
+        if not mined.is_set():
+            raise TransactionNotFound()
+        return dict(transactionHash=txn_hash, status=1)
+
+    w3.eth.get_transaction_receipt = get_transaction_receipt
+
+    woken = threading.Event()
+    manager = TransactionManager()
+    manager.set_wakeup(woken.set)
+    receipts: list[Optional[TxReceipt]] = []
+    # Submitting does not wait for the receipt.
+    manager.submit(("request", 1), w3, HexBytes(b"\x01"), receipts.append)
+    assert manager.in_flight(("request", 1))
+    assert manager.process_completed() == []
+
+    mined.set()
+    assert woken.wait(5)
+    # Callbacks are only run by process_completed.
+    assert receipts == []
+    assert manager.in_flight(("request", 1))
+    assert manager.process_completed() == [("request", 1)]
+    assert receipts == [dict(transactionHash=HexBytes(b"\x01"), status=1)]
+    assert succeeded(receipts[0])
+    assert not manager.in_flight(("request", 1))
+    manager.shutdown()
+
+
+def test_receipt_failure():
+    w3 = MagicMock()
+    w3.eth.get_transaction_receipt.side_effect = TimeExhausted("not mined")
+    woken = threading.Event()
+    manager = TransactionManager()
+    manager.set_wakeup(woken.set)
+    receipts: list[Optional[TxReceipt]] = []
+    manager.submit(("claim", 1), w3, HexBytes(b"\x01"), receipts.append)
+    assert woken.wait(5)
+    assert manager.process_completed() == [("claim", 1)]
+    assert receipts == [None]
+    assert not succeeded(None)
+    manager.shutdown()
+
+
+def test_shutdown_stops_waiting_for_receipts(monkeypatch):
+    monkeypatch.setattr(beamer.transactions, "_RECEIPT_POLL_INTERVAL", 0.05)
+    polled = threading.Event()
+    w3 = MagicMock()
+
+    def get_transaction_receipt(_txn_hash):
+        polled.set()
+        raise TransactionNotFound()
+
+    w3.eth.get_transaction_receipt = get_transaction_receipt
+    woken = threading.Event()
+    manager = TransactionManager(max_workers=1)
+    manager.set_wakeup(woken.set)
+    manager.submit(("request", 1), w3, HexBytes(b"\x01"), lambda _receipt: None)
+    assert polled.wait(5)
+
+    manager.shutdown()
+    # The worker thread leaves the polling loop without reporting a receipt.
+    for thread in manager._executor._threads:
+        thread.join(1)
+        assert not thread.is_alive()
+    assert not woken.is_set()
+    assert manager.process_completed() == []
+
+
+def test_nonce_middleware_allocates_nonces_locally():
+    address = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+    w3 = MagicMock()
+    w3.eth.get_transaction_count.return_value = 7
+    nonce_manager = NonceManager(w3, address)
+
+    sent = []
+
+    def make_request(_method, params):
+        sent.append(params[0])
+        if params[0].get("fail"):
+            return dict(error=dict(code=-32000, message="nonce too low"))
+        return dict(result="0x01")
+
+    middleware = construct_nonce_middleware(nonce_manager)(make_request, w3)
+    for _ in range(3):
+        middleware("eth_sendTransaction", [{"from": address}])
+    assert [tx["nonce"] for tx in sent] == [7, 8, 9]
+    assert w3.eth.get_transaction_count.call_count == 1
+
+    # Transactions of other accounts or with an explicit nonce are left alone.
+    middleware("eth_sendTransaction", [{"from": "0x0", "value": 1}])
+    middleware("eth_sendTransaction", [{"from": address, "nonce": 1}])
+    assert sent[-2:] == [{"from": "0x0", "value": 1}, {"from": address, "nonce": 1}]
+
+    # After a failure, the nonce is fetched from the node again.
+    middleware("eth_sendTransaction", [{"from": address, "fail": True}])
+    w3.eth.get_transaction_count.return_value = 10
+    middleware("eth_sendTransaction", [{"from": address}])
+    assert sent[-1]["nonce"] == 10
+    assert w3.eth.get_transaction_count.call_count == 2
+
+
+def _block(base_fee=None):
+    block = dict(number=1)
+    if base_fee is not None:
+        block["baseFeePerGas"] = base_fee
+    return block
+
+
+def test_gas_oracle_caches_fees(monkeypatch):
+    w3 = MagicMock()
+    w3.eth.get_block.return_value = _block(base_fee=10)
+    w3.eth.max_priority_fee = 2
+    w3.eth.gas_price = 30
+    gas_oracle = GasOracle(w3, refresh_interval=3600)
+    assert gas_oracle.get_fees() == dict(maxFeePerGas=22, maxPriorityFeePerGas=2)
+
+    # The fees are not refreshed before the refresh interval passed.
+    w3.eth.get_block.return_value = _block()
+    assert gas_oracle.get_fees() == dict(maxFeePerGas=22, maxPriorityFeePerGas=2)
+    assert w3.eth.get_block.call_count == 1
+
+    monkeypatch.setattr(beamer.transactions.time, "monotonic", lambda: 1e9)
+    assert gas_oracle.get_fees() == dict(gasPrice=30)
+    assert w3.eth.get_block.call_count == 2
+
+    sent = []
+
+    def make_request(_method, params):
+        sent.append(params[0])
+        return dict(result="0x01")
+
+    middleware = construct_gas_oracle_middleware(gas_oracle)(make_request, w3)
+    middleware("eth_sendTransaction", [{"to": "0x0"}])
+    middleware("eth_sendTransaction", [{"to": "0x0", "maxFeePerGas": 5}])
+    middleware("eth_call", [{"to": "0x0"}])
+    assert sent == [
+        {"to": "0x0", "gasPrice": 30},
+        {"to": "0x0", "maxFeePerGas": 5},
+        {"to": "0x0"},
+    ]
+    # Only sending a transaction without fees looks at the oracle.
+    assert w3.eth.get_block.call_count == 2
+
+
+def test_gas_oracle_without_priority_fee_support():
+    w3 = MagicMock()
+    w3.eth.get_block.return_value = _block(base_fee=10)
+    type(w3.eth).max_priority_fee = PropertyMock(side_effect=ValueError("method not found"))
+    w3.eth.gas_price = 30
+    gas_oracle = GasOracle(w3)
+    assert gas_oracle.get_fees() == dict(gasPrice=30)
+
+
+def test_gas_oracle_middleware_before_first_refresh():
+    w3 = MagicMock()
+    w3.eth.get_block.return_value = _block()
+    type(w3.eth).gas_price = PropertyMock(side_effect=[requests.exceptions.ReadTimeout(), 30])
+    gas_oracle = GasOracle(w3)
+
+    sent = []
+
+    def make_request(_method, params):
+        sent.append(params[0])
+        return dict(result="0x01")
+
+    # Without cached fees, the current gas price is used rather than web3's
+    # EIP-1559 defaults.
+    middleware = construct_gas_oracle_middleware(gas_oracle)(make_request, w3)
+    middleware("eth_sendTransaction", [{"to": "0x0"}])
+    assert sent == [{"to": "0x0", "gasPrice": 30}]
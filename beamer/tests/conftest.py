@@ -15,7 +15,7 @@ from brownie import (
     accounts,
 )
 
-from beamer.agent import Agent, Config
+from beamer.agent import Agent, ChainConfig, Config
 from beamer.contracts import ContractInfo
 from beamer.tests.util import alloc_accounts
 from beamer.typing import BlockNumber
@@ -153,8 +153,7 @@ def config(request_manager, fill_manager, token):
     token.mint(account.address, 300)
     url = brownie.web3.provider.endpoint_uri
     config = Config(
-        l2a_rpc_url=url,
-        l2b_rpc_url=url,
+        chains=[ChainConfig(url)],
         deployment_info=deployment_info,
         token_match_file=token_match_file,
         account=account,
@@ -5,6 +5,7 @@ import time
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from typing import Any, List, Optional
+from unittest.mock import MagicMock
 
 import brownie
 import requests
@@ -12,7 +13,19 @@ import web3
 from eth_abi.packed import encode_abi_packed
 from eth_utils import keccak, to_canonical_address
 
-from beamer.typing import RequestId
+from beamer.events import RequestCreated
+from beamer.state_machine import Context
+from beamer.store import Checkpoint
+from beamer.tracker import Tracker
+from beamer.typing import (
+    BlockNumber,
+    ChainId,
+    ChecksumAddress,
+    RequestId,
+    Termination,
+    TokenAmount,
+)
+from beamer.util import TokenMatchChecker
 
 
 def _alloc_account():
@@ -63,12 +76,15 @@ class _HTTPRequestHandler(BaseHTTPRequestHandler):
             return
 
         data = json.loads(post_body)
-        method = data["method"]
-        delay = self.server.call_delays.get(method)
-        if delay is not None:
-            if callable(delay):
-                delay = delay(data)
-            time.sleep(delay)
+        # A batch is delayed as long as its most delayed call.
+        calls = data if isinstance(data, list) else [data]
+        delays = []
+        for call in calls:
+            delay = self.server.call_delays.get(call["method"])
+            if delay is not None:
+                delays.append(delay(call) if callable(delay) else delay)
+        if delays:
+            time.sleep(max(delays))
 
         try:
             self.send_response(response.status_code)
@@ -234,3 +250,46 @@ def create_fill_hash(
             ],
         )
     )
+
+
+def make_request_created(
+    request_id: int,
+    chain_id: ChainId,
+    target_chain_id: ChainId,
+    token: ChecksumAddress,
+) -> RequestCreated:
+    return RequestCreated(
+        chain_id=chain_id,
+        request_id=RequestId(request_id),
+        target_chain_id=target_chain_id,
+        source_token_address=token,
+        target_token_address=token,
+        target_address=token,
+        amount=TokenAmount(123),
+        valid_until=Termination(456),
+    )
+
+
+def make_checkpoint(chain_id: ChainId, address: ChecksumAddress, next_block: int) -> Checkpoint:
+    return Checkpoint(chain_id=chain_id, address=address, next_block=BlockNumber(next_block))
+
+
+def make_context(
+    source_chain_id: ChainId,
+    target_chain_id: ChainId,
+    token: ChecksumAddress,
+    address: ChecksumAddress,
+) -> Context:
+    """Return a context for two chains on which the given token matches."""
+    return Context(
+        requests=Tracker(),
+        claims=Tracker(indexes=dict(request_key=lambda claim: claim.request_key)),
+        request_managers={source_chain_id: MagicMock(), target_chain_id: MagicMock()},
+        fill_managers={source_chain_id: MagicMock(), target_chain_id: MagicMock()},
+        match_checker=TokenMatchChecker(
+            [[[str(source_chain_id), token], [str(target_chain_id), token]]]
+        ),
+        fill_wait_time=5,
+        address=address,
+        latest_blocks={},
+    )
@@ -0,0 +1,147 @@
+import threading
+import time
+from typing import Optional
+
+import requests.exceptions
+import structlog
+from eth_typing import ChecksumAddress
+from web3.contract import Contract
+
+APPROVAL_POLICIES = ("exact", "unlimited")
+
+_MAX_UINT256 = 2 ** 256 - 1
+
+# The minimum time between two reconciliations of the cached balances with
+# the chain, in seconds.
+_BALANCE_REFRESH_INTERVAL = 10
+
+
+class AllowanceManager:
+    """Keeps track of the allowances the agent has given a spender, per token,
+    so that an approve transaction is only needed if the allowance does not
+    cover a transfer.
+
+    With the "exact" policy, each transfer is approved separately. With the
+    "unlimited" policy, a token is approved once with the maximum amount.
+
+    The tracked allowances are updated optimistically when approve or
+    transfer transactions are sent. If one of those fails, the allowance
+    should be invalidated, so that it is read from the chain again."""
+
+    def __init__(self, policy: str = "exact") -> None:
+        assert policy in APPROVAL_POLICIES
+        self._policy = policy
+        self._allowances: dict[ChecksumAddress, int] = {}
+
+    def covers(
+        self, token: Contract, owner: ChecksumAddress, spender: ChecksumAddress, amount: int
+    ) -> bool:
+        allowance = self._allowances.get(token.address)
+        if allowance is None:
+            allowance = token.functions.allowance(owner, spender).call()
+            self._allowances[token.address] = allowance
+        return allowance >= amount
+
+    def approval_amount(self, amount: int) -> int:
+        """Return the amount to approve for a transfer of amount."""
+        if self._policy == "exact":
+            return amount
+        return _MAX_UINT256
+
+    def approved(self, token_address: ChecksumAddress, amount: int) -> None:
+        self._allowances[token_address] = amount
+
+    def spent(self, token_address: ChecksumAddress, amount: int) -> None:
+        allowance = self._allowances.get(token_address)
+        if allowance is not None:
+            self._allowances[token_address] = max(0, allowance - amount)
+
+    def invalidate(self, token_address: ChecksumAddress) -> None:
+        self._allowances.pop(token_address, None)
+
+    def get(self, token_address: ChecksumAddress) -> Optional[int]:
+        return self._allowances.get(token_address)
+
+
+class BalanceCache:
+    """Caches the balances of tokens held by an owner, so that checking
+    whether a fill can be afforded does not require an RPC call.
+
+    A token's balance is read from the chain the first time it is needed.
+    Afterwards, it is reconciled with the chain at most every refresh_interval
+    seconds, see refresh, which picks up transfers from and to the owner.
+    Amounts spent by transactions that have not been mined yet are tracked
+    separately and subtracted from the available balance.
+
+    Tokens whose available balance went up are remembered until they are
+    taken with pop_increased, so that fills that could not be afforded
+    before can be tried again."""
+
+    def __init__(self, refresh_interval: float = _BALANCE_REFRESH_INTERVAL) -> None:
+        self._refresh_interval = refresh_interval
+        # This lock protects self._balances and self._pending, since refresh
+        # is called from a different thread than the other methods.
+        self._lock = threading.Lock()
+        self._balances: dict[ChecksumAddress, int] = {}
+        self._pending: dict[ChecksumAddress, int] = {}
+        self._tokens: dict[ChecksumAddress, tuple[Contract, ChecksumAddress]] = {}
+        self._increased: set[ChecksumAddress] = set()
+        self._last_refresh = time.monotonic()
+        self._log = structlog.get_logger(type(self).__name__)
+
+    def available(self, token: Contract, owner: ChecksumAddress) -> int:
+        with self._lock:
+            balance = self._balances.get(token.address)
+            if balance is not None:
+                return balance - self._pending.get(token.address, 0)
+
+        balance = token.functions.balanceOf(owner).call()
+        with self._lock:
+            self._tokens[token.address] = token, owner
+            self._balances.setdefault(token.address, balance)
+            return self._balances[token.address] - self._pending.get(token.address, 0)
+
+    def spent(self, token_address: ChecksumAddress, amount: int) -> None:
+        """Record a transaction spending amount that has been sent."""
+        with self._lock:
+            self._pending[token_address] = self._pending.get(token_address, 0) + amount
+
+    def settled(self, token_address: ChecksumAddress, amount: int, success: bool) -> None:
+        """Record that a transaction spending amount has been mined or failed."""
+        with self._lock:
+            self._pending[token_address] -= amount
+            if self._pending[token_address] == 0:
+                del self._pending[token_address]
+            if not success:
+                self._increased.add(token_address)
+            elif token_address in self._balances:
+                # If the balance was refreshed after the transaction was
+                # mined, this underestimates it until the next refresh.
+                self._balances[token_address] -= amount
+
+    def refresh(self) -> None:
+        """Read the balances from the chain if the refresh interval passed."""
+        now = time.monotonic()
+        if now - self._last_refresh < self._refresh_interval:
+            return
+        self._last_refresh = now
+
+        with self._lock:
+            tokens = list(self._tokens.values())
+        balances = {}
+        for token, owner in tokens:
+            try:
+                balances[token.address] = token.functions.balanceOf(owner).call()
+            except (requests.exceptions.RequestException, ValueError) as exc:
+                self._log.warning("Failed to refresh balance", token=token.address, exc=exc)
+        with self._lock:
+            for token_address, balance in balances.items():
+                if balance > self._balances.get(token_address, balance):
+                    self._increased.add(token_address)
+                self._balances[token_address] = balance
+
+    def pop_increased(self) -> set[ChecksumAddress]:
+        """Return the tokens whose available balance went up since the last call."""
+        with self._lock:
+            increased, self._increased = self._increased, set()
+        return increased
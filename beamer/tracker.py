@@ -1,22 +1,63 @@
 import threading
-from typing import Any, Generator, Generic, Optional, TypeVar
+from typing import Callable, Generic, Hashable, Iterator, Optional, TypeVar
 
 K = TypeVar("K")
 V = TypeVar("V")
 
 
 class Tracker(Generic[K, V]):
-    def __init__(self) -> None:
+    """A thread-safe mapping of keys to values.
+
+    Secondary indexes can be declared by name, each with a function that
+    returns the indexed attribute of a value. The attribute must not change
+    while the value is tracked. Values can then be looked up by that
+    attribute using find.
+
+    Iterating over a tracker iterates over a snapshot of its values, taken
+    when the iteration starts. Values added or removed during the iteration
+    are not seen by it, and adding or removing values never waits for an
+    iteration to finish. The snapshot is only copied again after the tracker
+    has changed."""
+
+    def __init__(self, indexes: Optional[dict[str, Callable[[V], Hashable]]] = None) -> None:
         self._lock = threading.Lock()
         self._map: dict[K, V] = {}
+        self._index_funcs = indexes or {}
+        self._indexes: dict[str, dict[Hashable, dict[K, V]]] = {
+            name: {} for name in self._index_funcs
+        }
+        # The values as of the last change, or None if it has to be copied again.
+        self._snapshot: Optional[tuple[V, ...]] = None
 
     def add(self, key: K, value: V) -> None:
         with self._lock:
+            old = self._map.get(key)
+            if old is not None:
+                self._unindex(key, old)
             self._map[key] = value
+            self._snapshot = None
+            for name, func in self._index_funcs.items():
+                self._indexes[name].setdefault(func(value), {})[key] = value
 
     def remove(self, key: K) -> None:
         with self._lock:
-            del self._map[key]
+            value = self._map.pop(key)
+            self._snapshot = None
+            self._unindex(key, value)
+
+    def _unindex(self, key: K, value: V) -> None:
+        for name, func in self._index_funcs.items():
+            index = self._indexes[name]
+            index_value = func(value)
+            entries = index[index_value]
+            del entries[key]
+            if not entries:
+                del index[index_value]
+
+    def find(self, index: str, value: Hashable) -> list[V]:
+        """Return all values whose attribute indexed as index equals value."""
+        with self._lock:
+            return list(self._indexes[index].get(value, {}).values())
 
     def __contains__(self, key: K) -> bool:
         with self._lock:
@@ -25,17 +66,14 @@ class Tracker(Generic[K, V]):
     def get(self, key: K) -> Optional[V]:
         return self._map.get(key)
 
-    def __iter__(self) -> Any:
-        def locked_iter() -> Generator:
-            with self._lock:
-                it = iter(self._map.values())
-                while True:
-                    try:
-                        yield next(it)
-                    except StopIteration:
-                        return
-
-        return locked_iter()
+    def snapshot(self) -> tuple[V, ...]:
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(self._map.values())
+            return self._snapshot
+
+    def __iter__(self) -> Iterator[V]:
+        return iter(self.snapshot())
 
     def __len__(self) -> int:
         with self._lock:
@@ -0,0 +1,268 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+import requests.exceptions
+import structlog
+import web3
+from eth_typing import ChecksumAddress
+from hexbytes import HexBytes
+from web3.types import Middleware, Nonce, RPCEndpoint, RPCResponse, TxParams, TxReceipt, Wei
+
+# Called with the receipt, or None if the receipt could not be obtained.
+ReceiptCallback = Callable[[Optional[TxReceipt]], None]
+
+# How long to wait for a transaction to be mined, in seconds.
+_RECEIPT_TIMEOUT = 120
+
+# The time between two polls for a receipt, in seconds. This is also the
+# maximum time shutdown has to wait for a receipt poll to notice it.
+_RECEIPT_POLL_INTERVAL = 0.5
+
+_FEE_PARAMS = ("gasPrice", "maxFeePerGas", "maxPriorityFeePerGas")
+
+# The minimum time between two refreshes of the cached fees, in seconds.
+_FEE_REFRESH_INTERVAL = 10
+
+
+def succeeded(receipt: Optional[TxReceipt]) -> bool:
+    return receipt is not None and receipt["status"] == 1
+
+
+class NonceManager:
+    """Hands out the nonces for transactions of an account on one chain.
+
+    The next nonce is fetched from the node once and then incremented locally,
+    so that several transactions can be sent without waiting for each other.
+    After a failed or dropped transaction, the nonce is fetched again."""
+
+    def __init__(self, w3: web3.Web3, address: ChecksumAddress) -> None:
+        self._w3 = w3
+        self._address = address
+        self._lock = threading.Lock()
+        self._next_nonce: Optional[Nonce] = None
+
+    @property
+    def address(self) -> ChecksumAddress:
+        return self._address
+
+    def allocate(self) -> Nonce:
+        with self._lock:
+            if self._next_nonce is None:
+                self._next_nonce = self._w3.eth.get_transaction_count(self._address, "pending")
+            nonce = self._next_nonce
+            self._next_nonce = Nonce(nonce + 1)
+            return nonce
+
+    def resync(self) -> None:
+        with self._lock:
+            self._next_nonce = None
+
+
+def construct_nonce_middleware(nonce_manager: NonceManager) -> Middleware:
+    """Fill in the nonce of transactions sent from the nonce manager's account.
+    This needs to be added after the signing middleware, so that it runs first."""
+
+    def nonce_middleware(
+        make_request: Callable[[RPCEndpoint, Any], Any], _w3: web3.Web3
+    ) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+        def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            if method != "eth_sendTransaction":
+                return make_request(method, params)
+            transaction = params[0]
+            if "nonce" in transaction or transaction.get("from") != nonce_manager.address:
+                return make_request(method, params)
+
+            transaction = dict(transaction, nonce=nonce_manager.allocate())
+            try:
+                response = make_request(method, [transaction])
+            except Exception:
+                # The nonce may or may not have been used.
+                nonce_manager.resync()
+                raise
+            if "error" in response:
+                nonce_manager.resync()
+            return response
+
+        return middleware
+
+    return nonce_middleware
+
+
+class GasOracle:
+    """Caches the fee parameters for transactions on one chain.
+
+    The fees are refreshed on demand, when a transaction is sent, but at most
+    every refresh_interval seconds. If the latest block has a base fee, i.e.
+    the chain supports EIP-1559, maxFeePerGas and maxPriorityFeePerGas are
+    used, otherwise gasPrice."""
+
+    def __init__(self, w3: web3.Web3, refresh_interval: float = _FEE_REFRESH_INTERVAL) -> None:
+        self._w3 = w3
+        self._refresh_interval = refresh_interval
+        # This lock serializes refreshes, so that concurrent transactions
+        # don't fetch the fees more than once.
+        self._lock = threading.Lock()
+        self._fees: Optional[TxParams] = None
+        self._last_refresh: Optional[float] = None
+        self._log = structlog.get_logger(type(self).__name__)
+
+    def get_fees(self) -> Optional[TxParams]:
+        """Return the fee parameters, refreshing them first if the refresh
+        interval passed. Returns None if no refresh has succeeded yet."""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_refresh is None or now - self._last_refresh >= self._refresh_interval:
+                # Failed refreshes are throttled as well.
+                self._last_refresh = now
+                self._refresh()
+            return self._fees
+
+    def _refresh(self) -> None:
+        fees: TxParams
+        try:
+            base_fee = self._w3.eth.get_block("latest").get("baseFeePerGas")
+            if base_fee is None:
+                fees = dict(gasPrice=self._w3.eth.gas_price)
+            else:
+                try:
+                    priority_fee = self._w3.eth.max_priority_fee
+                except ValueError:
+                    # Not all chains with a base fee support eth_maxPriorityFeePerGas.
+                    fees = dict(gasPrice=self._w3.eth.gas_price)
+                else:
+                    # Allow the base fee to double before the transaction
+                    # becomes unincludable.
+                    max_fee = Wei(2 * base_fee + priority_fee)
+                    fees = dict(maxFeePerGas=max_fee, maxPriorityFeePerGas=priority_fee)
+        except (requests.exceptions.RequestException, ValueError) as exc:
+            self._log.warning("Failed to refresh fees", exc=exc)
+            return
+
+        self._fees = fees
+
+
+def construct_gas_oracle_middleware(gas_oracle: GasOracle) -> Middleware:
+    """Fill in the cached fee parameters of transactions that don't specify
+    them, or the current gas price if there are none yet. This needs to be
+    added after the signing middleware."""
+
+    def gas_oracle_middleware(
+        make_request: Callable[[RPCEndpoint, Any], Any], w3: web3.Web3
+    ) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+        def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            if method != "eth_sendTransaction":
+                return make_request(method, params)
+            transaction = params[0]
+            if any(key in transaction for key in _FEE_PARAMS):
+                return make_request(method, params)
+            fees = gas_oracle.get_fees()
+            if fees is None:
+                # No fee refresh has succeeded yet. Web3's defaults would assume
+                # EIP-1559 support, which fails on legacy chains, so use the
+                # current gas price instead.
+                fees = dict(gasPrice=w3.eth.gas_price)
+            return make_request(method, [dict(transaction, **fees)])
+
+        return middleware
+
+    return gas_oracle_middleware
+
+
+class TransactionManager:
+    """Waits for the receipts of sent transactions in the background.
+
+    Each transaction is tracked as in flight under a key, e.g. the request or
+    claim it acts upon, until its receipt arrives. The receipt callbacks are
+    not run by the background threads, but by process_completed, so that the
+    thread owning the agent state can apply them."""
+
+    def __init__(self, max_workers: int = 8) -> None:
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="TransactionManager")
+        # This lock protects self._in_flight and self._completed.
+        self._lock = threading.Lock()
+        self._in_flight: dict[Hashable, int] = {}
+        self._completed: list[tuple[Hashable, ReceiptCallback, Optional[TxReceipt]]] = []
+        self._wakeup: Optional[Callable[[], None]] = None
+        self._nonce_managers: dict[web3.Web3, NonceManager] = {}
+        self._stopped = threading.Event()
+        self._log = structlog.get_logger(type(self).__name__)
+
+    def set_wakeup(self, wakeup: Callable[[], None]) -> None:
+        """Set a function that is called whenever a receipt arrived."""
+        self._wakeup = wakeup
+
+    def add_nonce_manager(self, w3: web3.Web3, nonce_manager: NonceManager) -> None:
+        """Resync the nonce manager if a transaction sent via w3 is not mined."""
+        self._nonce_managers[w3] = nonce_manager
+
+    def submit(
+        self, key: Hashable, w3: web3.Web3, txn_hash: HexBytes, callback: ReceiptCallback
+    ) -> None:
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        future = self._executor.submit(self._wait_for_receipt, w3, txn_hash)
+
+        def done(future: Future) -> None:
+            if self._stopped.is_set():
+                return
+            receipt = None
+            if not future.cancelled():
+                if future.exception() is None:
+                    receipt = future.result()
+                else:
+                    self._log.error(
+                        "Failed to get receipt",
+                        txn_hash=txn_hash.hex(),
+                        exc=future.exception(),
+                    )
+                    # The transaction may have been dropped, leaving a gap.
+                    nonce_manager = self._nonce_managers.get(w3)
+                    if nonce_manager is not None:
+                        nonce_manager.resync()
+            with self._lock:
+                self._completed.append((key, callback, receipt))
+            if self._wakeup is not None:
+                self._wakeup()
+
+        future.add_done_callback(done)
+
+    def _wait_for_receipt(self, w3: web3.Web3, txn_hash: HexBytes) -> Optional[TxReceipt]:
+        # Unlike wait_for_transaction_receipt, this stops polling on shutdown.
+        deadline = time.monotonic() + _RECEIPT_TIMEOUT
+        while not self._stopped.is_set():
+            try:
+                return w3.eth.get_transaction_receipt(txn_hash)
+            except web3.exceptions.TransactionNotFound:
+                pass
+            if time.monotonic() >= deadline:
+                raise web3.exceptions.TimeExhausted(
+                    f"Transaction {txn_hash.hex()} is not in the chain "
+                    f"after {_RECEIPT_TIMEOUT} seconds"
+                )
+            self._stopped.wait(_RECEIPT_POLL_INTERVAL)
+        return None
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._in_flight
+
+    def process_completed(self) -> list[Hashable]:
+        """Run the callbacks of all transactions whose receipt arrived since
+        the last call and return their keys."""
+        with self._lock:
+            completed, self._completed = self._completed, []
+            for key, _, _ in completed:
+                self._in_flight[key] -= 1
+                if self._in_flight[key] == 0:
+                    del self._in_flight[key]
+
+        for _, callback, receipt in completed:
+            callback(receipt)
+        return [key for key, _, _ in completed]
+
+    def shutdown(self) -> None:
+        """Stop waiting for receipts. Their callbacks are not run anymore."""
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
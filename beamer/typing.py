@@ -15,3 +15,8 @@ PrivateKey = NewType("PrivateKey", bytes)
 TokenAmount = NewType("TokenAmount", int)
 URL = NewType("URL", str)
 Termination = NewType("Termination", int)
+
+# Request and claim ids are only unique per RequestManager, so the agent
+# identifies them together with the id of the chain they were created on.
+RequestKey = tuple[ChainId, RequestId]
+ClaimKey = tuple[ChainId, ClaimId]
@@ -1,8 +1,11 @@
 import json
 import logging
 import sys
+import threading
+from dataclasses import dataclass
 from typing import List, TextIO
 
+import requests
 import structlog
 from eth_utils import is_checksum_address, to_checksum_address
 
@@ -41,6 +44,62 @@ def setup_logging(log_level: str, log_json: bool) -> None:
     )
 
 
+@dataclass(frozen=True)
+class ConnectionStats:
+    num_connections: int
+    num_requests: int
+
+
+class SessionPool:
+    """Keeps one HTTP session per RPC endpoint. Each session keeps up to
+    pool_size connections to the endpoint alive, so that the contract event
+    monitors and the transaction path reuse connections instead of opening
+    new ones."""
+
+    def __init__(self, pool_size: int = 10):
+        self._pool_size = pool_size
+        self._sessions: dict[str, requests.Session] = {}
+        self._adapters: dict[str, requests.adapters.HTTPAdapter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(url)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self._pool_size
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[url] = session
+                self._adapters[url] = adapter
+            return session
+
+    def stats(self) -> dict[str, ConnectionStats]:
+        """Return the number of opened connections and sent requests per endpoint."""
+        with self._lock:
+            adapters = dict(self._adapters)
+
+        stats = {}
+        for url, adapter in adapters.items():
+            pools = adapter.poolmanager.pools
+            num_connections = num_requests = 0
+            for key in pools.keys():
+                pool = pools[key]
+                num_connections += pool.num_connections
+                num_requests += pool.num_requests
+            stats[url] = ConnectionStats(num_connections, num_requests)
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+
 _Token = tuple[ChainId, ChecksumAddress]
 
 # dictionary from base chain ID to deployed roll up IDs
@@ -0,0 +1,100 @@
+"""Compare the precompiled event decoders used by EventFetcher with decoding
+logs via web3's generic get_event_data.
+
+Usage: python scripts/benchmark_event_decoding.py [<deployment-dir> [<num-logs>]]
+"""
+import random
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Optional
+
+from eth_abi.codec import ABICodec
+from eth_utils import encode_hex, to_checksum_address
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.events import get_event_data
+from web3.types import ABIEvent, LogReceipt
+
+import beamer.contracts
+from beamer.events import (
+    _EVENT_TYPES,
+    Event,
+    _camel_to_snake,
+    _decode_events,
+    _make_decoders,
+    _make_topics_to_abi,
+)
+from beamer.typing import ChainId
+
+_CHAIN_ID = ChainId(1)
+_ADDRESS = to_checksum_address("0x5FbDB2315678afecb367f032d93F642f64180aa3")
+
+
+def _decode_event_generic(
+    codec: ABICodec, log_entry: LogReceipt, event_abis: dict[bytes, ABIEvent]
+) -> Optional[Event]:
+    # This is how events were decoded before the precompiled decoders.
+    event_abi = event_abis[log_entry["topics"][0]]
+    data = get_event_data(abi_codec=codec, event_abi=event_abi, log_entry=log_entry)
+    kwargs = {_camel_to_snake(name): value for name, value in data.args.items()}
+    kwargs["chain_id"] = _CHAIN_ID
+    return _EVENT_TYPES[data.event](**kwargs)
+
+
+def _make_log(codec: ABICodec, topic: bytes, abi: ABIEvent) -> dict[str, Any]:
+    values = {"address": _ADDRESS, "bytes32": b"\x01" * 32, "uint256": random.randrange(2 ** 64)}
+    topics = [HexBytes(topic)]
+    types, data = [], []
+    for arg in abi["inputs"]:
+        value = values[arg["type"]]
+        if arg["indexed"]:
+            topics.append(HexBytes(codec.encode_single(arg["type"], value)))
+        else:
+            types.append(arg["type"])
+            data.append(value)
+    return dict(
+        topics=topics,
+        data=encode_hex(codec.encode_abi(types, data)),
+        logIndex=0,
+        transactionIndex=0,
+        transactionHash=HexBytes(b"\x00" * 32),
+        address=_ADDRESS,
+        blockHash=HexBytes(b"\x00" * 32),
+        blockNumber=1,
+    )
+
+
+def main() -> None:
+    deployment_dir = Path(sys.argv[1] if len(sys.argv) > 1 else "deployments/rinkeby")
+    num_logs = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+
+    w3 = Web3()
+    codec = w3.codec
+    abi = beamer.contracts.load_contract_abi(deployment_dir, "RequestManager")
+    contract = w3.eth.contract(address=_ADDRESS, abi=abi)
+    event_abis = _make_topics_to_abi(contract)
+    items = list(event_abis.items())
+    logs = [_make_log(codec, *random.choice(items)) for _ in range(num_logs)]
+
+    decoders = _make_decoders(codec, event_abis)
+    generic = [_decode_event_generic(codec, entry, event_abis) for entry in logs]  # type: ignore
+    assert _decode_events(logs, _CHAIN_ID, decoders) == generic  # type: ignore
+
+    def run_generic() -> None:
+        for entry in logs:
+            _decode_event_generic(codec, entry, event_abis)  # type: ignore
+
+    def run_precompiled() -> None:
+        _decode_events(logs, _CHAIN_ID, decoders)  # type: ignore
+
+    generic_time = min(timeit.repeat(run_generic, number=1, repeat=5))
+    precompiled_time = min(timeit.repeat(run_precompiled, number=1, repeat=5))
+    print(f"{num_logs} logs")
+    print(f"get_event_data: {generic_time:.3f}s ({num_logs / generic_time:,.0f} logs/s)")
+    print(f"precompiled:    {precompiled_time:.3f}s ({num_logs / precompiled_time:,.0f} logs/s)")
+    print(f"speedup:        {generic_time / precompiled_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
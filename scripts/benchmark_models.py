@@ -0,0 +1,99 @@
+"""Measure the memory footprint and the transition throughput of tracked
+requests, compared with requests built on python-statemachine.
+
+Usage: python scripts/benchmark_models.py [<num-requests>]
+"""
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from statemachine import State, StateMachine
+
+from beamer.models.request import Request
+from beamer.tracker import Tracker
+from beamer.typing import ChainId, FillId, RequestId, TokenAmount
+
+_ADDRESS = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+_FILLER = "0xe7f1725E7734CE288F8367e1Bb143E90bb3F0512"
+
+
+class _StateMachineRequest(StateMachine):
+    # This is how requests were represented before the slot-based models.
+    pending = State("Pending", initial=True)
+    filled = State("Filled")
+    claimed = State("Claimed")
+    withdrawn = State("Withdrawn")
+    ignored = State("Ignored")
+
+    fill = pending.to(filled) | filled.to(filled) | ignored.to(filled)
+    try_to_fill = pending.to(filled)
+    try_to_claim = filled.to(claimed)
+    withdraw = claimed.to(withdrawn) | filled.to(withdrawn) | ignored.to(withdrawn)
+    ignore = pending.to(ignored) | filled.to(ignored)
+
+    def __init__(self, *args: Any) -> None:
+        super().__init__()
+        (
+            self.id,
+            self.source_chain_id,
+            self.target_chain_id,
+            self.source_token_address,
+            self.target_token_address,
+            self.target_address,
+            self.amount,
+            self.valid_until,
+        ) = args
+        self.filler: Optional[str] = None
+        self.fill_id: Optional[FillId] = None
+
+    def on_fill(self, filler: str, fill_id: FillId) -> None:
+        self.filler = filler
+        self.fill_id = fill_id
+
+
+def _run(name: str, make_request: Callable[..., Any], num_requests: int) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    tracker: Tracker = Tracker()
+    for i in range(num_requests):
+        request = make_request(
+            RequestId(i),
+            ChainId(1),
+            ChainId(2),
+            _ADDRESS,
+            _ADDRESS,
+            _ADDRESS,
+            TokenAmount(i),
+            i,
+        )
+        tracker.add(request.id, request)
+    create_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for request in tracker:
+        request.fill(filler=_FILLER, fill_id=FillId(request.id))
+        request.try_to_claim()
+        request.withdraw()
+    transition_time = time.perf_counter() - start
+
+    print(f"{name}:")
+    print(f"  memory:      {memory / 2**20:,.0f} MiB ({memory / num_requests:,.0f} B/request)")
+    print(f"  create:      {create_time:.2f}s ({num_requests / create_time:,.0f} requests/s)")
+    print(
+        f"  transitions: {transition_time:.2f}s "
+        f"({3 * num_requests / transition_time:,.0f} transitions/s)"
+    )
+
+
+def main() -> None:
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{num_requests} requests")
+    _run("python-statemachine", _StateMachineRequest, num_requests)
+    _run("slots", Request, num_requests)
+
+
+if __name__ == "__main__":
+    main()